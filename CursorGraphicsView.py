@@ -1,22 +1,29 @@
 from math import floor
 
-from PyQt5.QtCore import QPointF
-from PyQt5.QtGui import QColor, QPen
-from PyQt5.QtWidgets import QGraphicsItemGroup, QGraphicsLineItem, QGraphicsView
+from PyQt5.QtCore import QPointF, pyqtSignal
+from PyQt5.QtGui import QColor, QPen, QPixmap
+from PyQt5.QtWidgets import QGraphicsItemGroup, QGraphicsLineItem, QGraphicsScene, QGraphicsView
 import Mimir_lib
 
 ## @brief Slice viewer
+# @details The viewer keeps the same scene, holding one pixmap item and one cursor, which are updated when a new slice
+# is shown.
 class CursorGraphicsView(QGraphicsView):
+    ## Emitted with the number of the viewer when its size changes, as the slices are scaled down to fit in it
+    resized = pyqtSignal(int)
 
     def __init__(self, *__args):
         super().__init__(*__args)
         self.num = -1
         self.scale = (1, 1)
+        self.setScene(QGraphicsScene(0, 0, 0, 0, self))
+        self.pixmap_item = self.scene().addPixmap(QPixmap())
+        self.make_cursor()
 
     ## @brief Mouse commands implementation
     # @param event Event containing the click action
     def mouseReleaseEvent(self, event):
-        if not self.scene(): return
+        if self.pixmap_item.pixmap().isNull(): return
 
         # the event's position is relative to the CursorGraphicsView, but we need it relative to the image
         point = self.mapToScene(event.pos())
@@ -32,6 +39,12 @@ class CursorGraphicsView(QGraphicsView):
             for i, slider in enumerate(self.sliders): slider.setValue(coords[i])
             for viewer in self.viewers: viewer.show_cursor(coords)
 
+    ## @brief Notify the change of size of the viewer
+    # @param event Resize event
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.resized.emit(self.num)
+
     ## @brief 
     def set_num(self, num: int):
         self.num = num
@@ -64,6 +77,18 @@ class CursorGraphicsView(QGraphicsView):
     def get_coords(self, pos):
         return [(s.value() if i == self.num else pos.pop(0)) for i, s in enumerate(self.sliders)]
 
+    ## @brief Show a slice
+    # @param pixmap Pixmap of the slice
+    def set_pixmap(self, pixmap):
+        self.pixmap_item.setPixmap(pixmap)
+        self.scene().setSceneRect(0, 0, pixmap.width(), pixmap.height())
+
+    ## @brief Remove the slice and the cursor
+    def clear_pixmap(self):
+        self.pixmap_item.setPixmap(QPixmap())
+        self.point_cursor.setVisible(False)
+        self.scene().setSceneRect(0, 0, 0, 0)
+
     ## @brief Create the cursor
     def make_cursor(self):
         pen = QPen(QColor(0, 255, 0))
@@ -1,8 +1,9 @@
-from PyQt5.QtWidgets import QFileDialog, QApplication, QMainWindow, QAction, QGraphicsScene, QListView, QTreeWidget, QTreeWidgetItem, QColorDialog, QMessageBox, QToolButton
-from PyQt5.QtGui import QTransform, QStandardItemModel, QStandardItem, QColor
+from PyQt5.QtWidgets import QFileDialog, QApplication, QMainWindow, QAction, QListView, QTreeWidget, QTreeWidgetItem, QColorDialog, QMessageBox, QToolButton, QInputDialog
+from PyQt5.QtGui import QTransform, QStandardItemModel, QStandardItem, QColor, QImage, QPixmap
 from PyQt5.QtCore import QPointF, QStringListModel
 from PyQt5 import QtCore
 import sys
+import threading
 import mimir_ui
 import os
 import Mimir_lib
@@ -11,9 +12,13 @@ import numpy
 from PIL import Image
 from matplotlib import pyplot
 from CursorGraphicsView import CursorGraphicsView
+from SlicePrefetcher import SlicePrefetcher
+from RenderScheduler import RenderScheduler
 
 ## @brief GUI of Mímir
 class Mimir(QMainWindow, mimir_ui.Ui_MainWindow):
+    ## Emitted with (image, minimum, maximum) when the range of values of an image has been computed in the background
+    contrastRangeReady = QtCore.pyqtSignal(object, object, object)
 
     ## @brief Initiate Qt interface and variables
     def __init__(self, parent=None):
@@ -32,6 +37,15 @@ class Mimir(QMainWindow, mimir_ui.Ui_MainWindow):
         self.maskMode = False
         self.currentMaskIndex = -1
         self.current_coords = [0, 0, 0]
+        self.prefetcher = SlicePrefetcher()
+        self.scheduler = RenderScheduler(self)
+        # get_slice arguments of the last slice asked by each viewer
+        self.requested_slices = {}
+        # versions of the points and masks on the last slice asked by each viewer
+        self.requested_versions = {}
+        # the render times are measured, to show the latency in the status bar
+        self.profiler = Mimir_lib.enable_profiling()
+        self.latencyTimer = QtCore.QTimer(self)
 
         # Interface initialization
         self.setupUi(self)
@@ -60,10 +74,12 @@ class Mimir(QMainWindow, mimir_ui.Ui_MainWindow):
         self.actionDelete_point.triggered.connect(lambda: self.delete_point())
         # ------ Mask menu
         self.actionNew_mask.triggered.connect(lambda: self.newMask())
+        self.actionNew_3D_mask.triggered.connect(lambda: self.newMask3D())
         self.actionDelete_mask.triggered.connect(lambda: self.delete_mask())
         self.actionSet_color.triggered.connect(lambda: self.setMaskColor())
         self.actionSave_to_NifTI.triggered.connect(lambda: self.saveMaskToNifti())
         self.actionSave_all_to_NifTI.triggered.connect(lambda: self.saveAllMasksToNifti())
+        self.actionSave_all_to_NifTI_labels.triggered.connect(lambda: self.saveMasksToLabels())
         # ------ Screenshot menu
         self.actionSave_current_axial_slice.triggered.connect(lambda: self.saveSlice(2))
         self.actionSave_current_sagittal_slice.triggered.connect(lambda: self.saveSlice(0))
@@ -71,9 +87,13 @@ class Mimir(QMainWindow, mimir_ui.Ui_MainWindow):
         # ------ Sliders
         for i in range(3):
             self.slice_sliders[i].valueChanged.connect(lambda value, i=i: self.drawViewer(self.slice_viewers[i], i, self.slice_sliders[i].value()))
+            self.slice_sliders[i].valueChanged.connect(lambda value, i=i: self.prefetch(i, value))
         self.cycle_slider.valueChanged.connect(self.drawAllViewers)
+        self.cycle_slider.valueChanged.connect(lambda value: self.prefetch(3, value))
         self.max_contrast_slider.valueChanged.connect(self.drawAllViewers)
         self.min_contrast_slider.valueChanged.connect(self.drawAllViewers)
+        self.autoContrastBt.clicked.connect(lambda: self.autoContrast())
+        self.contrastRangeReady.connect(self.updateContrastRange)
         # ------ Colormap list
         colormaps = pyplot.colormaps()
         colormaps.insert(0, "")
@@ -90,12 +110,17 @@ class Mimir(QMainWindow, mimir_ui.Ui_MainWindow):
         self.saveMaskNiftiBt.clicked.connect(lambda: self.saveMaskToNifti())
         self.saveAllMasksNiftiBt.clicked.connect(lambda: self.saveAllMasksToNifti())
         self.masks_list.itemDoubleClicked.connect(lambda: self.goToMask())
+        # ------ Rendered slices
+        self.scheduler.rendered.connect(self.showSlice)
+        self.latencyTimer.timeout.connect(self.showLatency)
+        self.latencyTimer.start(500)
         # --- Slice viewers
         for i, viewer in enumerate(self.slice_viewers):
             viewer.set_num(i)
             viewer.set_viewers(self.slice_viewers)
             viewer.set_sliders(self.slice_sliders)
             viewer.set_cycle_slider(self.cycle_slider)
+            viewer.resized.connect(lambda i: self.drawViewer(self.slice_viewers[i], i, self.slice_sliders[i].value()) if self.image_file else None)
         # Set most of UI to "not enabled"
         self.enableUi(False)
         self.enableViewers(False)
@@ -127,6 +152,7 @@ class Mimir(QMainWindow, mimir_ui.Ui_MainWindow):
         self.cycle_slider.setEnabled(state)
         self.max_contrast_slider.setEnabled(state)
         self.min_contrast_slider.setEnabled(state)
+        self.autoContrastBt.setEnabled(state)
         # --- Colormaps list
         self.comboBox.setEnabled(state)
         # --- Tabs (Main, Points and Masks)
@@ -142,17 +168,23 @@ class Mimir(QMainWindow, mimir_ui.Ui_MainWindow):
     def openFile(self):
         image_path = QFileDialog.getOpenFileName(parent=self, directory=self.lastUsedPath, filter='*.nii *.nii.gz')
         if not os.path.isfile(image_path[0]): return
-        self.image_file = Mimir_lib.Fd_data(image_path[0])
+        # uncompressed files are memory-mapped, so only the displayed slices need to be read
+        self.image_file = Mimir_lib.Fd_data(image_path[0], lazy=not image_path[0].endswith('.gz'))
+        self.image_file.enable_cache()
+        # the slices larger than the viewers are read from the downsampled copies of the image saved by Mimir_cli.py
+        # --pyramid: building them would read the whole image while a slice is waited for
+        self.image_file.enable_pyramid(build=False)
+        self.prefetcher.set_image_file(self.image_file)
+        self.scheduler.set_image_file(self.image_file)
         self.lastUsedPath = os.path.dirname(image_path[0])
         self.filename = os.path.basename(image_path[0])
         self.filename = os.path.splitext(self.filename)[0]
         
-        self.max_contrast_slider.setMaximum(self.image_file.contrast_max)
-        self.max_contrast_slider.setMinimum(self.image_file.contrast_min)
-        self.max_contrast_slider.setValue(self.image_file.contrast_max)
-        self.min_contrast_slider.setMaximum(self.image_file.contrast_max)
-        self.min_contrast_slider.setMinimum(self.image_file.contrast_min)
-        self.min_contrast_slider.setValue(self.image_file.contrast_min)
+        # the range of values of a lazy image would read the whole file: the sliders start from an estimate, and
+        # follow the range once it has been computed in the background
+        self.setContrastRange(*self.image_file.get_contrast_estimate(), reset=True)
+        if not self.image_file.has_contrast_range():
+            threading.Thread(target=self.computeContrastRange, args=(self.image_file,), daemon=True).start()
 
         if len(self.image_file.shape) == 4:
             self.cycle_slider.setMaximum(self.image_file.shape[3] - 1)
@@ -175,10 +207,45 @@ class Mimir(QMainWindow, mimir_ui.Ui_MainWindow):
         self.updatePointsList()
         self.updateMasksList()
 
+    ## @brief Set the range of the contrast sliders
+    # @details The sliders are moved to the ends of the range if reset is true, or if they were at the ends of the
+    # previous range
+    # @param minimum Minimum intensity
+    # @param maximum Maximum intensity
+    # @param reset If true, the contrast is reset to the whole range
+    def setContrastRange(self, minimum, maximum, reset=False):
+        full = reset or (self.min_contrast_slider.value() == self.min_contrast_slider.minimum() and self.max_contrast_slider.value() == self.max_contrast_slider.maximum())
+        minimum, maximum = int(numpy.floor(minimum)), int(numpy.ceil(maximum))
+        for slider in (self.min_contrast_slider, self.max_contrast_slider):
+            slider.setMinimum(minimum)
+            slider.setMaximum(maximum)
+        if full:
+            self.max_contrast_slider.setValue(maximum)
+            self.min_contrast_slider.setValue(minimum)
+
+    ## @brief Compute the range of values of an image
+    # @details Run on a background thread, the range is given to the UI thread by the contrastRangeReady signal
+    # @param image_file Image (Fd_data)
+    def computeContrastRange(self, image_file):
+        try:
+            self.contrastRangeReady.emit(image_file, image_file.contrast_min, image_file.contrast_max)
+        except Exception as e:
+            print("Contrast range failed: " + str(e))
+
+    ## @brief Set the contrast sliders to the range of values computed for an image
+    # @details Ignored if another image has been opened since
+    def updateContrastRange(self, image_file, minimum, maximum):
+        if image_file is self.image_file:
+            self.setContrastRange(minimum, maximum)
+
     ## @brief Close image file
     # @details Close image file then disable most of UI elements and clear viewers.
     def closeFile(self):
         self.image_file = None
+        self.prefetcher.set_image_file(None)
+        self.scheduler.set_image_file(None)
+        self.requested_slices.clear()
+        self.requested_versions.clear()
         self.enableUi(False)
         self.enableViewers(False)
         self.clearViewers()
@@ -193,7 +260,9 @@ class Mimir(QMainWindow, mimir_ui.Ui_MainWindow):
     def saveSlice(self, num_type: int):
         save_path = QFileDialog.getSaveFileName(parent=self, directory=self.lastUsedPath+'/'+self.filename, filter='*.png')
         if save_path[0] == '': return
-        Mimir_lib.save_slice(self.slices[num_type], save_path[0])
+        # the slice is saved at full size, even if it is shown scaled down
+        array, scale = self.image_file.get_slice_array(*self.requested_slices[num_type][:6])
+        Mimir_lib.save_slice(Mimir_lib.slice_to_image(array), save_path[0])
 
     ## @brief Draw all viewers
     # @details Draw all viewers according to the current coordinates.
@@ -201,8 +270,17 @@ class Mimir(QMainWindow, mimir_ui.Ui_MainWindow):
         for i in range(3):
             self.drawViewer(self.slice_viewers[i], i, self.slice_sliders[i].value())
 
+    ## @brief Draw the viewers whose slice changed
+    # @details Only the viewers showing a slice on which points or masks have been modified since it was drawn are
+    # drawn again.
+    def drawChangedViewers(self):
+        for i in range(3):
+            if self.image_file.get_slice_version(self.cycle, i, self.slice_sliders[i].value()) != self.requested_versions.get(i):
+                self.drawViewer(self.slice_viewers[i], i, self.slice_sliders[i].value())
+
     ## @brief Draw one viewer
-    # @details Draw one viewer according to the current coordinates.
+    # @details Draw one viewer according to the current coordinates. The slice is shown at once if it is already rendered,
+    # otherwise it is rendered in background and shown by showSlice.
     # @param viewer Viewer object to draw with
     # @param num_type 0:sagittal view, 1: coronal view, 2: axial view
     # @param num_slice Index of slice to draw.
@@ -223,19 +301,74 @@ class Mimir(QMainWindow, mimir_ui.Ui_MainWindow):
         else:
             contrast_max_percent = 0
         self.contrast_nb_label.setText(str(contrast_min_percent) + "% | " + str(contrast_max_percent) + "%")
-        self.slices[num_type], scale = self.image_file.get_slice(self.cycle, num_type, num_slice, self.contrast_min, self.contrast_max, self.color_map)
-        pixmap = self.slices[num_type].toqpixmap()
-        scene = QGraphicsScene(0, 0, pixmap.width(), pixmap.height())
-        scene.addPixmap(pixmap)
-        viewer.setScene(scene)
+        args = self.getSliceArgs(self.cycle, num_type, num_slice)
+        self.requested_slices[num_type] = args
+        self.requested_versions[num_type] = self.image_file.get_slice_version(self.cycle, num_type, num_slice)
+        cached = self.image_file.get_cached_slice_array(*args)
+        if cached:
+            self.scheduler.cancel(num_type)
+            self.showSlice(num_type, args, *cached)
+        else:
+            self.scheduler.request(num_type, args)
+
+    ## @brief Get the get_slice_array arguments of a slice shown in a viewer
+    # @details The slice is scaled down to fit in the viewer if it is larger
+    # @param cycle Cycle index
+    # @param num_type 0:sagittal view, 1: coronal view, 2: axial view
+    # @param num_slice Index of the slice
+    def getSliceArgs(self, cycle: int, num_type: int, num_slice: int):
+        viewport = self.slice_viewers[num_type].viewport()
+        max_size = max(1, min(viewport.width(), viewport.height()))
+        return (cycle, num_type, num_slice, self.contrast_min, self.contrast_max, self.color_map, 'nearest', True, max_size)
+
+    ## @brief Show a rendered slice in its viewer
+    # @details Slices which are not the last asked by the viewer are ignored. The pixmap is built directly from the
+    # rendered RGBA array.
+    # @param num_type 0:sagittal view, 1: coronal view, 2: axial view
+    # @param args get_slice_array arguments of the slice
+    # @param array RGBA array of the slice
+    # @param scale Scale of the image
+    def showSlice(self, num_type: int, args, array, scale):
+        if not self.image_file or self.requested_slices.get(num_type) != args: return
+        viewer = self.slice_viewers[num_type]
+        self.slices[num_type] = array
+        # the QImage only wraps the array, which is kept alive in self.slices; QPixmap.fromImage makes the copy
+        image = QImage(array.data, array.shape[1], array.shape[0], array.strides[0], QImage.Format_RGBA8888)
         viewer.set_scale(scale)
-        viewer.make_cursor()
-        #viewer.show_cursor()
+        viewer.set_pixmap(QPixmap.fromImage(image))
+
+    ## @brief Show the render latency in the status bar
+    # @details Show the render time of the last slice and the mean time of the slices rendered since the last call
+    def showLatency(self):
+        render = self.profiler.pop_stats().get('render')
+        if render:
+            self.statusBar().showMessage("Render: {:.1f} ms (last), {:.1f} ms (mean of {} slices)".format(render['last'] * 1000, render['time'] / render['count'] * 1000, render['count']))
+
+    ## @brief Set the contrast sliders from the histogram of the current cycle
+    # @details The extreme intensities (below the 1st and above the 99th percentile) are left out of the contrast window.
+    def autoContrast(self):
+        contrast_min, contrast_max = self.image_file.get_auto_contrast(img_nb=self.cycle)
+        self.min_contrast_slider.setValue(int(round(contrast_min)))
+        self.max_contrast_slider.setValue(int(round(contrast_max)))
+
+    ## @brief Render in background the slices likely to be shown next
+    # @details Called when a slider moves, to render the next slices (or the next cycle of the 3 views) in the direction of the move.
+    # @param axis Slider moved (0:sagittal, 1:coronal, 2:axial, 3:cycle)
+    # @param value New value of the slider
+    def prefetch(self, axis: int, value: int):
+        if not self.image_file: return
+        if axis < 3:
+            make_tasks = lambda v: [self.getSliceArgs(self.cycle, axis, v)]
+            maximum = self.slice_sliders[axis].maximum()
+        else:
+            make_tasks = lambda v: [self.getSliceArgs(v, i, self.slice_sliders[i].value()) for i in range(3)]
+            maximum = self.cycle_slider.maximum()
+        self.prefetcher.observe(axis, value, maximum, make_tasks)
 
     ## @brief Clear all viewers.
     def clearViewers(self):
         for viewer in self.slice_viewers:
-            viewer.scene().clear()
+            viewer.clear_pixmap()
 
     ## @brief Update list of user-created points.
     def updatePointsList(self):
@@ -253,7 +386,7 @@ class Mimir(QMainWindow, mimir_ui.Ui_MainWindow):
         self.image_file.add_point(coords + [cycle])
         print("Point added: " + str(coords + [cycle]))#DEBUG
         self.updatePointsList()
-        self.drawAllViewers()
+        self.drawChangedViewers()
 
     ## @brief Delete selected point
     # @details Delete the selected point, then update points list and viewers.
@@ -263,7 +396,7 @@ class Mimir(QMainWindow, mimir_ui.Ui_MainWindow):
             self.image_file.delete_point(selection.row())
             print("Point deleted: " + str(selection.row()))#DEBUG
         self.updatePointsList()
-        self.drawAllViewers()
+        self.drawChangedViewers()
 
     ## @brief Update list of user-created masks
     def updateMasksList(self):
@@ -297,7 +430,7 @@ class Mimir(QMainWindow, mimir_ui.Ui_MainWindow):
                 self.image_file.delete_mask(self.masks_list.currentIndex().row())
                 print("Delete mask #"+str(self.masks_list.currentIndex().row()))
             self.updateMasksList()
-            self.drawAllViewers()
+            self.drawChangedViewers()
             self.currentMaskIndex = self.getLastMaskIndex()
 
     ## @brief Save points and masks
@@ -333,11 +466,31 @@ class Mimir(QMainWindow, mimir_ui.Ui_MainWindow):
         for i in range(len(self.image_file.masks)):
             self.image_file.get_mask(i).save_mask_to_nifti(save_directory + "/" + self.filename + "_mask" + str(i))
 
+    ## @brief Save all masks to a single NifTI label map
+    # @details The voxels of the mask at index i are labelled i+1. The colors of the labels are saved next to it, in a
+    # .json file of the same name.
+    def saveMasksToLabels(self):
+        save_path = QFileDialog.getSaveFileName(parent=self, directory=self.lastUsedPath+'/'+self.filename+'_labels.nii', filter='*.nii *.nii.gz')[0]
+        if not save_path: return
+        base_path = save_path[:-len('.nii.gz')] if save_path.endswith('.nii.gz') else os.path.splitext(save_path)[0]
+        self.image_file.save_labels_to_nifti(save_path, base_path + '.json')
+
     ## @brief Allow user to create a new mask
     def newMask(self):
         self.currentMaskIndex += 1
         self.toMaskMode(True)
 
+    ## @brief Create new 3D mask
+    # @details Ask the plane of the key slices of the mask, then enter mask mode. The polygons added on key slices of
+    # this plane are interpolated on the slices between them.
+    def newMask3D(self):
+        planes = ['Axial', 'Sagittal', 'Coronal']
+        plane, ok = QInputDialog.getItem(self, "New 3D mask", "Plane of the key slices:", planes, 0, False)
+        if ok:
+            self.currentMaskIndex = self.image_file.add_mask_3d({'Sagittal':0, 'Coronal':1, 'Axial':2}[plane])
+            self.updateMasksList()
+            self.toMaskMode(True)
+
     ## @brief Get last index of masks from the image file
     def getLastMaskIndex(self):
         return len(self.image_file.masks) - 1
@@ -371,7 +524,7 @@ class Mimir(QMainWindow, mimir_ui.Ui_MainWindow):
             newColor = QColorDialog.getColor(QColor(maskColor[0], maskColor[1], maskColor[2], maskColor[3]), self, "Mask color", QColorDialog.ShowAlphaChannel)
             if newColor.isValid():
                 mask.set_color(newColor.getRgb())
-                self.drawAllViewers()
+                self.drawChangedViewers()
                 self.updateMasksList()
             else: print("Invalid color")
         else:
@@ -400,7 +553,7 @@ class Mimir(QMainWindow, mimir_ui.Ui_MainWindow):
                 if(self.maskMode):
                     self.image_file.get_mask(self.currentMaskIndex).add_point([self.slice_sliders[0].value(), self.slice_sliders[1].value(), self.slice_sliders[2].value()])
                     print("Add point to mask ", self.currentMaskIndex, ": ", str([self.slice_sliders[0].value(), self.slice_sliders[1].value(), self.slice_sliders[2].value()]))
-                    self.drawAllViewers()
+                    self.drawChangedViewers()
                 else:
                     self.add_point(self.current_coords, self.cycle)
             # Escape key : Quit mask mode
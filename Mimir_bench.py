@@ -0,0 +1,303 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import nibabel
+import numpy
+import PIL
+import Mimir_lib
+import Mimir_cli
+
+## Names of the benchmarks, in the order they are run
+BENCHMARKS = ('load', 'get_slice', 'get_slice_lazy', 'get_slice_pyramid', 'get_slice_colormap', 'get_slice_annotated', 'get_slice_cached',
+              'set_colormap', 'draw_points_masks', 'save_mask_to_nifti', 'mask_3d_edit', 'export_all')
+
+parser = argparse.ArgumentParser(description='Measure the rendering and export times of Mímir on a synthetic image.')
+parser.add_argument('--shape', default='128,128,64,4', help='Shape of the synthetic image, 3 or 4 dimensions (default 128,128,64,4)')
+parser.add_argument('--dtype', default='int16', help='Data type of the synthetic image (default int16)')
+parser.add_argument('--pixdim', default='1,1,1.5', help='Voxel sizes of the synthetic image (default 1,1,1.5)')
+parser.add_argument('--gzip', action='store_true', help='Save the synthetic image as .nii.gz instead of .nii')
+parser.add_argument('--points', type=int, default=200, help='Number of synthetic points (default 200)')
+parser.add_argument('--masks', type=int, default=12, help='Number of synthetic masks (default 12)')
+parser.add_argument('--repeat', type=int, default=5, help='Number of warm runs of each benchmark (default 5)')
+parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of processes rendering the slices in the export_all benchmark (default 1)')
+parser.add_argument('--encoder', choices=Mimir_lib.ENCODERS, default='png', help='Encoder of the slices in the export_all benchmark (default png)')
+parser.add_argument('--compress-level', dest='compress_level', type=int, help='Compression effort of the encoder in the export_all benchmark (default of the encoder)')
+parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic image, points and masks (default 0)')
+parser.add_argument('-b', '--benchmark', dest='benchmarks', action='append', choices=BENCHMARKS, help='Benchmark to run, can be repeated (default all)')
+parser.add_argument('-o', '--output', help='Write the results in this JSON file instead of the standard output')
+parser.add_argument('--baseline', help='JSON results of a previous run to compare with')
+parser.add_argument('--threshold', type=float, default=1.2, help='Ratio to the baseline of the minimum warm time above which a benchmark is reported slower (default 1.2)')
+
+## @brief Create a synthetic image
+# @details Save a NIfTI image made of smooth patterns and noise (so the slices compress like real images) and return
+# its path
+# @param directory Directory of the image
+# @param shape Shape of the image (3 or 4 dimensions)
+# @param dtype Data type of the image
+# @param pixdim Voxel sizes of the image
+# @param gzip If true, save the image as .nii.gz
+# @param random numpy RandomState generating the noise
+def make_image(directory, shape, dtype, pixdim, gzip, random):
+    grid = numpy.ogrid[tuple(slice(0, n) for n in shape)]
+    data = 500 + 300 * numpy.sin(grid[0] / 8.0) * numpy.cos(grid[1] / 11.0) + 100 * numpy.sin(grid[2] / 5.0)
+    if len(shape) == 4:
+        data = data + 20 * grid[3]
+    data = data + random.normal(0, 20, shape)
+    dtype = numpy.dtype(dtype)
+    if dtype.kind in 'iu':
+        data = numpy.clip(data, numpy.iinfo(dtype).min, numpy.iinfo(dtype).max)
+    image = nibabel.Nifti1Image(data.astype(dtype), numpy.eye(4))
+    image.header.set_zooms(tuple(pixdim) + (1.0,) * (len(shape) - 3))
+    path = os.path.join(directory, 'bench.nii.gz' if gzip else 'bench.nii')
+    nibabel.save(image, path)
+    return path
+
+## @brief Create synthetic points and masks
+# @details Add random points and polygonal masks to the image. Half of the points, and all the masks, are on the
+# middle slices of the planes (on the first cycle for the points), which are the slices rendered by the benchmarks.
+# @param image_file Image to annotate
+# @param n_points Number of points
+# @param n_masks Number of masks
+# @param random numpy RandomState placing the points and masks
+def make_annotations(image_file, n_points, n_masks, random):
+    shape = image_file.shape
+    cycles = shape[3] if len(shape) == 4 else 1
+    middle = [n // 2 for n in shape[:3]]
+    for i in range(n_points):
+        point = [int(random.randint(n)) for n in shape[:3]] + [int(random.randint(cycles))]
+        if i % 2 == 0:
+            point[i // 2 % 3] = middle[i // 2 % 3]
+            point[3] = 0
+        image_file.add_point(point, [int(c) for c in random.randint(0, 256, 3)] + [255])
+    for i in range(n_masks):
+        plane_nb = i % 3
+        width, height = (n for j, n in enumerate(shape[:3]) if j != plane_nb)
+        radius = random.uniform(min(width, height) / 8, min(width, height) / 3)
+        angles = numpy.sort(random.uniform(0, 2 * numpy.pi, 8))
+        points = []
+        for x, y in zip(width / 2 + radius * numpy.cos(angles), height / 2 + radius * numpy.sin(angles)):
+            point = [int(x), int(y)]
+            point.insert(plane_nb, middle[plane_nb])
+            points.append(point)
+        mask = image_file.get_mask(i)
+        mask.add_points(points)
+        mask.set_color([int(c) for c in random.randint(0, 256, 3)] + [128])
+
+## @brief Make a synthetic 3D mask
+# @details Return a 3D mask along the axial axis, made of polygons of 16 vertices on the slices at 1/4, 1/2 and 3/4 of
+# the volume
+# @param image_file Image of the mask
+# @param random Random generator
+def make_mask_3d(image_file, random):
+    shape = image_file.shape
+    mask = Mimir_lib.Mask3D(shape[:3], image_file.header['pixdim'], 2)
+    for slice_nb in (shape[2] // 4, shape[2] // 2, 3 * shape[2] // 4):
+        radius = random.uniform(min(shape[:2]) / 8, min(shape[:2]) / 3)
+        angles = numpy.sort(random.uniform(0, 2 * numpy.pi, 16))
+        mask.add_points([[int(shape[0] / 2 + radius * numpy.cos(angle)), int(shape[1] / 2 + radius * numpy.sin(angle)), slice_nb] for angle in angles])
+    return mask
+
+## @brief Get the slices rendered by the benchmarks
+# @details Return the (img_nb, plane_nb, slice_nb) of the middle slice of each plane, on the first cycle
+def get_bench_slices(image_file):
+    return [(0, plane_nb, image_file.shape[plane_nb] // 2) for plane_nb in range(3)]
+
+## @brief Open the synthetic image
+# @param context Paths of the synthetic image and annotations
+# @param lazy If true, read the voxels on demand
+# @param annotated If true, load the synthetic points and masks
+def open_image(context, lazy=False, annotated=False):
+    image_file = Mimir_lib.Fd_data(context['path'], lazy)
+    if annotated:
+        image_file.load_points_masks(context['mim_path'])
+    return image_file
+
+## @brief Prepare a benchmark of get_slice
+# @details Return a function rendering the middle slice of each plane
+# @param image_file Image to render
+# @param colormap Colormap of the slices
+# @param max_size Maximum width and height of the slices, None for their full size
+def get_slices_run(image_file, colormap=None, max_size=None):
+    slices = get_bench_slices(image_file)
+    contrast_min, contrast_max = image_file.contrast_min, image_file.contrast_max
+    def run():
+        for img_nb, plane_nb, slice_nb in slices:
+            image_file.get_slice(img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap, max_size=max_size)
+    return run
+
+## @brief Prepare a benchmark
+# @details Return the function to time, once the image and data it needs are ready
+# @param name Name of the benchmark (see BENCHMARKS)
+# @param context Paths of the synthetic image and annotations, directory of the outputs and options
+def prepare_benchmark(name, context):
+    if name == 'load':
+        return lambda: Mimir_lib.Fd_data(context['path'])
+    if name == 'get_slice':
+        return get_slices_run(open_image(context))
+    if name == 'get_slice_lazy':
+        return get_slices_run(open_image(context, lazy=True))
+    if name == 'get_slice_pyramid':
+        # slices scaled down to a quarter of the image, read from its pyramid (built beforehand)
+        image_file = open_image(context, lazy=True)
+        image_file.enable_pyramid()
+        for level in range(1, image_file.get_pyramid_size()):
+            image_file.get_pyramid_level(level)
+        return get_slices_run(image_file, max_size=max(1, max(image_file.shape[:3]) // 4))
+    if name == 'get_slice_colormap':
+        return get_slices_run(open_image(context), 'hot')
+    if name == 'get_slice_annotated':
+        return get_slices_run(open_image(context, annotated=True))
+    if name == 'get_slice_cached':
+        image_file = open_image(context, annotated=True)
+        image_file.enable_cache()
+        return get_slices_run(image_file)
+    if name == 'set_colormap':
+        image_file = open_image(context)
+        image, scale = image_file.get_slice(0, 2, image_file.shape[2] // 2, image_file.contrast_min, image_file.contrast_max, None)
+        return lambda: Mimir_lib.set_colormap(image, 'hot')
+    if name == 'draw_points_masks':
+        image_file = open_image(context, annotated=True)
+        layers = [(image_file._get_layer(img_nb, plane_nb, slice_nb, image_file.contrast_min, image_file.contrast_max, None), img_nb, plane_nb, slice_nb)
+                  for img_nb, plane_nb, slice_nb in get_bench_slices(image_file)]
+        def run():
+            for layer, img_nb, plane_nb, slice_nb in layers:
+                image_file._draw_points_masks(layer, img_nb, plane_nb, slice_nb)
+        return run
+    if name == 'save_mask_to_nifti':
+        mask = open_image(context, annotated=True).get_mask(0)
+        return lambda: mask.save_mask_to_nifti(os.path.join(context['directory'], 'mask.nii'))
+    if name == 'mask_3d_edit':
+        # a vertex is added to the middle key slice then removed, each time rasterizing again the segments around it
+        mask = make_mask_3d(open_image(context), numpy.random.RandomState(context['seed']))
+        mask.get_segments()
+        middle = sorted(mask.key_polygons)[1]
+        def run():
+            mask.add_point([0, 0, middle])
+            mask.get_segments()
+            mask.delete_point(mask.points.index([0, 0, middle]))
+            mask.get_segments()
+        return run
+    if name == 'export_all':
+        # same slices (every axial slice of every cycle) and files as Mimir_cli.py --all -p AXI
+        image_file = open_image(context, annotated=True)
+        args = Mimir_cli.parser.parse_args([context['path'], '--all', '-p', 'AXI', '--encoder', context['encoder'], '-o', os.path.join(context['directory'], 'export') + '/'])
+        tasks = Mimir_cli.get_tasks(image_file, args, context['path'])
+        return lambda: Mimir_lib.export_slices(image_file, tasks, context['jobs'], encoder=context['encoder'], compress_level=context['compress_level'])
+    raise ValueError('Unknown benchmark: ' + name)
+
+## @brief Run a benchmark
+# @details Return the results of the benchmark: the time (in seconds) of the first run, with the caches of Mimir_lib
+# emptied (cold), the minimum, median and mean times of the next runs (warm), and the peak memory (in bytes) allocated
+# by Python and numpy during a warm run. The memory is measured on a separate run, as tracing slows the allocations.
+# @param run Function to time
+# @param repeat Number of warm runs
+def run_benchmark(run, repeat):
+    Mimir_lib.clear_caches()
+    gc.collect()
+    start = time.perf_counter()
+    run()
+    cold = time.perf_counter() - start
+    warm = []
+    for i in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        warm.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'cold': cold, 'warm': {'min': min(warm), 'median': statistics.median(warm), 'mean': statistics.mean(warm)}, 'peak_memory': peak_memory}
+
+## @brief Compare results with a baseline
+# @details Print the ratios of the times of the benchmarks to the ones of the baseline, and return the names of the
+# benchmarks whose minimum warm time (the least disturbed by the other processes) is more than threshold times the one
+# of the baseline
+# @param results Results of the benchmarks
+# @param baseline Results of a previous run
+# @param threshold Ratio of the minimum warm times above which a benchmark is slower
+def compare_results(results, baseline, threshold):
+    if results['config'] != baseline.get('config'):
+        print("Warning: the baseline was run with other options ({})".format(baseline.get('config')), file=sys.stderr)
+    slower = []
+    for name, result in results['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        ratio = result['warm']['min'] / base['warm']['min']
+        if ratio > threshold:
+            slower.append(name)
+        print("{}: warm x{:.2f}, cold x{:.2f}, memory x{:.2f}{}".format(name, ratio, result['cold'] / base['cold'],
+              result['peak_memory'] / base['peak_memory'] if base['peak_memory'] else float('nan'),
+              ' SLOWER' if ratio > threshold else ''), file=sys.stderr)
+    return slower
+
+## @brief Run the benchmarks according to the command line arguments
+def main():
+    args = parser.parse_args()
+    try:
+        shape = tuple(int(n) for n in args.shape.split(','))
+        pixdim = tuple(float(n) for n in args.pixdim.split(','))
+        numpy.dtype(args.dtype)
+    except (ValueError, TypeError) as e:
+        parser.error(str(e))
+    if len(shape) not in (3, 4) or min(shape) < 1:
+        parser.error('argument --shape: 3 or 4 positive dimensions expected')
+    if len(pixdim) != 3:
+        parser.error('argument --pixdim: 3 voxel sizes expected')
+    if args.repeat < 1 or args.jobs < 1:
+        parser.error('arguments --repeat and -j/--jobs must be at least 1')
+
+    random = numpy.random.RandomState(args.seed)
+    results = {
+        'config': {'shape': list(shape), 'dtype': args.dtype, 'pixdim': list(pixdim), 'gzip': args.gzip, 'points': args.points,
+                   'masks': args.masks, 'repeat': args.repeat, 'jobs': args.jobs,
+                   'encoder': args.encoder, 'compress_level': args.compress_level, 'seed': args.seed},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'numpy': numpy.__version__,
+                        'nibabel': nibabel.__version__, 'pillow': getattr(PIL, '__version__', getattr(PIL, 'PILLOW_VERSION', None))},
+        'results': {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        context = {'directory': directory, 'jobs': args.jobs, 'seed': args.seed, 'encoder': args.encoder, 'compress_level': args.compress_level}
+        context['path'] = make_image(directory, shape, args.dtype, pixdim, args.gzip, random)
+        image_file = Mimir_lib.Fd_data(context['path'])
+        make_annotations(image_file, args.points, args.masks, random)
+        context['mim_path'] = os.path.join(directory, 'bench.mim')
+        image_file.save_points_masks(context['mim_path'])
+        del image_file
+
+        for name in BENCHMARKS:
+            if args.benchmarks and name not in args.benchmarks:
+                continue
+            result = run_benchmark(prepare_benchmark(name, context), args.repeat)
+            results['results'][name] = result
+            print("{}: cold {:.2f} ms, warm {:.2f} ms (median), peak memory {:.1f} MB".format(
+                  name, result['cold'] * 1000, result['warm']['median'] * 1000, result['peak_memory'] / 2**20), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            slower = compare_results(results, json.load(fp), args.threshold)
+        if slower:
+            print("Slower than the baseline: " + ', '.join(slower), file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,19 @@
 import argparse
+import collections
+import glob
+import json
+import multiprocessing
 import Mimir_lib
 import os
+import shlex
+import sys
+import time
+
+## Number of images processed by a process of the batch mode before it is replaced, to give back the memory
+BATCH_IMAGES_PER_PROCESS = 16
+## Encoder of each extension of the output file of a single slice
+EXTENSION_ENCODERS = dict([(extension, encoder) for encoder, extension in Mimir_lib.ENCODER_EXTENSIONS.items()] + [('.jpeg', 'jpeg')])
+
 ## @brief Check if a path exist, create it if not
 # @param file_path Path to check
 def ensure_dir(file_path):
@@ -18,180 +31,462 @@ def is_int(s):
         return False
 
 parser = argparse.ArgumentParser(description='Process 2D, 3D or 4D images.')
-parser.add_argument('path_in', help='Path of image to be processed')
+parser.add_argument('path_in', nargs='*', help='Path of image to be processed (with --batch, paths or glob patterns of the images)')
 parser.add_argument('-o', dest='path_out', help='Output file')
 parser.add_argument('-t', '--img_nb', dest='img_nb', type=int, help='In case of a 4D image, select the time of the image to process')
 parser.add_argument('-p', '--plane', dest='plane', choices=['SAG', '0', 'COR', '1', 'AXI', '2'], help='View of image to be processed')
 parser.add_argument('-s', '--slice_nb', dest='slice_nb', type=int, help='Number of the slice to process')
 parser.add_argument('-c', '--cmap', '--colormap', dest='cmap', help='Add a colormap to the processed image')
-parser.add_argument('-m', '--contrast-min', dest='contrast_min', default=0, type=float, help='Adjust the minimum contrast in %% (0-100)')
-parser.add_argument('-M', '--contrast-max', dest='contrast_max', default=100, type=float, help='Adjust the maximum contrast in %% (0-100)')
+parser.add_argument('-m', '--contrast-min', dest='contrast_min', type=float, help='Adjust the minimum contrast in %% (0-100)')
+parser.add_argument('-M', '--contrast-max', dest='contrast_max', type=float, help='Adjust the maximum contrast in %% (0-100)')
+parser.add_argument('-a', '--auto-contrast', dest='auto_contrast', action='store_true', help='Use -m and -M as percentiles of the intensities of the image (default {} and {}) instead of percentages of its range'.format(Mimir_lib.AUTO_CONTRAST_MIN, Mimir_lib.AUTO_CONTRAST_MAX))
 parser.add_argument('--all', dest='all', action='store_true', help='Process every slice possible with the options given')
 parser.add_argument('-l', '--link', dest='link', help='Link a .mim file to print points and masks stored in it')
 parser.add_argument('-e','--edit', dest='edit', action='store_true', help='Edit points and masks in the specified slices (if no other options, all slices are accessible)')
-args = parser.parse_args()
+parser.add_argument('--lazy', dest='lazy', action='store_true', help='Read only the needed slices from the file instead of loading the whole image (best with uncompressed .nii files)')
+parser.add_argument('-j', '--jobs', dest='jobs', default=1, type=int, help='Number of processes rendering the slices with --all (number of images processed at once with --batch)')
+parser.add_argument('--interpolation', dest='interpolation', choices=Mimir_lib.INTERPOLATIONS, default='nearest', help='Interpolation used to scale the slices according to the voxel sizes (default nearest)')
+parser.add_argument('--batch', dest='batch', action='store_true', help='Process several images with the options given (-l is linked to the images without their own .mim file)')
+parser.add_argument('--manifest', dest='manifest', help='With --batch, text file listing the images to process, one per line, optionally followed by the .mim file to link to it')
+parser.add_argument('--report', dest='report', help='With --batch, write the outputs, processing times and errors of every image in this JSON file')
+parser.add_argument('--encoder', dest='encoder', choices=Mimir_lib.ENCODERS, help='Format of the saved slices: png, raw RGB array (npy), lossless webp or jpeg (default png, or given by the extension of -o for a single slice)')
+parser.add_argument('--compress-level', dest='compress_level', type=int, help='Compression effort of the encoder: 0 (fastest) to 9 (smallest) for png (default 6), 0 to 6 for webp (default 4)')
+parser.add_argument('--quality', dest='quality', type=int, help='Quality of the jpeg encoder in %% (1-100, default 75)')
+parser.add_argument('--stack', dest='stack', choices=['time', 'plane'], help='With --all, save each slice along the time (time) or each plane of an image of the time series (plane) in a single .npy file of RGB frames, indexed in index.json')
+parser.add_argument('--mask-dtype', dest='mask_dtype', choices=['float64', 'uint8'], default='float64', help='With -e, type of the voxels of the masks saved to nifti (default float64)')
+parser.add_argument('--mask-gzip', dest='mask_gzip', type=int, help='With -e, save the masks to .nii.gz files compressed with this gzip level (1-9)')
+parser.add_argument('--mask-crop', dest='mask_crop', action='store_true', help='With -e, save only the bounding box of the masks to nifti (the affine keeps the position of the voxels)')
+parser.add_argument('--mask-affine', dest='mask_affine', choices=['identity', 'image'], default='identity', help='With -e, affine of the masks saved to nifti: identity, or the one of the image (default identity)')
+parser.add_argument('--stats', dest='stats', help='Compute the mean, standard deviation, minimum and maximum of the intensities in each mask and at each point of the -l file on every time, and their volume, and write them in this .csv or .npz file (no slice is saved)')
+parser.add_argument('--pyramid', dest='pyramid', action='store_true', help='Build the downsampled copies of the image used to show its slices scaled down, and save them next to the image (no slice is saved)')
+parser.add_argument('--profile', dest='profile', action='store_true', help='Print the time spent in each stage of the rendering and the throughput at the end')
+
+## @brief Check the command line arguments which depend on the image
+# @details Raise a ValueError if an argument doesn't fit the image
+# @param image_file Image to process
+# @param args Command line arguments
+def check_image_args(image_file, args):
+    if(args.img_nb and (args.img_nb < 0 or args.img_nb > image_file.shape[3])):
+        raise ValueError('argument -t/--img_nb: invalid choice {} (choose in range 0-{})'.format(args.img_nb, image_file.shape[3]))
+
+## @brief Get the contrast window given by the command line arguments
+# @details Return (contrast_min, contrast_max), in intensities of the image
+# @param image_file Image to process
+# @param args Command line arguments
+def get_contrast(image_file, args):
+    if(args.auto_contrast):
+        return image_file.get_auto_contrast(Mimir_lib.AUTO_CONTRAST_MIN if args.contrast_min is None else args.contrast_min,
+                                            Mimir_lib.AUTO_CONTRAST_MAX if args.contrast_max is None else args.contrast_max, args.img_nb)
+    # without a window asked, the display range of the header avoids reading the whole image in lazy mode
+    header_range = image_file.get_header_range()
+    if(args.contrast_min is None and args.contrast_max is None and header_range is not None):
+        return header_range
+    contrast_min = round(image_file.contrast_min+(args.contrast_min or 0)*(image_file.contrast_max-image_file.contrast_min)/100)
+    contrast_max = round(image_file.contrast_min+(100 if args.contrast_max is None else args.contrast_max)*(image_file.contrast_max-image_file.contrast_min)/100)
+    return contrast_min, contrast_max
+
+## @brief Get the slices to save according to the command line arguments
+# @details Return a list of (img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap, path of the output file).
+# Raise a ValueError if the slice asked doesn't exist.
+# @param image_file Image to process
+# @param args Command line arguments
+# @param path_in Path of the image
+# @param path_out Output file of a single slice, derived from path_in if None (with --all, the slices are saved in
+# the directory of args.path_out)
+def get_tasks(image_file, args, path_in, path_out=None):
+    contrast_min, contrast_max = get_contrast(image_file, args)
+    if(args.plane):
+        plane_nb = {'SAG':0, '0':0, 'COR':1, '1':1, 'AXI':2, '2':2}.get(args.plane)
+    #Save every slices corresponding to the given options
+    if(args.all):
+        tasks = []
+        for i in range(args.img_nb if args.img_nb else 0, args.img_nb + 1 if args.img_nb else (image_file.shape[3] if len(image_file.shape) == 4 else 1)):
+            for j in range(plane_nb if args.plane else 0, plane_nb + 1 if args.plane else 3):
+                if(args.slice_nb is not None and (args.slice_nb < 0 or args.slice_nb > image_file.shape[j])):
+                    raise ValueError('argument -s/--slice_nb: invalid choice {} (choose in range 0-{} for {} plane)'.format(args.slice_nb, image_file.shape[j], {0:'SAG', 1:'COR', 2:'AXI'}.get(j)))
+                for k in range(args.slice_nb if args.slice_nb else 0, args.slice_nb + 1 if args.slice_nb else image_file.shape[j]):
+                    path_out = "{}/{}/{}/{}/{}{}".format((os.path.dirname(args.path_out) if args.path_out else os.path.dirname(path_in)),os.path.splitext(path_in)[0],i,{0:'SAG', 1:'COR', 2:'AXI'}.get(j),k,Mimir_lib.ENCODER_EXTENSIONS[args.encoder])
+                    tasks.append((i, j, k, contrast_min, contrast_max, args.cmap, path_out))
+        return tasks
+    if(args.slice_nb < 0 or args.slice_nb > image_file.shape[plane_nb]):
+        raise ValueError('argument -s/--slice_nb: invalid choice {} (choose in range 0-{} for {} plane)'.format(args.slice_nb, image_file.shape[plane_nb], {0:'SAG', 1:'COR', 2:'AXI'}.get(plane_nb)))
+    if not path_out:
+        path_out = "{}/{}{}".format((os.path.dirname(args.path_out) if args.path_out else os.path.dirname(path_in)),os.path.splitext(path_in)[0],Mimir_lib.ENCODER_EXTENSIONS[args.encoder])
+    return [(args.img_nb if args.img_nb else 0, plane_nb, args.slice_nb, contrast_min, contrast_max, args.cmap, path_out)]
+
+## @brief Save the slices given by the command line arguments in stacks
+# @details Each stack is saved as a .npy file of RGB frames (see Mimir_lib.export_stacks): with --stack time, one file
+# per slice of a plane holding the slice at every time, with --stack plane, one file per plane and time holding every
+# slice of the plane. The stacks are described in an index.json file (image, plane, slice or time and frames of each
+# file) next to them. Return the list of the files saved and the number of slices.
+# Raise a ValueError if a slice asked doesn't exist.
+# @param image_file Image to process
+# @param args Command line arguments
+# @param path_in Path of the image
+# @param jobs Number of processes rendering the slices
+def save_stacks(image_file, args, path_in, jobs=1):
+    directory = "{}/{}".format((os.path.dirname(args.path_out) if args.path_out else os.path.dirname(path_in)),os.path.splitext(path_in)[0])
+    stacks = collections.OrderedDict()
+    for img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap, path_out in get_tasks(image_file, args, path_in):
+        plane = {0:'SAG', 1:'COR', 2:'AXI'}.get(plane_nb)
+        if(args.stack == 'time'):
+            key = ("{}/{}/{}.npy".format(directory, plane, slice_nb), plane, 'slice', slice_nb)
+        else:
+            key = ("{}/{}/{}.npy".format(directory, img_nb, plane), plane, 'time', img_nb)
+        stacks.setdefault(key, []).append((img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap))
+    infos = Mimir_lib.export_stacks(image_file, [(key[0], tasks) for key, tasks in stacks.items()], jobs, interpolation=args.interpolation)
+    contrast_min, contrast_max = get_contrast(image_file, args)
+    index = {'image': path_in, 'stack': args.stack, 'contrast': [float(contrast_min), float(contrast_max)], 'colormap': args.cmap, 'files': []}
+    for (path_out, plane, field, value), tasks, (shape, scale) in zip(stacks.keys(), stacks.values(), infos):
+        index['files'].append({'path': os.path.relpath(path_out, directory), 'plane': plane, field: value,
+                               'frames': [task[0 if args.stack == 'time' else 2] for task in tasks],
+                               'shape': list(shape), 'scale': [float(v) for v in scale]})
+    index_path = "{}/index.json".format(directory)
+    ensure_dir(index_path)
+    with open(index_path, 'w') as fp:
+        json.dump(index, fp, indent=2)
+    return [key[0] for key in stacks] + [index_path], sum(len(tasks) for tasks in stacks.values())
+
+## @brief Print the statistics of the profiler
+# @details Print the number of calls, total and mean time and throughput of each stage of the rendering, then the
+# number of slices and megabytes read and written per second
+# @param stats Statistics of the profiler (see Mimir_lib.Profiler.get_stats)
+# @param elapsed Total time (in seconds) of the processing
+# @param slices Number of slices saved
+# @param processes Number of processes which rendered the slices
+def print_profile(stats, elapsed, slices, processes=1):
+    print("{:<10} {:>8} {:>10} {:>10} {:>10}".format('Stage', 'Calls', 'Total (s)', 'Mean (ms)', 'MB/s'))
+    for stage in Mimir_lib.PROFILE_STAGES:
+        if stage in stats:
+            count, seconds, size = stats[stage]['count'], stats[stage]['time'], stats[stage]['bytes']
+            print("{:<10} {:>8} {:>10.3f} {:>10.3f} {:>10}".format(stage, count, seconds, seconds / count * 1000,
+                  "{:.1f}".format(size / seconds / 1e6) if seconds and size else '-'))
+    read = stats.get('read', {}).get('bytes', 0)
+    written = stats.get('write', {}).get('bytes', 0)
+    print("{} slice(s) in {:.2f} s: {:.1f} slices/s, {:.1f} MB/s read, {:.1f} MB/s written".format(
+          slices, elapsed, slices / elapsed, read / elapsed / 1e6, written / elapsed / 1e6))
+    if processes > 1:
+        print("(the times of the stages are summed over the {} processes)".format(processes))
+
+## @brief Get the images of the batch mode
+# @details Return a list of (path of the image, path of the .mim file to link or None). The paths which aren't files are
+# expanded as glob patterns (a pattern matching no file is kept, and fails when processed).
+# @param paths Paths or glob patterns of the images
+# @param manifest Path of a text file listing an image (and optionally a .mim file) per line, None if there is none
+# @param link .mim file linked to the images without their own
+def get_batch_files(paths, manifest=None, link=None):
+    files = []
+    for path in paths:
+        matches = [path] if os.path.isfile(path) else sorted(glob.glob(path))
+        files.extend((match, link) for match in (matches or [path]))
+    if manifest:
+        with open(manifest) as fp:
+            for line in fp:
+                fields = shlex.split(line, comments=True)
+                if fields:
+                    files.append((fields[0], fields[1] if len(fields) > 1 else link))
+    return files
+
+## @brief Save the slices of an image of the batch mode
+# @details Return the report of the image: dictionary of its path, linked .mim file, status ("ok" or "failed"),
+# output files, number of slices saved, processing time (in seconds) and error, and with --profile the statistics of
+# the profiler
+# @param job (command line arguments, path of the image, path of the .mim file to link or None)
+def process_batch_file(job):
+    args, path_in, link = job
+    report = {'path': path_in, 'link': link, 'status': 'ok', 'outputs': [], 'slices': 0, 'time': 0, 'error': None}
+    if(args.profile):
+        Mimir_lib.enable_profiling()
+    start = time.perf_counter()
+    try:
+        image_file = Mimir_lib.Fd_data(path_in, args.lazy)
+        if(link):
+            image_file.load_points_masks(link)
+        check_image_args(image_file, args)
+        if(args.stack):
+            report['outputs'], report['slices'] = save_stacks(image_file, args, path_in)
+        else:
+            tasks = get_tasks(image_file, args, path_in)
+            Mimir_lib.export_slices(image_file, tasks, interpolation=args.interpolation, encoder=args.encoder, compress_level=args.compress_level, quality=args.quality)
+            report['outputs'], report['slices'] = [task[-1] for task in tasks], len(tasks)
+    except Exception as e:
+        report['status'] = 'failed'
+        report['error'] = '{}: {}'.format(type(e).__name__, e)
+    report['time'] = time.perf_counter() - start
+    if(args.profile):
+        report['profile'] = Mimir_lib.get_profiler().pop_stats()
+    return report
+
+## @brief Process the images of the batch mode
+# @details The images are processed by args.jobs processes, each one processing an image at a time. An image which
+# fails is reported, without stopping the others. Return the report of the batch: dictionary of the reports of the
+# images (see process_batch_file), the numbers of images processed and failed and the total time.
+# @param args Command line arguments
+# @param files List of (path of the image, path of the .mim file to link or None)
+def run_batch(args, files):
+    start = time.perf_counter()
+    jobs = [(args, path_in, link) for path_in, link in files]
+    reports = []
+    pool = None
+    if args.jobs > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(jobs)), maxtasksperchild=BATCH_IMAGES_PER_PROCESS)
+    try:
+        for report in (pool.imap(process_batch_file, jobs) if pool else map(process_batch_file, jobs)):
+            if report['status'] == 'ok':
+                print("{}: {} file(s) saved in {:.2f} s".format(report['path'], len(report['outputs']), report['time']))
+            else:
+                print("{}: failed ({})".format(report['path'], report['error']), file=sys.stderr)
+            if report.get('profile'):
+                Mimir_lib.get_profiler().merge(report['profile'])
+            reports.append(report)
+        if pool:
+            pool.close()
+            pool.join()
+    finally:
+        if pool:
+            pool.terminate()
+    failed = sum(report['status'] != 'ok' for report in reports)
+    return {'files': reports, 'processed': len(reports), 'failed': failed, 'time': time.perf_counter() - start}
 
-if not os.path.isfile(args.path_in):
-    parser.error('The file',args.path_in,'does not exist.')
+## @brief Process the image according to the command line arguments
+def main():
+    args = parser.parse_args()
+    start = time.perf_counter()
+    if(args.profile):
+        Mimir_lib.enable_profiling()
 
-image_file = Mimir_lib.Fd_data(args.path_in)
-if(args.link):
-    image_file.load_points_masks(args.link)
+    if(args.contrast_min and (args.contrast_min < 0 or args.contrast_min > 100)):
+        parser.error('argument -m/--contrast_min: invalid choice {} (choose in range 0-100)'.format(args.contrast_min))
+    if(args.contrast_max and (args.contrast_max < 0 or args.contrast_max > 100)):
+        parser.error('argument -M/--contrast_max: invalid choice {} (choose in range 0-100)'.format(args.contrast_max))
+    if(args.jobs < 1):
+        parser.error('argument -j/--jobs: invalid choice {} (must be at least 1)'.format(args.jobs))
+    if not args.edit and not args.all and not args.stats and not args.pyramid and not (args.plane and args.slice_nb is not None):
+        parser.error('both plane and slice_nb arguments are obligatory if --all, -e|--edit, --stats or --pyramid flag are not set.')
+    if(args.stats and not args.stats.endswith(('.csv', '.npz'))):
+        parser.error('argument --stats: the statistics can only be saved to .csv or .npz files')
+    if(args.stats and (args.batch or args.edit)):
+        parser.error('argument --stats: not allowed with --batch or -e/--edit')
+    if(args.pyramid and (args.batch or args.edit or args.stats)):
+        parser.error('argument --pyramid: not allowed with --batch, -e/--edit or --stats')
+    # the format of a single slice is given by the extension of its output file
+    single_slice = not (args.batch or args.pyramid or args.stats or args.edit or args.stack or args.all)
+    extension_encoder = EXTENSION_ENCODERS.get(os.path.splitext(args.path_out)[1].lower()) if single_slice and args.path_out else None
+    if(args.encoder is None):
+        args.encoder = extension_encoder or 'png'
+    elif(extension_encoder and extension_encoder != args.encoder):
+        parser.error('argument --encoder: {} does not match the extension of the output file {}'.format(args.encoder, args.path_out))
+    if not Mimir_lib.is_encoder_available(args.encoder):
+        parser.error('argument --encoder: {} is not supported by this installation of python-pillow'.format(args.encoder))
+    if(args.compress_level is not None and (args.encoder not in ('png', 'webp') or not 0 <= args.compress_level <= {'png':9, 'webp':6}[args.encoder])):
+        parser.error('argument --compress-level: invalid choice {} (choose in range 0-9 for png, 0-6 for webp)'.format(args.compress_level))
+    if(args.quality is not None and (args.encoder != 'jpeg' or not 1 <= args.quality <= 100)):
+        parser.error('argument --quality: invalid choice {} (choose in range 1-100 for jpeg)'.format(args.quality))
+    if(args.mask_gzip is not None and not 1 <= args.mask_gzip <= 9):
+        parser.error('argument --mask-gzip: invalid choice {} (choose in range 1-9)'.format(args.mask_gzip))
+    if(args.stack and not args.all):
+        parser.error('argument --stack: only allowed with --all')
 
-if(args.plane):
-    plane_nb = {'SAG':0, '0':0, 'COR':1, '1':1, 'AXI':2, '2':2}.get(args.plane)
+    #BATCH MODE
+    if(args.batch):
+        if(args.edit):
+            parser.error('argument -e/--edit: not allowed with --batch')
+        try:
+            files = get_batch_files(args.path_in, args.manifest, args.link)
+        except OSError as e:
+            parser.error('argument --manifest: {}'.format(e))
+        if not files:
+            parser.error('no image to process (give paths or a --manifest)')
+        report = run_batch(args, files)
+        print("{} image(s) processed in {:.2f} s, {} failed".format(report['processed'], report['time'], report['failed']))
+        if(args.profile):
+            print_profile(Mimir_lib.get_profiler().get_stats(), time.perf_counter() - start, sum(image['slices'] for image in report['files']), args.jobs)
+        if(args.report):
+            ensure_dir(os.path.abspath(args.report))
+            with open(args.report, 'w') as fp:
+                json.dump(report, fp, indent=2)
+        sys.exit(1 if report['failed'] else 0)
 
-if(args.contrast_min and (args.contrast_min < 0 or args.contrast_min > 100)):
-    parser.error('argument -m/--contrast_min: invalid choice {} (choose in range 0-100)'.format(args.contrast_min))
-if(args.contrast_max and (args.contrast_max < 0 or args.contrast_max > 100)):
-    parser.error('argument -M/--contrast_max: invalid choice {} (choose in range 0-100)'.format(args.contrast_max))
-if(args.img_nb and (args.img_nb < 0 or args.img_nb > image_file.shape[3])):
-    parser.error('argument -t/--img_nb: invalid choice {} (choose in range 0-{})'.format(args.img_nb, image_file.shape[3]))
+    if(len(args.path_in) != 1):
+        parser.error('exactly one path_in is expected without --batch')
+    args.path_in = args.path_in[0]
+    if not os.path.isfile(args.path_in):
+        parser.error('The file {} does not exist.'.format(args.path_in))
 
-contrast_min = round(image_file.contrast_min+args.contrast_min*(image_file.contrast_max-image_file.contrast_min)/100)
-contrast_max = round(image_file.contrast_min+args.contrast_max*(image_file.contrast_max-image_file.contrast_min)/100)
+    image_file = Mimir_lib.Fd_data(args.path_in, args.lazy)
+    if(args.link):
+        image_file.load_points_masks(args.link)
+    try:
+        check_image_args(image_file, args)
+    except ValueError as e:
+        parser.error(str(e))
 
-#MASK AND POINTS EDITION MODE
-if(args.edit):
-    input_value = [""]
+    #PYRAMID MODE
+    if(args.pyramid):
+        if(image_file.get_pyramid_size() == 1):
+            print("The image is too small to need downsampled copies")
+        else:
+            image_file.save_pyramid()
+            print("{} levels saved in {}".format(image_file.get_pyramid_size() - 1, image_file.get_pyramid_path()))
+    #STATISTICS MODE
+    elif(args.stats):
+        stats = image_file.get_roi_statistics()
+        ensure_dir(os.path.abspath(args.stats))
+        Mimir_lib.save_roi_statistics(stats, args.stats)
+        print("Statistics of {} region(s) on {} time(s) saved in {}".format(len(stats['names']), stats['mean'].shape[1], args.stats))
+    #MASK AND POINTS EDITION MODE
+    elif(args.edit):
+        input_value = [""]
+        # options of the masks saved to nifti
+        nifti_extension = ".nii" if args.mask_gzip is None else ".nii.gz"
+        nifti_options = {'affine': image_file.get_affine() if args.mask_affine == 'image' else None,
+                         'crop': args.mask_crop, 'compress_level': args.mask_gzip}
     
-    edit_point = True
-    last_index = len(image_file.masks) - 1
-    actual_index = 0
-    while(len(input_value) == 0 or (input_value[0] != "save" and input_value[0] != "exit")):
-        input_value = input("{}> ".format("point" if edit_point else "mask {}".format(actual_index))).split()
-        #SAVE
-        if(len(input_value) >= 1):
-            if(input_value[0] == "save"):
-                path_out = args.path_out if args.path_out else "{}/{}.mim".format(os.path.dirname(args.path_in),os.path.splitext(args.path_in)[0])
-                ensure_dir(path_out)
-                image_file.save_points_masks(path_out)
-                print("Masks and points saved in {}".format(path_out))
-            #SAVE MASK TO NIFTI
-            elif(input_value[0] == "nifti" and len(input_value) == 2):
-                if(is_int(input_value[1]) and int(input_value[1]) < len(image_file.masks) and int(input_value[1]) >= 0):
-                    path_out = "{}/{}_mask_{}.nii".format((os.path.dirname(args.path_out) if args.path_out else os.path.dirname(args.path_in)),os.path.splitext(args.path_in)[0],input_value[1])
+        edit_point = True
+        last_index = len(image_file.masks) - 1
+        actual_index = 0
+        while(len(input_value) == 0 or (input_value[0] != "save" and input_value[0] != "exit")):
+            input_value = input("{}> ".format("point" if edit_point else "mask {}".format(actual_index))).split()
+            #SAVE
+            if(len(input_value) >= 1):
+                if(input_value[0] == "save"):
+                    path_out = args.path_out if args.path_out else "{}/{}.mim".format(os.path.dirname(args.path_in),os.path.splitext(args.path_in)[0])
                     ensure_dir(path_out)
-                    image_file.get_mask(int(input_value[1])).save_mask_to_nifti(path_out)
-                elif(input_value[1] == "all"):
-                    for k,mask in enumerate(image_file.masks):
-                        path_out = "{}/{}_mask_{}.nii".format((os.path.dirname(args.path_out) if args.path_out else os.path.dirname(args.path_in)),os.path.splitext(args.path_in)[0],k)
+                    image_file.save_points_masks(path_out)
+                    print("Masks and points saved in {}".format(path_out))
+                #SAVE MASK TO NIFTI
+                elif(input_value[0] == "nifti" and len(input_value) == 2):
+                    if(is_int(input_value[1]) and int(input_value[1]) < len(image_file.masks) and int(input_value[1]) >= 0):
+                        path_out = "{}/{}_mask_{}{}".format((os.path.dirname(args.path_out) if args.path_out else os.path.dirname(args.path_in)),os.path.splitext(args.path_in)[0],input_value[1],nifti_extension)
                         ensure_dir(path_out)
-                        mask.save_mask_to_nifti(path_out)
-            #CHANGE TO MASK MODE
-            elif(input_value[0] == "mask" or input_value[0] == "m" or input_value[0] == "masks"):
-                edit_point = False
-                if len(input_value) == 1:
-                    last_index += 1
-                    actual_index = last_index
-                elif(is_int(input_value[1])):
-                    actual_index = int(input_value[1])
-            #CHANGE TO POINT MODE
-            elif(input_value[0] == "point" or input_value[0] == "p" or input_value[0] == "points"):
-                edit_point = True
-            #DELETION
-            elif(input_value[0] == "del" or input_value[0] == "d" or input_value == "delete"):
-                if(is_int(input_value[1])):
-                    if(edit_point): #POINT MODE
-                        image_file.delete_point(int(input_value[1]))
-                    else: #MASK MODE
-                        image_file.get_mask(actual_index).delete_point(int(input_value[1]))
-                    print("Point {} deleted".format(input_value[1]))
-                elif(input_value[1] == "mask" and is_int(input_value[2])):
-                    image_file.delete_mask(int(input_value[2]))
-                    print("Mask {} deleted".format(input_value[2]))
-            #COLOR CHANGE
-            elif(input_value[0] == "col" or input_value[0] == "c" or input_value[0] == "color"):
-                if(edit_point and is_int(input_value[1])): #POINT MODE
-                    color = []
-                    if(len(input_value[2:]) == 4):
-                        for v in input_value[2:]:
-                            if(is_int(v) and int(v) < 256 and int(v) >= 0):
-                                color.append(int(v))
+                        image_file.get_mask(int(input_value[1])).save_mask_to_nifti(path_out, args.mask_dtype, **nifti_options)
+                    elif(input_value[1] == "labels"):
+                        path_out = "{}/{}_labels{}".format((os.path.dirname(args.path_out) if args.path_out else os.path.dirname(args.path_in)),os.path.splitext(args.path_in)[0],nifti_extension)
+                        ensure_dir(path_out)
+                        image_file.save_labels_to_nifti(path_out, "{}/{}_labels.json".format((os.path.dirname(args.path_out) if args.path_out else os.path.dirname(args.path_in)),os.path.splitext(args.path_in)[0]), **nifti_options)
+                        print("Masks saved in {}".format(path_out))
+                    elif(input_value[1] == "all"):
+                        for k,mask in enumerate(image_file.masks):
+                            path_out = "{}/{}_mask_{}{}".format((os.path.dirname(args.path_out) if args.path_out else os.path.dirname(args.path_in)),os.path.splitext(args.path_in)[0],k,nifti_extension)
+                            ensure_dir(path_out)
+                            mask.save_mask_to_nifti(path_out, args.mask_dtype, **nifti_options)
+                #NEW 3D MASK
+                elif(input_value[0] == "mask3d" and len(input_value) == 2 and input_value[1] in ('SAG', '0', 'COR', '1', 'AXI', '2')):
+                    edit_point = False
+                    actual_index = image_file.add_mask_3d({'SAG':0, '0':0, 'COR':1, '1':1, 'AXI':2, '2':2}.get(input_value[1]))
+                    last_index = actual_index
+                #CHANGE TO MASK MODE
+                elif(input_value[0] == "mask" or input_value[0] == "m" or input_value[0] == "masks"):
+                    edit_point = False
+                    if len(input_value) == 1:
+                        last_index += 1
+                        actual_index = last_index
+                    elif(is_int(input_value[1])):
+                        actual_index = int(input_value[1])
+                #CHANGE TO POINT MODE
+                elif(input_value[0] == "point" or input_value[0] == "p" or input_value[0] == "points"):
+                    edit_point = True
+                #DELETION
+                elif(input_value[0] == "del" or input_value[0] == "d" or input_value == "delete"):
+                    if(is_int(input_value[1])):
+                        if(edit_point): #POINT MODE
+                            image_file.delete_point(int(input_value[1]))
+                        else: #MASK MODE
+                            image_file.get_mask(actual_index).delete_point(int(input_value[1]))
+                        print("Point {} deleted".format(input_value[1]))
+                    elif(input_value[1] == "mask" and is_int(input_value[2])):
+                        image_file.delete_mask(int(input_value[2]))
+                        print("Mask {} deleted".format(input_value[2]))
+                #COLOR CHANGE
+                elif(input_value[0] == "col" or input_value[0] == "c" or input_value[0] == "color"):
+                    if(edit_point and is_int(input_value[1])): #POINT MODE
+                        color = []
+                        if(len(input_value[2:]) == 4):
+                            for v in input_value[2:]:
+                                if(is_int(v) and int(v) < 256 and int(v) >= 0):
+                                    color.append(int(v))
+                                else:
+                                    print("Color must be number in range (0-255).")
+                            if(len(color) == 4):
+                                image_file.set_color_point(int(input_value[1]), color)
+                                print("Point {} set to color {}".format(input_value[1], input_value[2:]))
                             else:
                                 print("Color must be number in range (0-255).")
-                        if(len(color) == 4):
-                            image_file.set_color_point(int(input_value[1]), color)
-                            print("Point {} set to color {}".format(input_value[1], input_value[2:]))
                         else:
-                            print("Color must be number in range (0-255).")
-                    else:
-                        print("Color must be R G B A.")
-                else: #MASK MODE
-                    color = []
-                    if(len(input_value[1:]) == 4):
-                        for v in input_value[1:]:
-                            if(is_int(v)):
-                                color.append(int(v))
-                        if(len(color) == 4):
-                            image_file.get_mask(actual_index).set_color(color)
-                            print("Mask set to color {}".format(input_value[1:]))
-            #DATA PRINT
-            elif(input_value[0] == "data"):
-                print("Points :")
-                for i,point in enumerate(image_file.points):
-                    print("\t",i,point[:4],"color : ",point[4:])
-                print("________\nMasks:")
-                for i,mask in enumerate(image_file.masks):
-                    print("\t",i)
-                    for j,point in enumerate(mask.points):
-                        print("\t\t",j,point)
-            #HELP
-            elif(input_value[0] == "help" or input_value[0] == "h" or input_value[0] == "?"):
-                print("  save : \n\t\tSave the mim file to the output file provided or to the default output file ({}).".format("{}/{}.mim".format(os.path.dirname(args.path_in),os.path.splitext(args.path_in)[0])))
-                print("  nifti index|all: \n\t\tSave the mask at the index (or all masks if \"all\" is specified) to a nifti file.")
-                print("  m|mask|masks [index] : \n\t\tEdit new mask or specific mask if index provided.")
-                print("  p|point|points : \n\t\tEdit points.")
-                print("  d|del|delete [mask] index : \n\t\tDelete point at index (from data if in point mode, from mask if in mask mode) or mask if specified \"mask\".")
-                print("  c|col|color [index] R G B A : \n\t\tSet point at index to color (R,G,B,A) if in point mode, set mask to color if in mask mode.")
-                print("  data : \n\t\tPrint all masks and points.")
-                print("  ?|h|help : \n\t\tPrint this help.")
-                print("  SAG COR AXI [T] [R G B A] : \n\t\tAdd point (4D) and color to data if in point mode, add point (3D) if in mask mode.")
-                print("  exit : \n\t\tExit (Be careful, it won't save automatically)")
-            #POINT ADDITION
-            elif(input_value[0] != "exit"):
-                if(edit_point): #POINT MODE
-                    point = []
-                    if(len(input_value) == 4 or len(input_value) == 8):
-                        for v in input_value:
-                            if(is_int(v)):
-                                point.append(int(v))
-                        if(len(point) == 4 or len(point) == 8):
-                            image_file.add_point(point[:4], point[4:])
-                            print("Point {} added".format(point[:4]), "with color {}".format(point[4:]) if point[4:] else "")
-                else: #MASK MODE
-                    point = []
-                    if(len(input_value) == 3):
-                        for v in input_value:
-                            if(is_int(v)):
-                                point.append(int(v))
-                        if(len(point) == 3):
-                            err = image_file.get_mask(actual_index).add_point(point)
-                            if err:
-                                print("Point {} not in mask's plan".format(point))
-                            else:
-                                print("Point {} added".format(point))
-#SLICE RECUPERATION MODE
-else:
-    #Save every slices corresponding to the given options
-    if(args.all):
-        for i in range(args.img_nb if args.img_nb else 0, args.img_nb + 1 if args.img_nb else image_file.shape[3]):
-            for j in range(plane_nb if args.plane else 0, plane_nb + 1 if args.plane else 3):
-                if(args.slice_nb is not None and (args.slice_nb < 0 or args.slice_nb > image_file.shape[j])):
-                    parser.error('argument -s/--slice_nb: invalid choice {} (choose in range 0-{} for {} plane)'.format(args.slice_nb, image_file.shape[j], {0:'SAG', 1:'COR', 2:'AXI'}.get(j)))
-                for k in range(args.slice_nb if args.slice_nb else 0, args.slice_nb + 1 if args.slice_nb else image_file.shape[j]):
-                    img, scale = image_file.get_slice(i, j, k, contrast_min, contrast_max, args.cmap)
-                    path_out = "{}/{}/{}/{}/{}.png".format((os.path.dirname(args.path_out) if args.path_out else os.path.dirname(args.path_in)),os.path.splitext(args.path_in)[0],i,{0:'SAG', 1:'COR', 2:'AXI'}.get(j),k)
-                    ensure_dir(path_out)
-                    Mimir_lib.save_slice(img, path_out)
+                            print("Color must be R G B A.")
+                    else: #MASK MODE
+                        color = []
+                        if(len(input_value[1:]) == 4):
+                            for v in input_value[1:]:
+                                if(is_int(v)):
+                                    color.append(int(v))
+                            if(len(color) == 4):
+                                image_file.get_mask(actual_index).set_color(color)
+                                print("Mask set to color {}".format(input_value[1:]))
+                #DATA PRINT
+                elif(input_value[0] == "data"):
+                    print("Points :")
+                    for i,point in enumerate(image_file.points):
+                        print("\t",i,point[:4],"color : ",point[4:])
+                    print("________\nMasks:")
+                    for i,mask in enumerate(image_file.masks):
+                        print("\t",i)
+                        for j,point in enumerate(mask.points):
+                            print("\t\t",j,point)
+                #HELP
+                elif(input_value[0] == "help" or input_value[0] == "h" or input_value[0] == "?"):
+                    print("  save : \n\t\tSave the mim file to the output file provided or to the default output file ({}).".format("{}/{}.mim".format(os.path.dirname(args.path_in),os.path.splitext(args.path_in)[0])))
+                    print("  nifti index|all: \n\t\tSave the mask at the index (or all masks if \"all\" is specified) to a nifti file.")
+                    print("  nifti labels: \n\t\tSave all masks to a single nifti file, the voxels of the mask at index i being labelled i+1, and the colors of the labels to a .json file.")
+                    print("  m|mask|masks [index] : \n\t\tEdit new mask or specific mask if index provided.")
+                    print("  mask3d SAG|COR|AXI : \n\t\tEdit new 3D mask, made of polygons on key slices of the plane (the slices between are interpolated).")
+                    print("  p|point|points : \n\t\tEdit points.")
+                    print("  d|del|delete [mask] index : \n\t\tDelete point at index (from data if in point mode, from mask if in mask mode) or mask if specified \"mask\".")
+                    print("  c|col|color [index] R G B A : \n\t\tSet point at index to color (R,G,B,A) if in point mode, set mask to color if in mask mode.")
+                    print("  data : \n\t\tPrint all masks and points.")
+                    print("  ?|h|help : \n\t\tPrint this help.")
+                    print("  SAG COR AXI [T] [R G B A] : \n\t\tAdd point (4D) and color to data if in point mode, add point (3D) if in mask mode.")
+                    print("  exit : \n\t\tExit (Be careful, it won't save automatically)")
+                #POINT ADDITION
+                elif(input_value[0] != "exit"):
+                    if(edit_point): #POINT MODE
+                        point = []
+                        if(len(input_value) == 4 or len(input_value) == 8):
+                            for v in input_value:
+                                if(is_int(v)):
+                                    point.append(int(v))
+                            if(len(point) == 4 or len(point) == 8):
+                                image_file.add_point(point[:4], point[4:])
+                                print("Point {} added".format(point[:4]), "with color {}".format(point[4:]) if point[4:] else "")
+                    else: #MASK MODE
+                        point = []
+                        if(len(input_value) == 3):
+                            for v in input_value:
+                                if(is_int(v)):
+                                    point.append(int(v))
+                            if(len(point) == 3):
+                                err = image_file.get_mask(actual_index).add_point(point)
+                                if err:
+                                    print("Point {} not in mask's plan".format(point))
+                                else:
+                                    print("Point {} added".format(point))
+    #SLICE RECUPERATION MODE
+    elif(args.stack):
+        try:
+            outputs, slices = save_stacks(image_file, args, args.path_in, args.jobs)
+        except ValueError as e:
+            parser.error(str(e))
+        if(args.profile):
+            print_profile(Mimir_lib.get_profiler().get_stats(), time.perf_counter() - start, slices, args.jobs)
     else:
-        if (args.plane and args.slice_nb is not None):
-            if(args.slice_nb is not None and (args.slice_nb < 0 or args.slice_nb > image_file.shape[plane_nb])):
-                parser.error('argument -s/--slice_nb: invalid choice {} (choose in range 0-{} for {} plane)'.format(args.slice_nb, image_file.shape[plane_nb], {0:'SAG', 1:'COR', 2:'AXI'}.get(plane_nb)))
-            img, scale = image_file.get_slice(args.img_nb if args.img_nb else 0, plane_nb, args.slice_nb, contrast_min, contrast_max, args.cmap)
-            path_out = args.path_out if args.path_out else "{}/{}.png".format(os.path.dirname(args.path_in),os.path.splitext(args.path_in)[0])
-            
-            ensure_dir(path_out)
-            Mimir_lib.save_slice(img, path_out)
-        else:
-            parser.error('both plane and slice_nb arguments are obligatory if --all or -e|--edit flag are not set.')
\ No newline at end of file
+        try:
+            tasks = get_tasks(image_file, args, args.path_in, args.path_out)
+        except ValueError as e:
+            parser.error(str(e))
+        # slices are rendered (by args.jobs processes) while the previous ones are written
+        Mimir_lib.export_slices(image_file, tasks, args.jobs, interpolation=args.interpolation, encoder=args.encoder, compress_level=args.compress_level, quality=args.quality)
+        if(args.profile):
+            print_profile(Mimir_lib.get_profiler().get_stats(), time.perf_counter() - start, len(tasks), args.jobs)
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,452 @@
 from PIL import Image, ImageDraw
+import collections
+import csv
+import functools
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
 import numpy
 import nibabel
 import pickle
 from matplotlib import cm
 from matplotlib.path import Path
 
+## Maximum size (in bytes) of a block of the volume read at once in lazy mode
+BLOCK_BYTES = 64 * 1024 * 1024
+## Default size (in bytes) of the cache of rendered slices
+CACHE_BYTES = 256 * 1024 * 1024
+## Smallest size (largest dimension, in voxels) of the coarsest level of the pyramid of an image
+PYRAMID_MIN_SIZE = 32
+## Number of bins of the histograms of data which isn't made of 8 or 16 bits integers
+HISTOGRAM_BINS = 4096
+## Default percentiles of the intensities used as contrast window by Fd_data.get_auto_contrast
+AUTO_CONTRAST_MIN = 1
+AUTO_CONTRAST_MAX = 99
+
+## Interpolations available to scale the slices according to the voxel sizes
+INTERPOLATIONS = ('nearest', 'bilinear')
+## Encoders available to save the slices: lossless PNG, raw uint8 RGB array (.npy), lossless WebP and JPEG (for previews)
+ENCODERS = ('png', 'npy', 'webp', 'jpeg')
+## Extension of the files written by each encoder
+ENCODER_EXTENSIONS = {'png': '.png', 'npy': '.npy', 'webp': '.webp', 'jpeg': '.jpg'}
+## Stages measured by the Profiler, in the order of the rendering
+PROFILE_STAGES = ('load', 'read', 'contrast', 'colormap', 'overlay', 'resample', 'render', 'cache_hit', 'encode', 'write')
+
+## @brief Number of calls, time and size of the data processed by the stages of the rendering
+# @details The stages (see PROFILE_STAGES) are: loading an image (load), reading a plane (read), scaling its values to
+# 0-255 (contrast), looking up the colors (colormap, which also applies the contrast of 8 and 16 bits integers),
+# drawing the points and masks (overlay), rotating and scaling the slice (resample), the whole rendering of a slice
+# including the previous stages (render), getting a slice from the cache (cache_hit), compressing a PNG (encode) and
+# writing the files of export_slices (write). The profiler can be used from several threads.
+class Profiler:
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    ## @brief Record a call of a stage
+    # @param stage Name of the stage
+    # @param seconds Time of the call
+    # @param size Size (in bytes) of the data processed
+    def add(self, stage, seconds, size=0):
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = {'count': 0, 'time': 0.0, 'bytes': 0, 'last': 0.0}
+            stats['count'] += 1
+            stats['time'] += seconds
+            stats['bytes'] += size
+            stats['last'] = seconds
+
+    ## @brief Add the statistics of another profiler (of another process)
+    # @param stages Statistics returned by get_stats
+    def merge(self, stages):
+        with self._lock:
+            for stage, other in stages.items():
+                stats = self._stages.setdefault(stage, {'count': 0, 'time': 0.0, 'bytes': 0, 'last': 0.0})
+                stats['count'] += other['count']
+                stats['time'] += other['time']
+                stats['bytes'] += other['bytes']
+                stats['last'] = other['last']
+
+    ## @brief Get the statistics of the stages
+    # @details Return a dictionary giving for each stage called its number of calls (count), total time in seconds
+    # (time), total size in bytes of the data processed (bytes) and time of the last call (last)
+    def get_stats(self):
+        with self._lock:
+            return {stage: dict(stats) for stage, stats in self._stages.items()}
+
+    ## @brief Get the statistics of the stages and reset them
+    def pop_stats(self):
+        with self._lock:
+            stages = self._stages
+            self._stages = {}
+            return stages
+
+    ## @brief Reset the statistics
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+
+## Profiler of the rendering, None when profiling is disabled (the stages are then not measured at all)
+_profiler = None
+
+## @brief Start measuring the stages of the rendering
+# @details Return the profiler, which is kept if profiling was already enabled
+def enable_profiling():
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler()
+    return _profiler
+
+## @brief Stop measuring the stages of the rendering
+def disable_profiling():
+    global _profiler
+    _profiler = None
+
+## @brief Get the profiler of the rendering
+# @details Return None if profiling is disabled
+def get_profiler():
+    return _profiler
+
+## @brief Bounded cache of rendered slices
+# @details When the total size of the entries exceeds the budget, the least recently used entries are evicted.
+# The cache can be used from several threads.
+class SliceCache:
+
+    ## @brief Create an empty cache
+    # @param max_bytes Maximum total size of the entries
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    ## @brief Get an entry
+    # @details Return the value of the entry, None if the key isn't in the cache
+    # @param key Key of the entry
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    ## @brief Add an entry
+    # @param key Key of the entry
+    # @param value Value of the entry
+    # @param size Size (in bytes) of the value
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.size -= self._entries.popitem(last=False)[1][1]
+
+    ## @brief Remove some entries
+    # @param predicate Function called with the key of each entry, returning true if the entry must be removed
+    def discard(self, predicate):
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self.size -= self._entries.pop(key)[1]
+
+    ## @brief Remove every entry
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+## @brief Histogram of the intensities of an image
+# @details There is one histogram for each cycle (temporal) of the image. Data made of 8 or 16 bits integers has one bin
+# for each value, so its percentiles are exact.
+class Histogram:
+
+    ## @brief Create a histogram
+    # @param edges Edges of the bins (number of bins + 1)
+    # @param counts Number of voxels in each bin, for each cycle (number of cycles x number of bins)
+    # @param exact True if each bin holds a single value (the lower edge of the bin)
+    def __init__(self, edges, counts, exact):
+        self.edges = edges
+        self.counts = counts
+        self.exact = exact
+
+    ## @brief Get the intensity below which a percentage of the voxels are
+    # @param percent Percentage (0-100) of the voxels
+    # @param img_nb Number of the cycle (temporal), every cycle if None
+    def get_percentile(self, percent, img_nb=None):
+        counts = self.counts[img_nb] if img_nb is not None else self.counts.sum(axis=0)
+        cumulative = numpy.cumsum(counts)
+        rank = min(max(percent, 0), 100) / 100 * cumulative[-1]
+        # first bin reaching the rank (the first non-empty bin for 0%)
+        i = int(numpy.searchsorted(cumulative, rank, 'left' if rank > 0 else 'right'))
+        if self.exact:
+            return self.edges[i]
+        # linear interpolation inside the bin
+        return self.edges[i] + (self.edges[i + 1] - self.edges[i]) * (rank - cumulative[i] + counts[i]) / counts[i]
+
 ## @brief Data of the loaded image
 class Fd_data:
 
-    def __init__(self, path):
+    ## @brief Load an image file
+    # @details In lazy mode, the voxels are not loaded in memory: the nibabel proxy (memory-mapped for uncompressed
+    # .nii files) is kept and only the planes requested by get_slice are read and scaled. Compressed files (.nii.gz)
+    # can't be memory-mapped, so every read has to go through the gzip stream and eager mode is usually faster for them.
+    # @param path Path of the image file
+    # @param lazy If true, read the voxels on demand instead of loading the whole volume
+    def __init__(self, path, lazy=False):
+        self.path = path
         self.img = nibabel.load(path)
-        self.data = self.img.get_data()
-        self.header = self.img.get_header()
-        self.contrast_min = self.data.min()
-        self.contrast_max = self.data.max()
-        self.shape = self.data.shape
+        self.header = self.img.header
+        self.shape = self.img.shape
+        self.lazy = lazy
+        profiler = _profiler
+        if profiler: start = time.perf_counter()
+        if lazy:
+            self.data = None
+            self._contrast_range = None
+        else:
+            self.data = self.img.get_data()
+            self._contrast_range = (self.data.min(), self.data.max())
+        if profiler: profiler.add('load', time.perf_counter() - start, self.data.nbytes if self.data is not None else 0)
+        self._histogram = None
         self.points = []
         self.masks = []
         self.default_color = [255,0,0,255]
-    
+        # points by (plane_nb, slice_nb, img_nb) of the slices they are drawn on
+        self._points_index = {}
+        self.cache = None
+        # incremented when all the points and masks are replaced
+        self._annotations_version = 0
+        # number of changes of the points and masks drawn on each (plane_nb, slice_nb, img_nb), img_nb being None for
+        # the changes visible on every cycle (masks)
+        self._slice_versions = collections.Counter()
+        # (version, slices) of each mask when the changes of the masks were last looked for
+        self._masks_slices = {}
+        self._slice_versions_lock = threading.Lock()
+        # levels of the pyramid built or loaded (the first one, None, is the image itself), None if it isn't used
+        self._pyramid = None
+        self._pyramid_persist = False
+        # if false, the slices are only read from the levels saved in get_pyramid_path(), none being built
+        self._pyramid_build = True
+        # true once the saved levels have been looked for, when they aren't built
+        self._pyramid_searched = False
+        self._pyramid_lock = threading.Lock()
+
+    ## @brief Keep the rendered slices in a cache
+    # @details Rendering a slice already in the cache returns the cached image, which must not be modified. When the
+    # points or the masks change, only the slices they are drawn on are removed from the cache, and the slices are
+    # rendered again from their cached intensities (before drawing the points and masks).
+    # @param max_bytes Maximum size (in bytes) of the cached images
+    def enable_cache(self, max_bytes=CACHE_BYTES):
+        self.cache = SliceCache(max_bytes)
+
+    ## @brief Stop caching the rendered slices
+    def disable_cache(self):
+        self.cache = None
+
+    ## @brief Render the slices asked with a maximum size from a pyramid of downsampled volumes
+    # @details Each level of the pyramid halves the size of the previous one (the mean of 2x2x2 voxels), down to
+    # PYRAMID_MIN_SIZE voxels. A slice asked with a max_size smaller than its size is read from the coarsest level
+    # which still has as many voxels as the pixels of the slice, so its cost depends on the size of the slice and not
+    # on the size of the image. The levels are built when first needed, reading the image block by block, or loaded
+    # (memory-mapped) from get_pyramid_path() if they have been saved there after the last change of the image file.
+    # Without building, only the saved levels are used: the slices are read from the image beyond them, so that a
+    # slice is never delayed by reading the whole image (see save_pyramid to save the levels).
+    # @param persist If true, the levels built are saved in get_pyramid_path()
+    # @param build If true, the levels missing are built when first needed, otherwise only the saved ones are used
+    def enable_pyramid(self, persist=False, build=True):
+        with self._pyramid_lock:
+            if self._pyramid is None:
+                self._pyramid = [None]
+            self._pyramid_persist = persist
+            self._pyramid_build = build
+
+    ## @brief Stop using the pyramid
+    def disable_pyramid(self):
+        with self._pyramid_lock:
+            self._pyramid = None
+            self._pyramid_searched = False
+        if self.cache is not None:
+            self.cache.discard(lambda key: key[0] == 'layer' and key[-1] > 0)
+
+    ## @brief Get the path of the directory where the pyramid is saved
+    # @details The directory is next to the image file, named after it with the .pyramid extension
+    def get_pyramid_path(self):
+        path = self.path[:-3] if self.path.endswith('.gz') else self.path
+        return os.path.splitext(path)[0] + '.pyramid'
+
+    ## @brief Get the number of levels of the pyramid
+    # @details The first level is the image itself
+    def get_pyramid_size(self):
+        size = max(self.shape[:3])
+        levels = 1
+        while -(-size // 2 ** levels) >= PYRAMID_MIN_SIZE:
+            levels += 1
+        return levels
+
+    ## @brief Get a level of the pyramid
+    # @details Return the data of the level, with the first 3 dimensions of the image divided by 2 ** level (rounded
+    # up), building or loading it and the previous levels if needed. The data of the image (or its nibabel proxy in lazy
+    # mode) is returned for the level 0.
+    # @param level Number of the level
+    def get_pyramid_level(self, level):
+        if level == 0:
+            return self.data if self.data is not None else self.img.dataobj
+        with self._pyramid_lock:
+            if self._pyramid is None:
+                raise ValueError('The pyramid is not enabled')
+            if level >= self.get_pyramid_size():
+                raise ValueError('Level {} out of range 0-{}'.format(level, self.get_pyramid_size() - 1))
+            while len(self._pyramid) <= level:
+                self._pyramid.append(self._load_pyramid_level(len(self._pyramid)))
+            return self._pyramid[level]
+
+    ## @brief Get the number of levels of the pyramid the slices can be read from
+    # @details All the levels if they are built when needed, otherwise the levels loaded so far and the ones saved in
+    # get_pyramid_path() (looked for once), 1 if the pyramid isn't used
+    def _get_ready_pyramid_size(self):
+        with self._pyramid_lock:
+            if self._pyramid is None:
+                return 1
+            if self._pyramid_build:
+                return self.get_pyramid_size()
+            if not self._pyramid_searched:
+                self._pyramid_searched = True
+                while len(self._pyramid) < self.get_pyramid_size():
+                    data = self._read_pyramid_level(len(self._pyramid))
+                    if data is None:
+                        break
+                    self._pyramid.append(data)
+            return len(self._pyramid)
+
+    ## @brief Load a saved level of the pyramid
+    # @details Return the level (memory-mapped) from get_pyramid_path(), or None if it wasn't saved there after the
+    # last change of the image file
+    # @param level Number of the level
+    def _read_pyramid_level(self, level):
+        shape = tuple(-(-n // 2 ** level) for n in self.shape[:3]) + tuple(self.shape[3:])
+        level_path = os.path.join(self.get_pyramid_path(), 'level{}.npy'.format(level))
+        if os.path.isfile(level_path) and os.path.getmtime(level_path) >= os.path.getmtime(self.path):
+            data = numpy.load(level_path, mmap_mode='r')
+            if data.shape == shape:
+                return data
+        return None
+
+    ## @brief Build or load a level of the pyramid
+    # @details The level is loaded from get_pyramid_path() if it was saved after the last change of the image file,
+    # otherwise it is built from the previous one (which must be loaded) and saved if the pyramid is persisted
+    # @param level Number of the level
+    def _load_pyramid_level(self, level):
+        data = self._read_pyramid_level(level)
+        if data is not None:
+            return data
+        shape = tuple(-(-n // 2 ** level) for n in self.shape[:3]) + tuple(self.shape[3:])
+        level_path = os.path.join(self.get_pyramid_path(), 'level{}.npy'.format(level))
+        source = self._pyramid[level - 1] if level > 1 else self.get_pyramid_level(0)
+        # blocks of an even number of axial slices (as float64 in the worst case), downsampled one by one
+        depth = max(2, BLOCK_BYTES // (int(numpy.prod(source.shape)) // source.shape[2] * 8) // 2 * 2)
+        data = None
+        for start in range(0, source.shape[2], depth):
+            block = downsample_volume(numpy.asarray(source[:, :, start:start + depth]))
+            if data is None:
+                if self._pyramid_persist:
+                    os.makedirs(self.get_pyramid_path(), exist_ok=True)
+                    # written under another name, so a partial level is never loaded
+                    data = numpy.lib.format.open_memmap(level_path + '.tmp', 'w+', block.dtype, shape)
+                else:
+                    data = numpy.empty(shape, block.dtype)
+            data[:, :, start // 2:start // 2 + block.shape[2]] = block
+        if self._pyramid_persist:
+            data.flush()
+            del data
+            os.replace(level_path + '.tmp', level_path)
+            data = numpy.load(level_path, mmap_mode='r')
+        return data
+
+    ## @brief Build and save every level of the pyramid
+    # @details The levels are saved in get_pyramid_path(), the pyramid being enabled, built and persisted from now on
+    def save_pyramid(self):
+        self.enable_pyramid(True, True)
+        for level in range(1, self.get_pyramid_size()):
+            self.get_pyramid_level(level)
+
+    ## @brief Get the version of the points and masks drawn on a slice
+    # @details The version changes each time a point or a mask drawn on the slice (before or after the change) is
+    # modified, so a slice only needs to be drawn again if its version changed.
+    # @param img_nb Number of the cycle (temporal) of the slice
+    # @param plane_nb Number of the plane (0:sagittal, 1:coronal, 2:axial) of the slice
+    # @param slice_nb Number of the slice in the plane
+    def get_slice_version(self, img_nb, plane_nb, slice_nb):
+        self._update_masks_slices()
+        return (self._annotations_version, self._slice_versions[(plane_nb, slice_nb, img_nb)], self._slice_versions[(plane_nb, slice_nb, None)])
+
+    ## @brief Record a change of the points or masks
+    # @details The rendered images of the changed slices are removed from the cache
+    # @param slices (plane_nb, slice_nb, img_nb) of the changed slices, img_nb being None for every cycle
+    def _changed_slices(self, slices):
+        slices = set(slices)
+        if not slices:
+            return
+        with self._slice_versions_lock:
+            self._slice_versions.update(slices)
+        if self.cache is not None:
+            self.cache.discard(lambda key: key[0] == 'slice' and ((key[2], key[3], key[1]) in slices or (key[2], key[3], None) in slices))
+
+    ## @brief Record all the points and masks as changed
+    def _changed_all(self):
+        with self._slice_versions_lock:
+            self._annotations_version += 1
+        if self.cache is not None:
+            self.cache.discard(lambda key: key[0] == 'slice')
+
+    ## @brief Record the changes of the masks
+    # @details The masks can be modified directly, so their versions are compared to the ones seen last time. The
+    # slices a changed mask was drawn on before the change and the ones it is drawn on now are all changed.
+    def _update_masks_slices(self):
+        changed = []
+        with self._slice_versions_lock:
+            masks_slices = {}
+            for mask in self.masks:
+                previous = self._masks_slices.pop(mask, None)
+                if previous is not None and previous[0] == mask.version:
+                    masks_slices[mask] = previous
+                    continue
+                masks_slices[mask] = (mask.version, mask.get_slices())
+                changed.append(masks_slices[mask][1])
+                if previous is not None:
+                    changed.append(previous[1])
+            # the masks left have been removed
+            changed.extend(slices for version, slices in self._masks_slices.values())
+            self._masks_slices = masks_slices
+        self._changed_slices((plane_nb, slice_nb, None) for slices in changed for plane_nb, slice_nb in slices)
+
+    ## @brief Minimum value of the data
+    # @details In lazy mode, it is computed on first access by reading the volume block by block
+    @property
+    def contrast_min(self):
+        return self._get_contrast_range()[0]
+
+    ## @brief Maximum value of the data
+    # @details In lazy mode, it is computed on first access by reading the volume block by block
+    @property
+    def contrast_max(self):
+        return self._get_contrast_range()[1]
+
     ## @brief Get minimum contrast of the data
     def get_contrast_min(self):
         return self.contrast_min
@@ -27,82 +455,353 @@ class Fd_data:
     def get_contrast_max(self):
         return self.contrast_max
 
+    ## @brief Compute (once) the range of values of the data
+    def _get_contrast_range(self):
+        if self._contrast_range is None:
+            minimum, maximum = None, None
+            for block in self._iter_blocks():
+                block_min, block_max = block.min(), block.max()
+                minimum = block_min if minimum is None else min(minimum, block_min)
+                maximum = block_max if maximum is None else max(maximum, block_max)
+            self._contrast_range = (minimum, maximum)
+        return self._contrast_range
+
+    ## @brief Check if the range of values of the data is known
+    # @details Always true in eager mode; in lazy mode, false until contrast_min, contrast_max or the histogram has
+    # read the whole volume
+    def has_contrast_range(self):
+        return self._contrast_range is not None
+
+    ## @brief Get the display range of the header
+    # @details Return (cal_min, cal_max) of the NIfTI header, in intensities of the image, or None if they aren't set
+    def get_header_range(self):
+        cal_min, cal_max = float(self.header['cal_min']), float(self.header['cal_max'])
+        return (cal_min, cal_max) if cal_max > cal_min else None
+
+    ## @brief Get the range of values of the data without reading the whole volume
+    # @details Return the range of the data if it is known (see has_contrast_range), otherwise the display range of the
+    # header if it is set, otherwise the range of the middle slices of the first cycle, which are the first ones shown.
+    # The exact range can then be computed in the background.
+    def get_contrast_estimate(self):
+        if self._contrast_range is not None:
+            return self._contrast_range
+        header_range = self.get_header_range()
+        if header_range is not None:
+            return header_range
+        planes = [self._read_plane(0, plane_nb, self.shape[plane_nb] // 2) for plane_nb in range(3)]
+        return min(plane.min() for plane in planes), max(plane.max() for plane in planes)
+
+    ## @brief Get the histogram of the intensities
+    # @details It is computed once, reading the data block by block: in a single pass for data made of 8 or 16 bits
+    # integers, after the range of the data is known otherwise
+    def get_histogram(self):
+        if self._histogram is None:
+            cycles = range(self.shape[3]) if len(self.shape) == 4 else [None]
+            dtype = numpy.asarray(self._read_plane(0, 2, 0)).dtype
+            if dtype.kind in 'iu' and dtype.itemsize <= 2:
+                offset = numpy.iinfo(dtype).min
+                # counts of every possible value, only kept between the minimum and maximum of each cycle
+                cycles_counts = []
+                for cycle in cycles:
+                    counts = numpy.zeros(2 ** (8 * dtype.itemsize), dtype=numpy.int64)
+                    for block in self._iter_blocks(cycle):
+                        counts += numpy.bincount(block.ravel().astype(numpy.int64) - offset, minlength=len(counts))
+                    used = numpy.flatnonzero(counts)
+                    cycles_counts.append((used[0], counts[used[0]:used[-1] + 1]))
+                first = min(start for start, counts in cycles_counts)
+                last = max(start + len(counts) for start, counts in cycles_counts)
+                histogram_counts = numpy.zeros((len(cycles_counts), last - first), dtype=numpy.int64)
+                for i, (start, counts) in enumerate(cycles_counts):
+                    histogram_counts[i, start - first:start - first + len(counts)] = counts
+                self._histogram = Histogram(numpy.arange(first + offset, last + offset + 1), histogram_counts, True)
+                if self._contrast_range is None:
+                    self._contrast_range = (dtype.type(first + offset), dtype.type(last + offset - 1))
+            else:
+                minimum, maximum = self._get_contrast_range()
+                histogram_counts = numpy.zeros((len(cycles), HISTOGRAM_BINS), dtype=numpy.int64)
+                for i, cycle in enumerate(cycles):
+                    for block in self._iter_blocks(cycle):
+                        histogram_counts[i] += numpy.histogram(block, HISTOGRAM_BINS, (minimum, maximum))[0]
+                edges = numpy.linspace(minimum, maximum, HISTOGRAM_BINS + 1)
+                self._histogram = Histogram(edges, histogram_counts, False)
+        return self._histogram
+
+    ## @brief Get the intensity below which a percentage of the voxels are
+    # @param percent Percentage (0-100) of the voxels
+    # @param img_nb Number of the cycle (temporal), every cycle if None
+    def get_percentile(self, percent, img_nb=None):
+        return self.get_histogram().get_percentile(percent, img_nb if len(self.shape) == 4 else None)
+
+    ## @brief Get a contrast window ignoring the extreme intensities
+    # @details Return the (minimum, maximum) contrast given by percentiles of the intensities
+    # @param percent_min Percentage of the voxels below the minimum contrast
+    # @param percent_max Percentage of the voxels below the maximum contrast
+    # @param img_nb Number of the cycle (temporal), every cycle if None
+    def get_auto_contrast(self, percent_min=AUTO_CONTRAST_MIN, percent_max=AUTO_CONTRAST_MAX, img_nb=None):
+        return self.get_percentile(percent_min, img_nb), self.get_percentile(percent_max, img_nb)
+
+    ## @brief Iterate over the data by blocks of axial slices
+    # @details Only one block (at most BLOCK_BYTES) is held in memory at a time in lazy mode
+    # @param img_nb Number of the cycle (temporal) to read, every cycle if None
+    def _iter_blocks(self, img_nb=None):
+        source = self.data if self.data is not None else self.img.dataobj
+        cycles = [img_nb] if img_nb is not None else range(self.shape[3]) if len(self.shape) == 4 else [None]
+        # scaled data is read as float64, so 8 bytes per voxel is the worst case
+        depth = max(1, BLOCK_BYTES // (self.shape[0] * self.shape[1] * 8))
+        for cycle in cycles:
+            for start in range(0, self.shape[2], depth):
+                block_range = (slice(None), slice(None), slice(start, start + depth))
+                if cycle is not None: block_range = block_range + (cycle,)
+                yield numpy.asarray(source[block_range])
+
+    ## @brief Read a plane of the data
+    # @details Return a 2D array, read from the file in lazy mode (with the scaling of the header applied)
+    # @param img_nb Number of the cycle (temporal) of the chosen slice
+    # @param plane_nb Number of the plane (0:sagittal, 1:coronal, 2:axial) of the chosen slice
+    # @param slice_nb Number of the slice in the plane
+    # @param level Level of the pyramid read (see get_pyramid_level), the slice being the one holding slice_nb
+    def _read_plane(self, img_nb, plane_nb, slice_nb, level=0):
+        # the slice(None) index will take an entire dimension, so using 2 of them and a number will reduce the
+        # dimensions of the original array by one if the image is 3D
+        slice_range = [slice(None)] * 3
+        slice_range[plane_nb] = slice_nb // 2 ** level
+        slice_range = tuple(slice_range)
+
+        # if the original image is 4D, we need to further reduce the number of dimensions by selecting a 3D image
+        if len(self.shape) == 4: slice_range = slice_range + (img_nb,)
+
+        profiler = _profiler
+        if profiler: start = time.perf_counter()
+        if level > 0:
+            plane = numpy.asarray(self.get_pyramid_level(level)[slice_range])
+        elif self.data is not None:
+            plane = self.data[slice_range]
+        else:
+            plane = numpy.asarray(self.img.dataobj[slice_range])
+        if profiler: profiler.add('read', time.perf_counter() - start, plane.nbytes)
+        return plane
+
     ## @brief Get shape of the data
     # @details Number of slices in each dimension
     def get_shape(self):
         return self.shape
 
     ## @brief Get an image of a specific slice
-    # @details Return an image of the chosen slice
+    # @details Return an image of the chosen slice and the scales of its width and height (pixels per voxel)
     # @param img_nb Number of the cycle (temporal) of the chosen slice
     # @param plane_nb Number of the plane (0:sagittal, 1:coronal, 1:axial) of the chosen slice
     # @param slice_nb Number of the slice in the plane
     # @param contrast_min Minimum value wanted for the image
     # @param contrast_max Maximum value wanted for the image
     # @param colormap Name of the colormap to apply on the image
-    def get_slice(self, img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap):
-        # the slice(None) index will take an entire dimension, so using 2 of them and a number will reduce the
-        # dimensions of the original array by one if the image is 3D
-        slice_range = [slice(None)] * 3
-        slice_range[plane_nb] = slice_nb
-        slice_range = tuple(slice_range)
+    # @param interpolation Interpolation used to scale the image according to the voxel sizes (see INTERPOLATIONS)
+    # @param overlays If false, the points and masks are not drawn
+    # @param max_size Maximum width and height of the image, which is scaled down (keeping its proportions) if it is
+    # larger, None for no maximum (see enable_pyramid)
+    def get_slice(self, img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap, interpolation='nearest', overlays=True, max_size=None):
+        array, scale = self.get_slice_array(img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap, interpolation, overlays, max_size)
+        return slice_to_image(array), scale
 
-        # if the original image is 4D, we need to further reduce the number of dimensions by selecting a 3D image
-        if len(self.shape) == 4: slice_range = slice_range + (img_nb,)
-        
-        # after the 2D plane has been extracted, the contrast must be changed according to the contrast sliders' values
-        plane = numpy.copy(self.data[slice_range])
-        plane[plane < contrast_min] = contrast_min
-        plane[plane > contrast_max] = contrast_max
+    ## @brief Get the pixels of a specific slice
+    # @details Same as get_slice, but the slice is returned as a read-only (height, width, 4) uint8 RGBA array, which
+    # can be shown without any conversion.
+    def get_slice_array(self, img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap, interpolation='nearest', overlays=True, max_size=None):
+        if max_size is not None and max_size >= max(self._get_slice_size(plane_nb)[1]):
+            max_size = None
+        if self.cache is not None:
+            # the version is part of the key, in case a slice rendered with the previous points and masks by another
+            # thread is added after the slice has been removed from the cache
+            version = self.get_slice_version(img_nb, plane_nb, slice_nb) if overlays else None
+            key = ('slice', img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap, interpolation, max_size, version)
+            cached = self.cache.get(key)
+            if cached is None:
+                cached = self._render_slice(img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap, interpolation, overlays, max_size)
+                self.cache.put(key, cached, cached[0].nbytes)
+            elif _profiler:
+                _profiler.add('cache_hit', 0, cached[0].nbytes)
+            return cached
+        return self._render_slice(img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap, interpolation, overlays, max_size)
 
-        converted = numpy.require(numpy.divide(numpy.subtract(plane, contrast_min), (contrast_max - contrast_min) / 255 if contrast_max != contrast_min else 1),
-                                numpy.uint8, 'C')
+    ## @brief Get the pixels of a specific slice if they have already been rendered
+    # @details Return the result of get_slice_array if it is in the cache, None otherwise
+    def get_cached_slice_array(self, img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap, interpolation='nearest', overlays=True, max_size=None):
+        if self.cache is None:
+            return None
+        if max_size is not None and max_size >= max(self._get_slice_size(plane_nb)[1]):
+            max_size = None
+        version = self.get_slice_version(img_nb, plane_nb, slice_nb) if overlays else None
+        return self.cache.get(('slice', img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap, interpolation, max_size, version))
 
-        # the plane next needs to be scaled according to the scales in the NIfTI header
+    ## @brief Get the size of the slices of a plane
+    # @details Return the scales of the width and the height of the rotated slices given by the voxel sizes, and their
+    # (width, height) in pixels
+    # @param plane_nb Number of the plane (0:sagittal, 1:coronal, 2:axial)
+    def _get_slice_size(self, plane_nb):
         scales_indexes = [((x + plane_nb) % 3) + 1 for x in [1, 2]]
-
-        image = Image.fromarray(converted)
-        if colormap:
-            image = set_colormap(image, colormap)
-        image = self._draw_points_masks(image, img_nb, plane_nb, slice_nb)
-        image = image.rotate(90, expand=True)
         pixdim = self.header['pixdim']
-        new_width = int(round(image.width*pixdim[min(scales_indexes)]))
-        new_height = int(round(image.height*pixdim[max(scales_indexes)]))
-        image = image.resize((new_width, new_height))
+        scale = (pixdim[min(scales_indexes)], pixdim[max(scales_indexes)])
+        height, width = [n for i, n in enumerate(self.shape[:3]) if i != plane_nb]
+        return scale, (int(round(height*scale[0])), int(round(width*scale[1])))
 
-        return image, (pixdim[min(scales_indexes)], pixdim[max(scales_indexes)])
+    ## @brief Render the pixels of a specific slice
+    # @details Same as get_slice_array, without the cache
+    def _render_slice(self, img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap, interpolation='nearest', overlays=True, max_size=None):
+        profiler = _profiler
+        if profiler: start = time.perf_counter()
+        # the plane needs to be rotated and scaled according to the scales in the NIfTI header
+        scale, size = self._get_slice_size(plane_nb)
+        level = 0
+        if max_size is not None and max(size) > max_size:
+            ratio = max_size / max(size)
+            size = (max(1, int(round(size[0] * ratio))), max(1, int(round(size[1] * ratio))))
+            height, width = [n for i, n in enumerate(self.shape[:3]) if i != plane_nb]
+            # coarsest level with at least one voxel for each pixel of the slice
+            if self._pyramid is not None:
+                levels = self._get_ready_pyramid_size()
+                while level + 1 < levels and -(-height // 2 ** (level + 1)) >= size[0] and -(-width // 2 ** (level + 1)) >= size[1]:
+                    level += 1
+            scale = (size[0] / height, size[1] / width)
+        layer = self._get_layer(img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap, level)
+        if overlays:
+            if profiler: overlay_start = time.perf_counter()
+            layer = self._draw_points_masks(layer, img_nb, plane_nb, slice_nb, level)
+            if profiler: profiler.add('overlay', time.perf_counter() - overlay_start, layer.nbytes)
 
-    ## @brief Draw the points and masks on the image
-    # @details Return an image of the image with the points and the masks
-    # @param image Image to modify
+        if profiler: resample_start = time.perf_counter()
+        array = resample_slice(layer, scale if level == 0 else (size[0] / layer.shape[0], size[1] / layer.shape[1]), interpolation)
+        # the slice may be cached and shown by other threads
+        array.setflags(write=False)
+        if profiler:
+            end = time.perf_counter()
+            profiler.add('resample', end - resample_start, array.nbytes)
+            profiler.add('render', end - start, array.nbytes)
+        return array, scale
+
+    ## @brief Get the intensities of a slice
+    # @details Return the (height, width, 4) uint8 RGBA array of the plane with the contrast and the colormap applied,
+    # before the points and masks are drawn. It is kept in the cache, so changing the points and masks doesn't need to
+    # read the plane again. At a level of the pyramid, the layer is the one of the slice of the level holding slice_nb.
+    def _get_layer(self, img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap, level=0):
+        key = ('layer', img_nb, plane_nb, slice_nb // 2 ** level, contrast_min, contrast_max, colormap, level)
+        layer = self.cache.get(key) if self.cache is not None else None
+        if layer is None:
+            # after the 2D plane has been extracted, the contrast and the colormap are applied in one lookup
+            plane = self._read_plane(img_nb, plane_nb, slice_nb, level)
+            layer = render_plane(plane, contrast_min, contrast_max, colormap)
+            layer.setflags(write=False)
+            if self.cache is not None:
+                self.cache.put(key, layer, layer.nbytes)
+        return layer
+
+    ## @brief Draw the points and masks on the pixels of a slice
+    # @details Return a (height, width, 4) uint8 RGBA array of the slice with the points and the masks, the array
+    # itself if there are none on the slice
+    # @param layer RGBA array of the slice, in voxel coordinates
     # @param img_nb Number of the cycle (temporal) of the chosen slice
     # @param plane_nb Number of the plane (0:sagittal, 1:coronal, 1:axial) of the chosen slice
     # @param slice_nb Number of the slice in the plane
-    def _draw_points_masks(self, image, img_nb, plane_nb, slice_nb):
-        image = image.convert('RGB')
-        image_draw = ImageDraw.Draw(image, 'RGBA')
-        
-        #Draw masks
+    # @param level Level of the pyramid of the layer: the coordinates of the points and masks are divided by 2 ** level
+    def _draw_points_masks(self, layer, img_nb, plane_nb, slice_nb, level=0):
+        factor = 2 ** level
+        # polygons (list of coordinates) and sections of the 3D masks (origin and array of booleans), in the order of the masks
+        polygons = []
         for mask in self.masks:
+            if isinstance(mask, Mask3D):
+                section = mask.get_section(plane_nb, slice_nb)
+                if section is not None:
+                    if level:
+                        # a voxel of the level is in the section if any of the voxels it is made of is
+                        (row, column), section = section
+                        top, left = row % factor, column % factor
+                        blocks = numpy.zeros((-(-(top + section.shape[0]) // factor), factor, -(-(left + section.shape[1]) // factor), factor), dtype=bool)
+                        blocks.reshape(blocks.shape[0] * factor, -1)[top:top + section.shape[0], left:left + section.shape[1]] = section
+                        section = ((row // factor, column // factor), blocks.any(axis=(1, 3)))
+                    polygons.append((section, mask.get_color() if mask.get_color() else self.default_color))
             mask_points = []
-            for a in mask.points:
-                if a[plane_nb] == slice_nb:
-                    temp_list = a[:plane_nb]+a[plane_nb+1:]
-                    temp_list.reverse()
-                    mask_points.extend(temp_list)
+            for a in mask.get_points_on_slice(plane_nb, slice_nb):
+                temp_list = a[:plane_nb]+a[plane_nb+1:]
+                temp_list.reverse()
+                mask_points.extend(temp_list)
             if len(mask_points) >= 4:
-                color = mask.get_color() if mask.get_color() else self.default_color
+                if level:
+                    mask_points = [c / factor for c in mask_points]
+                polygons.append((mask_points, mask.get_color() if mask.get_color() else self.default_color))
+        points = self.get_points_on_slice(img_nb, plane_nb, slice_nb)
+        if not polygons and not points:
+            return layer
+
+        image = Image.fromarray(layer, 'RGBA').convert('RGB')
+        image_draw = ImageDraw.Draw(image, 'RGBA')
+
+        #Draw masks
+        for mask_points, color in polygons:
+            if isinstance(mask_points, tuple):
+                # section of a 3D mask, blended with the alpha of its color
+                (row, column), section = mask_points
+                alpha = Image.fromarray(section.astype(numpy.uint8) * numpy.uint8(color[3]), 'L')
+                image.paste(tuple(color[:3]), (column, row), alpha)
+            else:
                 image_draw.polygon(tuple(mask_points), fill=tuple(color))
 
         #Draw points
-        for a in self.points:
-            if a[3] == img_nb and a[plane_nb] == slice_nb:
-                color = a[4:] if a[4:] else self.default_color
-                temp_list = a[:plane_nb]+a[plane_nb+1:3]
-                temp_list.reverse()
-                image_draw.ellipse([temp_list[0]-1, temp_list[1]-1, temp_list[0]+1, temp_list[1]+1], fill=tuple(color))
-        return image
+        for a in points:
+            color = a[4:] if a[4:] else self.default_color
+            temp_list = a[:plane_nb]+a[plane_nb+1:3]
+            temp_list.reverse()
+            if level:
+                temp_list = [c / factor for c in temp_list]
+            image_draw.ellipse([temp_list[0]-1, temp_list[1]-1, temp_list[0]+1, temp_list[1]+1], fill=tuple(color))
+        return numpy.asarray(image.convert('RGBA'))
+
+    ## @brief Get the points of a slice
+    # @details Return the points drawn on the slice, in the order of the list of points
+    # @param img_nb Number of the cycle (temporal) of the slice
+    # @param plane_nb Number of the plane (0:sagittal, 1:coronal, 2:axial) of the slice
+    # @param slice_nb Number of the slice in the plane
+    def get_points_on_slice(self, img_nb, plane_nb, slice_nb):
+        return self._points_index.get((plane_nb, slice_nb, img_nb), [])
+
+    ## @brief Add a point to the index of the points
+    # @param point Point (list of coordinates and color)
+    def _index_point(self, point):
+        for plane_nb in range(3):
+            self._points_index.setdefault((plane_nb, point[plane_nb], point[3]), []).append(point)
+
+    ## @brief Replace or remove a point in the index of the points
+    # @param point Point to replace
+    # @param new_point Point to put in its place, None to remove it
+    def _reindex_point(self, point, new_point=None):
+        for plane_nb in range(3):
+            key = (plane_nb, point[plane_nb], point[3])
+            bucket = self._points_index[key]
+            # the point is searched by identity, as several points can have the same coordinates
+            i = next(i for i, a in enumerate(bucket) if a is point)
+            if new_point is None:
+                del bucket[i]
+                if not bucket:
+                    del self._points_index[key]
+            else:
+                bucket[i] = new_point
+
+    ## @brief Rebuild the index of the points
+    # @details The new index replaces the previous one at once, so a slice rendered meanwhile uses either of them
+    def _rebuild_points_index(self):
+        points_index = {}
+        for point in self.points:
+            for plane_nb in range(3):
+                points_index.setdefault((plane_nb, point[plane_nb], point[3]), []).append(point)
+        self._points_index = points_index
+
+    ## @brief Replace all the points and masks
+    # @details The index of the points is rebuilt and every slice is changed
+    # @param points List of points (4D coordinates and color)
+    # @param masks List of masks (Mask or Mask3D)
+    def set_points_masks(self, points, masks):
+        self.points[:] = points
+        self.masks[:] = masks
+        self._rebuild_points_index()
+        self._masks_slices = {mask: (mask.version, mask.get_slices()) for mask in self.masks}
+        self._changed_all()
 
     ## @brief Add a point to the data
     # @param details Add a point to the list of points
@@ -112,18 +811,25 @@ class Fd_data:
         if len(point) == 4 and point not in self.points:
             color_point = color if color and len(color) == 4 else self.default_color
             self.points.append(point+color_point)
+            self._index_point(self.points[-1])
+            self._changed_slices(_point_slices(point))
     
     ## @brief Change color of a point
     # @param index Index of the point in the list
     # @param color (R,G,B,A) color of the point
     def set_color_point(self, index, color):
         if index < len(self.points) and index >= 0 and len(color) == 4:
-            self.points[index] = self.points[index][:4]+color
+            new_point = self.points[index][:4]+color
+            self._reindex_point(self.points[index], new_point)
+            self.points[index] = new_point
+            self._changed_slices(_point_slices(new_point))
 
     ## @brief Delete a point
     # @param index Index of the point in the list
     def delete_point(self, index):
         if index < len(self.points) and index >= 0:
+            self._changed_slices(_point_slices(self.points[index]))
+            self._reindex_point(self.points[index])
             del self.points[index]
     
     ## @brief Return a mask
@@ -133,45 +839,678 @@ class Fd_data:
             self.masks.append(Mask(self.shape[:3], self.header['pixdim']))
         return self.masks[index]
 
+    ## @brief Compute statistics of the intensities in the masks and at the points
+    # @details The voxels of all the regions (masks and points) are gathered at once from each cycle, read block by
+    # block in lazy mode, so only one block of the volume is in memory at a time. A point is a region of one voxel,
+    # at its position on every cycle.
+    # Return a dictionary of the names of the regions ('mask i' or 'point i'), their number of voxels ('voxels') and
+    # volume in mm³ ('volume'), and the mean, standard deviation, minimum and maximum of their intensities on each
+    # cycle ('mean', 'std', 'min' and 'max', arrays of shape (regions, cycles), NaN for an empty region).
+    # @param masks If true, compute the statistics of the masks
+    # @param points If true, compute the statistics of the points
+    def get_roi_statistics(self, masks=True, points=True):
+        regions = []
+        if masks:
+            regions.extend(('mask {}'.format(i), mask.get_voxels()) for i, mask in enumerate(self.masks))
+        if points:
+            for i, point in enumerate(self.points):
+                inside = all(0 <= point[j] < self.shape[j] for j in range(3))
+                regions.append(('point {}'.format(i), numpy.array([point[:3]] if inside else [], dtype=int).reshape(-1, 3)))
+        counts = numpy.array([len(voxels) for name, voxels in regions], dtype=int)
+        coords = numpy.concatenate([voxels for name, voxels in regions] + [numpy.zeros((0, 3), dtype=int)])
+        cycles = self.shape[3] if len(self.shape) == 4 else 1
+        stats = {'names': [name for name, voxels in regions], 'voxels': counts,
+                 'volume': counts * float(numpy.prod(numpy.abs(self.header['pixdim'][1:4])))}
+        for name in ('mean', 'std', 'min', 'max'):
+            stats[name] = numpy.full((len(regions), cycles), numpy.nan)
+        filled = counts > 0
+        if not filled.any():
+            return stats
+
+        # the voxels are sorted along the last axis to be gathered from the blocks of the volume
+        order = numpy.argsort(coords[:, 2], kind='mergesort')
+        sorted_coords = coords[order]
+        starts = (numpy.cumsum(counts) - counts)[filled]
+        values = numpy.empty(len(coords))
+        for cycle in range(cycles):
+            start = 0
+            for block in self._iter_blocks(cycle if len(self.shape) == 4 else None):
+                low, high = numpy.searchsorted(sorted_coords[:, 2], (start, start + block.shape[2]))
+                block_coords = sorted_coords[low:high]
+                values[order[low:high]] = block[block_coords[:, 0], block_coords[:, 1], block_coords[:, 2] - start]
+                start += block.shape[2]
+            # the empty regions are skipped, so each reduced segment is made of the values of one region
+            mean = numpy.add.reduceat(values, starts) / counts[filled]
+            deviations = values - numpy.repeat(mean, counts[filled])
+            stats['mean'][filled, cycle] = mean
+            stats['std'][filled, cycle] = numpy.sqrt(numpy.add.reduceat(deviations * deviations, starts) / counts[filled])
+            stats['min'][filled, cycle] = numpy.minimum.reduceat(values, starts)
+            stats['max'][filled, cycle] = numpy.maximum.reduceat(values, starts)
+        return stats
+
+    ## @brief Get the affine of the image
+    # @details Return the (4, 4) array transforming the voxel coordinates to world coordinates, to save the masks in
+    # the space of the image
+    def get_affine(self):
+        return self.img.affine
+
+    ## @brief Add a 3D mask
+    # @details Return the index of the mask in the list
+    # @param axis Axis (0:sagittal, 1:coronal, 2:axial) of the key slices of the mask
+    def add_mask_3d(self, axis):
+        self.masks.append(Mask3D(self.shape[:3], self.header['pixdim'], axis))
+        return len(self.masks) - 1
+
     ## @brief Delete a mask
     # @param index Index of the mask in the list
     def delete_mask(self, index):
         if index < len(self.masks) and index >=0:
             del self.masks[index]
 
+    ## @brief Save all the masks in a single NIfTI label map
+    # @details The voxels of the mask at index i are labelled i + 1 (0 is the background). The masks are rasterized
+    # in their order, so a mask overwrites the labels of the previous ones where they overlap, as when they are drawn.
+    # The labels are uint8 up to 255 masks, uint16 above. The options are the ones of Mask.save_mask_to_nifti (see
+    # save_volume_to_nifti).
+    # @param save_path Path of the output file (.nii or .nii.gz)
+    # @param colors_path Path of a JSON file describing the mask and color of each label, None to not write it
+    # @param affine Affine of the image, None for the identity (see get_affine)
+    # @param crop If true, save only the bounding box of the masks
+    # @param compress_level Level of the gzip compression of .nii.gz files, default of nibabel if None
+    def save_labels_to_nifti(self, save_path, colors_path=None, affine=None, crop=False, compress_level=None):
+        if len(self.masks) > 65535:
+            raise ValueError('{} masks can\'t be saved in a label map (65535 at most)'.format(len(self.masks)))
+        labels = numpy.zeros(self.shape[:3], dtype=numpy.uint8 if len(self.masks) <= 255 else numpy.uint16)
+        for i, mask in enumerate(self.masks):
+            mask.fill_volume(labels, i + 1)
+        save_volume_to_nifti(labels, save_path, self.header['pixdim'], affine, crop, compress_level)
+        if colors_path:
+            # the color of a mask without one is the color it is drawn with
+            colors = {'image': self.path, 'labels': [{'label': i + 1, 'mask': i, 'type': '3D' if isinstance(mask, Mask3D) else '2D',
+                                                      'color': [int(c) for c in (mask.get_color() or self.default_color)]}
+                                                     for i, mask in enumerate(self.masks)]}
+            with open(colors_path, 'w') as fp:
+                json.dump(colors, fp, indent=2)
+
     ## @brief Save masks and points in a file
     # @param save_path Path of the output file
     def save_points_masks(self, save_path):
-        with open(save_path, 'wb') as fp:
-            pickle.dump((self.points, self.masks), fp)
+        write_mim(save_path, self.points, self.masks)
     
     ## @brief Load masks and points from a file
+    # @details Files saved by previous versions of Mímir (with pickle) can also be loaded. If the file can't be read,
+    # the error is raised and the points and masks are left as they were.
     # @param load_path Path of the input file
     def load_points_masks(self, load_path):
-        del self.points[:]
-        del self.masks[:]
+        # the file is read entirely before replacing the points and masks, which are kept if it can't be read
+        masks = []
         with open (load_path, 'rb') as fp:
-            l_points, l_masks = pickle.load(fp)
-            self.points.extend(l_points)
-            self.masks.extend(l_masks)
+            magic = fp.read(len(MIM_MAGIC))
+        if magic == MIM_MAGIC:
+            mim = read_mim(load_path)
+            points = numpy.hstack((mim['points'], mim['points_colors'])).tolist()
+            vertices = mim['vertices'].tolist()
+            offsets = mim['masks_offsets'].tolist()
+            for i, (index_freeze, value_freeze) in enumerate(mim['masks_freeze'].tolist()):
+                if mim['masks_flags'][i] & MIM_MASK_3D:
+                    # the vertices of the key slices follow each other, the axis of the mask is stored as frozen axis
+                    mask = Mask3D(self.shape[:3], self.header['pixdim'], index_freeze)
+                    for vertex in vertices[offsets[i]:offsets[i + 1]]:
+                        mask.key_polygons.setdefault(vertex[index_freeze], []).append(vertex)
+                else:
+                    mask = Mask(self.shape[:3], self.header['pixdim'])
+                    mask.points = vertices[offsets[i]:offsets[i + 1]]
+                    mask.index_freeze, mask.value_freeze = index_freeze, value_freeze
+                    mask._rebuild_index()
+                if mim['masks_flags'][i] & MIM_MASK_HAS_COLOR:
+                    mask.color = mim['masks_colors'][i].tolist()
+                masks.append(mask)
+        else:
+            with open (load_path, 'rb') as fp:
+                points, masks = _LegacyMimUnpickler(fp).load()
+            points, masks = list(points), list(masks)
+        self.set_points_masks(points, masks)
                 
+## First bytes of a .mim file (since version 2)
+MIM_MAGIC = b'\x89MIM'
+## Version of the .mim files written with 3D masks (the files without are written in version 2, for previous versions of Mímir)
+MIM_VERSION = 3
+## Flag of a mask which has a color in a .mim file
+MIM_MASK_HAS_COLOR = 1
+## Flag of a 3D mask in a .mim file (since version 3)
+MIM_MASK_3D = 2
+# magic, version, flags, number of points, number of masks, number of vertices of the masks, reserved
+_MIM_HEADER = struct.Struct('<4sHHIIII')
+
+## @brief Save points and masks in a .mim file
+# @details A .mim file is made of a header followed by little endian arrays: the coordinates of the points (int32,
+# n_points x 4), the offsets of the vertices of each mask (int32, n_masks + 1), the frozen axis and coordinate of each
+# mask (int32, n_masks x 2), the vertices of all the masks (int32, n_vertices x 3), the colors of the points
+# (uint8, n_points x 4), the colors of the masks (uint8, n_masks x 4) and the flags of the masks (uint8, n_masks).
+# The vertices of a 3D mask are the ones of its key slices, by increasing key slice, and its axis is stored as frozen
+# axis (with -1 as frozen coordinate).
+# @param save_path Path of the output file
+# @param points List of points (4D coordinates followed by the (R,G,B,A) color)
+# @param masks List of masks
+def write_mim(save_path, points, masks):
+    points = numpy.array(points, dtype='<i4').reshape(-1, 8)
+    offsets = numpy.zeros(len(masks) + 1, dtype='<i4')
+    numpy.cumsum([len(mask.points) for mask in masks], out=offsets[1:])
+    vertices = numpy.array([point for mask in masks for point in mask.points], dtype='<i4').reshape(-1, 3)
+    freeze = numpy.array([(mask.axis, -1) if isinstance(mask, Mask3D) else (mask.index_freeze, mask.value_freeze) for mask in masks], dtype='<i4').reshape(-1, 2)
+    colors = numpy.array([mask.get_color() or (0, 0, 0, 0) for mask in masks], dtype='u1').reshape(-1, 4)
+    flags = numpy.array([(MIM_MASK_HAS_COLOR if mask.get_color() else 0) | (MIM_MASK_3D if isinstance(mask, Mask3D) else 0) for mask in masks], dtype='u1')
+    version = MIM_VERSION if any(isinstance(mask, Mask3D) for mask in masks) else 2
+    with open(save_path, 'wb') as fp:
+        fp.write(_MIM_HEADER.pack(MIM_MAGIC, version, 0, len(points), len(masks), len(vertices), 0))
+        for array in (points[:, :4], offsets, freeze, vertices, points[:, 4:].astype('u1'), colors, flags):
+            fp.write(numpy.ascontiguousarray(array).tobytes())
+
+## @brief Read the arrays of a .mim file
+# @details Return a dictionary of the arrays described in write_mim ('points', 'masks_offsets', 'masks_freeze',
+# 'vertices', 'points_colors', 'masks_colors' and 'masks_flags'), which are read-only views of the content of the file
+# @param load_path Path of the input file
+def read_mim(load_path):
+    with open(load_path, 'rb') as fp:
+        content = fp.read()
+    if len(content) < _MIM_HEADER.size:
+        raise ValueError('{} is truncated'.format(load_path))
+    magic, version, flags, n_points, n_masks, n_vertices, reserved = _MIM_HEADER.unpack_from(content)
+    if magic != MIM_MAGIC:
+        raise ValueError('{} is not a .mim file'.format(load_path))
+    if version > MIM_VERSION:
+        raise ValueError('{} is a .mim file of version {}, which is not supported'.format(load_path, version))
+    mim = {}
+    offset = _MIM_HEADER.size
+    for name, dtype, shape in (('points', '<i4', (n_points, 4)), ('masks_offsets', '<i4', (n_masks + 1,)),
+                               ('masks_freeze', '<i4', (n_masks, 2)), ('vertices', '<i4', (n_vertices, 3)),
+                               ('points_colors', 'u1', (n_points, 4)), ('masks_colors', 'u1', (n_masks, 4)),
+                               ('masks_flags', 'u1', (n_masks,))):
+        count = int(numpy.prod(shape))
+        mim[name] = numpy.frombuffer(content, dtype, count, offset).reshape(shape)
+        offset += count * mim[name].itemsize
+    return mim
+
+## @brief Unpickler of the .mim files saved by previous versions of Mímir
+# @details Only the classes which can be found in those files can be loaded, so opening a file from an untrusted
+# source can't run arbitrary code
+class _LegacyMimUnpickler(pickle.Unpickler):
+    ALLOWED = {('Mimir_lib', 'Mask'), ('copyreg', '_reconstructor'), ('builtins', 'object'),
+               ('numpy', 'ndarray'), ('numpy', 'dtype'),
+               ('numpy.core.multiarray', '_reconstruct'), ('numpy.core.multiarray', 'scalar'),
+               ('numpy._core.multiarray', '_reconstruct'), ('numpy._core.multiarray', 'scalar')}
+
+    def find_class(self, module, name):
+        if (module, name) not in self.ALLOWED:
+            raise pickle.UnpicklingError('{}.{} is not allowed in a .mim file'.format(module, name))
+        return super().find_class(module, name)
+
+## @brief Scale values to the 0-255 range according to the contrast
+# @details Values out of [contrast_min, contrast_max] are clamped, the result is an array of uint8
+# @param values Array of values (not modified)
+# @param contrast_min Value mapped to 0
+# @param contrast_max Value mapped to 255
+def scale_contrast(values, contrast_min, contrast_max):
+    # the values are clamped in their own type, so float values can then be scaled in place (numpy.clip has no casting
+    # argument before numpy 1.17)
+    scaled = numpy.empty_like(values)
+    numpy.maximum(values, contrast_min, out=scaled, casting='unsafe')
+    numpy.minimum(scaled, contrast_max, out=scaled, casting='unsafe')
+    step = (contrast_max - contrast_min) / 255 if contrast_max != contrast_min else 1
+    if scaled.dtype.kind == 'f':
+        numpy.subtract(scaled, contrast_min, out=scaled)
+        numpy.divide(scaled, step, out=scaled)
+    else:
+        scaled = numpy.divide(numpy.subtract(scaled, contrast_min), step)
+    return numpy.require(scaled, numpy.uint8, 'C')
+
+## @brief Get the lookup table of a colormap
+# @details Return a (256, 4) array of uint8 RGBA colors, a grayscale ramp if no colormap is given
+# @param colormap Name of the colormap
+@functools.lru_cache(maxsize=64)
+def get_colormap_lut(colormap):
+    if colormap:
+        lut = numpy.uint8(cm.get_cmap(colormap)(numpy.arange(256)) * 255)
+    else:
+        lut = numpy.empty((256, 4), dtype=numpy.uint8)
+        lut[:, :3] = numpy.arange(256)[:, None]
+        lut[:, 3] = 255
+    lut.setflags(write=False)
+    return lut
+
+## @brief Get the lookup table from raw values to colors
+# @details For 8 and 16 bits integer types, return an array of uint8 RGBA colors indexed directly by the raw values
+# (negative values wrap around the end of the table, like numpy negative indexes)
+# @param dtype_str String of the numpy type of the values
+# @param contrast_min Value mapped to the first color of the colormap
+# @param contrast_max Value mapped to the last color of the colormap
+# @param colormap Name of the colormap
+@functools.lru_cache(maxsize=32, typed=True)
+def _get_values_lut(dtype_str, contrast_min, contrast_max, colormap):
+    dtype = numpy.dtype(dtype_str)
+    values = numpy.arange(2 ** (8 * dtype.itemsize), dtype='u{}'.format(dtype.itemsize)).view(dtype)
+    lut = get_colormap_lut(colormap)[scale_contrast(values, contrast_min, contrast_max)]
+    lut.setflags(write=False)
+    return lut
+
+## @brief Apply the contrast and the colormap to a plane
+# @details Return an array of uint8 RGBA colors with the shape of the plane. Planes of 8 or 16 bits integers are mapped
+# to colors with one lookup in a table of every possible value, other types are first scaled to 0-255.
+# @param plane 2D array of raw values
+# @param contrast_min Value mapped to the first color of the colormap
+# @param contrast_max Value mapped to the last color of the colormap
+# @param colormap Name of the colormap (grayscale if None or empty)
+def render_plane(plane, contrast_min, contrast_max, colormap):
+    profiler = _profiler
+    if profiler: start = time.perf_counter()
+    if plane.dtype.kind in 'iu' and plane.dtype.itemsize <= 2:
+        colors = _get_values_lut(plane.dtype.str, contrast_min, contrast_max, colormap or None)[plane]
+    else:
+        values = scale_contrast(plane, contrast_min, contrast_max)
+        if profiler:
+            contrast_end = time.perf_counter()
+            profiler.add('contrast', contrast_end - start, plane.nbytes)
+            start = contrast_end
+        colors = get_colormap_lut(colormap or None)[values]
+    if profiler: profiler.add('colormap', time.perf_counter() - start, colors.nbytes)
+    return colors
+
 ## @brief Add a colormap to an image
 # @param color Name of the colormap 
 def set_colormap(image, color):
-    cmap = cm.get_cmap(color)
-    img = image.convert('L')
-    img = numpy.array(img)
-    img = cmap(img)
-    img = numpy.uint8(img * 255)
-    img = Image.fromarray(img)
-    return img
-
-## @brief Save an image as a PNG
+    img = numpy.array(image.convert('L'))
+    return Image.fromarray(get_colormap_lut(color)[img], 'RGBA')
+
+## @brief Get the slices a point is drawn on
+# @details Return the (plane_nb, slice_nb, img_nb) of the 3 slices
+# @param point Point (list of coordinates and color)
+def _point_slices(point):
+    return [(plane_nb, point[plane_nb], point[3]) for plane_nb in range(3)]
+
+## @brief Get the sampling positions of a slice rotated and scaled
+# @details Return, for each pixel of the rotated and scaled slice, the flat index of the pixel of the slice it is taken
+# from (nearest), or the flat indexes of the 4 pixels around it and the weights of the right and lower ones (bilinear).
+# The positions only depend on the sizes of the slice, so they are computed once for each plane of an image.
+# @param height Height of the slice
+# @param width Width of the slice
+# @param new_width Width of the rotated and scaled slice
+# @param new_height Height of the rotated and scaled slice
+# @param interpolation Interpolation (see INTERPOLATIONS)
+@functools.lru_cache(maxsize=64)
+def _get_resampling(height, width, new_width, new_height, interpolation):
+    # the slice is rotated by 90 degrees counterclockwise, so the columns of the result go along the rows of the slice
+    # and the rows of the result along the columns of the slice (starting from the last one)
+    x_scale = height / new_width
+    y_scale = width / new_height
+    if interpolation == 'nearest':
+        # same positions as the NEAREST resize of Pillow, which adds the scale from the middle of the first pixel
+        x = numpy.full(new_width, x_scale)
+        x[0] = x_scale * 0.5
+        x = numpy.add.accumulate(x)
+        y = numpy.full(new_height, y_scale)
+        y[0] = y_scale * 0.5
+        y = numpy.add.accumulate(y)
+        x = numpy.minimum(x.astype(numpy.intp), height - 1)
+        y = numpy.minimum(y.astype(numpy.intp), width - 1)
+        indexes = x[numpy.newaxis, :] * width + (width - 1 - y)[:, numpy.newaxis]
+        indexes.setflags(write=False)
+        return indexes
+    if interpolation == 'bilinear':
+        x = numpy.clip((numpy.arange(new_width) + 0.5) * x_scale - 0.5, 0, height - 1)
+        y = numpy.clip((numpy.arange(new_height) + 0.5) * y_scale - 0.5, 0, width - 1)
+        x0 = x.astype(numpy.intp)
+        y0 = y.astype(numpy.intp)
+        x1 = numpy.minimum(x0 + 1, height - 1)
+        y1 = numpy.minimum(y0 + 1, width - 1)
+        rows0 = (width - 1 - y0)[:, numpy.newaxis]
+        rows1 = (width - 1 - y1)[:, numpy.newaxis]
+        indexes = numpy.stack([x0 * width + rows0, x1 * width + rows0, x0 * width + rows1, x1 * width + rows1])
+        x_weights = (x - x0).astype(numpy.float32)[numpy.newaxis, :, numpy.newaxis]
+        y_weights = (y - y0).astype(numpy.float32)[:, numpy.newaxis, numpy.newaxis]
+        for array in (indexes, x_weights, y_weights):
+            array.setflags(write=False)
+        return indexes, x_weights, y_weights
+    raise ValueError('Unknown interpolation: ' + str(interpolation))
+
+## @brief Rotate and scale the pixels of a slice
+# @details Return the (new_height, new_width, 4) uint8 RGBA array of the slice rotated by 90 degrees (counterclockwise)
+# and scaled according to the voxel sizes, made by gathering the pixels at precomputed positions. In nearest mode, the
+# result is the same as Pillow's rotate(90, expand=True) followed by resize with the NEAREST filter.
+# @param layer (height, width, 4) uint8 RGBA array of the slice
+# @param scale Scales of the width and the height of the rotated slice
+# @param interpolation Interpolation (see INTERPOLATIONS)
+def resample_slice(layer, scale, interpolation='nearest'):
+    height, width = layer.shape[:2]
+    new_width = int(round(height*scale[0]))
+    new_height = int(round(width*scale[1]))
+    resampling = _get_resampling(height, width, new_width, new_height, interpolation)
+    # each RGBA pixel is gathered as a single 32 bits value
+    pixels = numpy.ascontiguousarray(layer).view(numpy.uint32).reshape(-1)
+    if interpolation == 'nearest':
+        return pixels[resampling].view(numpy.uint8).reshape(new_height, new_width, 4)
+    indexes, x_weights, y_weights = resampling
+    top_left, top_right, bottom_left, bottom_right = (pixels[i].view(numpy.uint8).reshape(new_height, new_width, 4).astype(numpy.float32) for i in indexes)
+    # the operations are done in place to limit the temporary arrays
+    top_right -= top_left
+    top_right *= x_weights
+    top_left += top_right
+    bottom_right -= bottom_left
+    bottom_right *= x_weights
+    bottom_left += bottom_right
+    bottom_left -= top_left
+    bottom_left *= y_weights
+    top_left += bottom_left
+    top_left += 0.5
+    return top_left.astype(numpy.uint8)
+
+## @brief Halve the size of a volume
+# @details Return the volume with its first 3 dimensions divided by 2 (rounded up), each voxel being the mean of 2x2x2
+# voxels (the last voxels of an odd dimension are averaged with themselves). Integer values are rounded to their type.
+# @param volume 3D or 4D array
+def downsample_volume(volume):
+    volume = numpy.asarray(volume)
+    # odd dimensions are padded by repeating their last voxels
+    padding = [(0, n % 2) for n in volume.shape[:3]] + [(0, 0)] * (volume.ndim - 3)
+    if any(after for before, after in padding):
+        volume = numpy.pad(volume, padding, 'edge')
+    shape = []
+    for n in volume.shape[:3]:
+        shape.extend((n // 2, 2))
+    means = volume.reshape(tuple(shape) + volume.shape[3:]).mean(axis=(1, 3, 5))
+    if volume.dtype.kind in 'iu':
+        means = numpy.rint(means, out=means)
+    return means.astype(volume.dtype)
+
+## @brief Empty the caches of the module
+# @details The lookup tables of the colormaps and contrasts and the resampling positions of the slices are computed
+# again when they are next needed
+def clear_caches():
+    get_colormap_lut.cache_clear()
+    _get_values_lut.cache_clear()
+    _get_resampling.cache_clear()
+
+## @brief Convert the pixels of a slice to an image
+# @details Return the RGB image of an array returned by Fd_data.get_slice_array
+# @param array (height, width, 4) uint8 RGBA array
+def slice_to_image(array):
+    return Image.fromarray(array, 'RGBA').convert('RGB')
+
+## @brief Check if an encoder can be used
+# @details The WebP encoder needs python-pillow to be built with libwebp
+# @param encoder Encoder to check (see ENCODERS)
+def is_encoder_available(encoder):
+    if encoder == 'npy':
+        return True
+    Image.init()
+    return encoder.upper() in Image.SAVE
+
+## @brief Save an image
+# @details With the default options, the file is the same as the one saved by python-pillow with its default PNG
+# settings
 # @param image Image to save
-# @param save_path Path of the output file 
-def save_slice(image, save_path):
-    # python-pillow can load any kind of image and save it in any common format
-    image.save(save_path, 'PNG')
+# @param save_path Path or file object of the output file
+# @param encoder Encoder used to save the image (see ENCODERS)
+# @param compress_level Compression effort: zlib level (0-9) for png, method (0-6) for webp, default of the encoder if None
+# @param quality Quality (1-100) for jpeg, default of the encoder if None
+def save_slice(image, save_path, encoder='png', compress_level=None, quality=None):
+    profiler = _profiler
+    if profiler: start = time.perf_counter()
+    if encoder == 'npy':
+        if isinstance(save_path, str):
+            # numpy.save would add .npy to a path without this extension
+            with open(save_path, 'wb') as fp:
+                numpy.save(fp, numpy.asarray(image))
+        else:
+            numpy.save(save_path, numpy.asarray(image))
+    else:
+        options = {}
+        if encoder == 'png' and compress_level is not None:
+            options['compress_level'] = compress_level
+        elif encoder == 'webp':
+            options['lossless'] = True
+            if compress_level is not None:
+                options['method'] = compress_level
+        elif encoder == 'jpeg' and quality is not None:
+            options['quality'] = quality
+        # python-pillow can load any kind of image and save it in any common format
+        image.save(save_path, encoder.upper(), **options)
+    if profiler: profiler.add('encode', time.perf_counter() - start, image.width * image.height * len(image.getbands()))
+
+## Image loaded by each process of export_slices
+_export_data = None
+
+## @brief Load the image in a process of export_slices
+# @param path Path of the image file, read lazily (memory-mapped)
+# @param data_path Path of a .npy file holding the already decoded data (for compressed image files), None to use the image file
+# @param points Points to draw on the slices
+# @param masks Masks to draw on the slices
+# @param profile If true, measure the stages of the rendering in the process
+def _init_export_process(path, data_path, points, masks, profile=False):
+    global _export_data
+    if profile:
+        enable_profiling()
+    _export_data = Fd_data(path, lazy=True)
+    if data_path:
+        _export_data.data = numpy.load(data_path, mmap_mode='r')
+    _export_data.set_points_masks(points, masks)
+
+## @brief Render and encode slices
+# @details Return a list of (path of the output file, content of the file)
+# @param tasks List of (img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap, path of the output file)
+# @param image_file Image to render from, the image loaded by _init_export_process if None
+# @param interpolation Interpolation used to scale the slices (see INTERPOLATIONS)
+# @param encoding Options of save_slice (encoder, compress_level, quality)
+def _render_slices(tasks, image_file=None, interpolation='nearest', encoding=None):
+    image_file = image_file or _export_data
+    encoded = []
+    for img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap, save_path in tasks:
+        image, scale = image_file.get_slice(img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap, interpolation)
+        buffer = io.BytesIO()
+        save_slice(image, buffer, **(encoding or {}))
+        encoded.append((save_path, buffer.getvalue()))
+    return encoded
+
+## @brief Render the frames of stacks
+# @details Return a list of (RGB array of the slice, scale of the slice)
+# @param tasks List of (img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap)
+# @param image_file Image to render from, the image loaded by _init_export_process if None
+# @param interpolation Interpolation used to scale the slices (see INTERPOLATIONS)
+def _render_frames(tasks, image_file=None, interpolation='nearest'):
+    image_file = image_file or _export_data
+    frames = []
+    for task in tasks:
+        array, scale = image_file.get_slice_array(*task, interpolation=interpolation)
+        frames.append((array[..., :3], scale))
+    return frames
+
+## @brief Render slices in a process of an export
+# @details Return the result of the render function and the statistics of the profiler of the process since its last
+# call (None if profiling is disabled), to be merged in the profiler of the main process
+# @param render Function rendering the slices (_render_slices or _render_frames)
+# @param tasks Slices to render
+# @param options Other arguments of render (interpolation, ...)
+def _render_in_process(render, tasks, options):
+    result = render(tasks, None, *options)
+    return result, (_profiler.pop_stats() if _profiler else None)
+
+## @brief Render chunks of slices, with a pool of processes if several jobs are asked
+# @details The results of the chunks are given to handle in the order of the chunks. With several jobs, the slices are
+# rendered by a pool of processes sharing the image through a memory map (of the file itself, or of a temporary copy
+# of the decoded data for compressed files), while the main process handles the results. The number of chunks waiting
+# to be handled is bounded.
+# @param image_file Image to render from
+# @param chunks List of lists of tasks given to render
+# @param jobs Number of processes rendering the slices
+# @param render Function rendering a chunk (_render_slices or _render_frames)
+# @param handle Function called with the result of each chunk
+# @param options Other arguments of render (interpolation, ...)
+def _export(image_file, chunks, jobs, render, handle, options):
+    if jobs <= 1:
+        for chunk in chunks:
+            handle(render(chunk, image_file, *options))
+        return
+
+    def handle_result(result):
+        result, stats = result
+        if stats and _profiler:
+            _profiler.merge(stats)
+        handle(result)
+
+    temp_dir = None
+    data_path = None
+    if image_file.path.endswith(('.gz', '.bz2')):
+        # a compressed file can't be memory-mapped: the decoded data is shared through a temporary .npy file instead
+        temp_dir = tempfile.mkdtemp()
+        data_path = os.path.join(temp_dir, 'data.npy')
+        numpy.save(data_path, image_file.data if image_file.data is not None else numpy.asarray(image_file.img.dataobj))
+    try:
+        pool = multiprocessing.Pool(jobs, _init_export_process, (image_file.path, data_path, image_file.points, image_file.masks, _profiler is not None))
+        try:
+            pending = collections.deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(_render_in_process, (render, chunk, options)))
+                if len(pending) >= 2 * jobs:
+                    handle_result(pending.popleft().get())
+            while pending:
+                handle_result(pending.popleft().get())
+            pool.close()
+            pool.join()
+        finally:
+            pool.terminate()
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir)
+
+## @brief Create the directory of a file if it doesn't exist
+# @param path Path of the file
+# @param directories Set of the directories already created, updated
+def _make_file_directory(path, directories):
+    directory = os.path.dirname(path)
+    if directory not in directories:
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        directories.add(directory)
+
+## @brief Save many slices of an image
+# @details With several jobs, the slices are rendered and encoded by a pool of processes while the main process writes
+# the files (see _export).
+# @param image_file Image to save the slices from
+# @param tasks List of (img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap, path of the output file)
+# @param jobs Number of processes rendering the slices
+# @param chunk_size Number of slices rendered by a process at once
+# @param interpolation Interpolation used to scale the slices (see INTERPOLATIONS)
+# @param encoder Encoder used to save the slices (see ENCODERS and save_slice)
+# @param compress_level Compression effort of the encoder, default of the encoder if None
+# @param quality Quality of the jpeg encoder, default of the encoder if None
+def export_slices(image_file, tasks, jobs=1, chunk_size=16, interpolation='nearest', encoder='png', compress_level=None, quality=None):
+    chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+    directories = set()
+
+    def write(encoded):
+        profiler = _profiler
+        for save_path, content in encoded:
+            if profiler: start = time.perf_counter()
+            _make_file_directory(save_path, directories)
+            with open(save_path, 'wb') as fp:
+                fp.write(content)
+            if profiler: profiler.add('write', time.perf_counter() - start, len(content))
+
+    encoding = {'encoder': encoder, 'compress_level': compress_level, 'quality': quality}
+    _export(image_file, chunks, jobs, _render_slices, write, (interpolation, encoding))
+
+## @brief Save stacks of slices of an image, each one in a single file
+# @details Each stack (for example the slices of a plane, or a slice along the time) is saved as a .npy file holding a
+# (frames, height, width, 3) uint8 array of the RGB slices, which must all have the same size. The frames are written
+# one by one in the file (memory-mapped), so a stack is never held in memory. With several jobs, the frames are
+# rendered by a pool of processes (see _export).
+# Return the list of (shape of the array, scale of the slices) of the stacks.
+# @param image_file Image to save the slices from
+# @param stacks List of (path of the .npy file, list of (img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap))
+# @param jobs Number of processes rendering the slices
+# @param chunk_size Number of slices rendered by a process at once
+# @param interpolation Interpolation used to scale the slices (see INTERPOLATIONS)
+def export_stacks(image_file, stacks, jobs=1, chunk_size=16, interpolation='nearest'):
+    stacks = [(path, tasks) for path, tasks in stacks if tasks]
+    frames = [(i, j) for i, (path, tasks) in enumerate(stacks) for j in range(len(tasks))]
+    tasks = [task for path, stack_tasks in stacks for task in stack_tasks]
+    chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+    positions = iter(frames)
+    directories = set()
+    infos = []
+    # memory-mapped array of the stack being written
+    current = {'array': None}
+
+    def write(rendered):
+        profiler = _profiler
+        for frame, scale in rendered:
+            if profiler: start = time.perf_counter()
+            i, j = next(positions)
+            if j == 0:
+                path = stacks[i][0]
+                _make_file_directory(path, directories)
+                shape = (len(stacks[i][1]),) + frame.shape
+                current['array'] = numpy.lib.format.open_memmap(path, mode='w+', dtype=numpy.uint8, shape=shape)
+                infos.append((shape, scale))
+            if frame.shape != current['array'].shape[1:]:
+                raise ValueError('The slices of {} have different sizes'.format(stacks[i][0]))
+            current['array'][j] = frame
+            if j == len(stacks[i][1]) - 1:
+                current['array'].flush()
+                current['array'] = None
+            if profiler: profiler.add('write', time.perf_counter() - start, frame.nbytes)
+
+    _export(image_file, chunks, jobs, _render_frames, write, (interpolation,))
+    return infos
+
+## @brief Save the statistics of regions of an image
+# @details A .csv file has a line per region and cycle (name of the region, cycle, number of voxels, volume in mm³,
+# mean, standard deviation, minimum and maximum), a .npz file holds the arrays of the statistics
+# @param stats Statistics returned by Fd_data.get_roi_statistics
+# @param save_path Path of the output file (.csv or .npz)
+def save_roi_statistics(stats, save_path):
+    if save_path.endswith('.npz'):
+        numpy.savez(save_path, **dict(stats, names=numpy.array(stats['names'])))
+    elif save_path.endswith('.csv'):
+        with open(save_path, 'w', newline='') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(['roi', 'cycle', 'voxels', 'volume_mm3', 'mean', 'std', 'min', 'max'])
+            for i, name in enumerate(stats['names']):
+                for cycle in range(stats['mean'].shape[1]):
+                    writer.writerow([name, cycle, stats['voxels'][i], repr(float(stats['volume'][i]))] +
+                                    [repr(float(stats[key][i, cycle])) for key in ('mean', 'std', 'min', 'max')])
+    else:
+        raise ValueError('{}: the statistics can only be saved to .csv or .npz files'.format(save_path))
+
+## @brief Save a volume of masks in a NIfTI file
+# @details Files ending with .gz are compressed with gzip. The volume can be cropped to the bounding box of its
+# non-zero voxels: the affine is then translated to the first voxel of the box, so the voxels keep their position.
+# Without affine, the identity is used, with the voxel sizes of the image in the header.
+# @param volume 3D array to save
+# @param save_path Path of the output file (.nii or .nii.gz)
+# @param pixdim Voxel sizes of the image (pixdim field of its header)
+# @param affine Affine of the image (voxel to world coordinates), None for the identity
+# @param crop If true, save only the bounding box of the non-zero voxels
+# @param compress_level Level of the gzip compression (1-9) of .nii.gz files, default of nibabel if None
+def save_volume_to_nifti(volume, save_path, pixdim, affine=None, crop=False, compress_level=None):
+    offset = numpy.zeros(3, dtype=int)
+    if crop:
+        # the bounding box is found from the projections of the volume on each axis
+        ranges = [numpy.flatnonzero(volume.any(axis=tuple(j for j in range(3) if j != i))) for i in range(3)]
+        if all(len(r) for r in ranges):
+            offset = numpy.array([r[0] for r in ranges])
+            volume = volume[tuple(slice(r[0], r[-1] + 1) for r in ranges)]
+    new_affine = numpy.eye(4) if affine is None else numpy.array(affine, dtype=float)
+    # the first voxel of the volume is at the offset in the voxels of the image
+    new_affine[:3, 3] += new_affine[:3, :3].dot(offset)
+    new_nifti = nibabel.Nifti1Image(volume, affine=new_affine)
+    if affine is None:
+        hdr = new_nifti.header
+        hdr['pixdim'] = pixdim
+    if compress_level is not None and save_path.endswith('.gz'):
+        with gzip.open(save_path, 'wb', compresslevel=compress_level) as fp:
+            new_nifti.to_file_map({'image': nibabel.FileHolder(fileobj=fp)})
+    else:
+        new_nifti.to_filename(save_path)
 
 ## @brief Data of a mask
 class Mask:
@@ -182,75 +1521,524 @@ class Mask:
         self.color = None
         self.shape = shape
         self.pixdim = pixdim
+        # incremented each time the mask is modified
+        self.version = 0
+        self._lock = threading.RLock()
+        self._init_index()
+
+    ## @brief Initialize the index of the points
+    # @details The index is made of the points by (plane_nb, slice_nb) of the slices they are on, the set of the points,
+    # the number of points having each coordinate (for each axis) and the set of (axis, coordinate) shared by several points
+    def _init_index(self):
+        self._points_index = {}
+        self._points_set = set()
+        self._coords_count = [collections.Counter() for i in range(3)]
+        self._shared_coords = set()
+
+    ## @brief Get the state of the mask to pickle
+    # @details The index of the points isn't saved, it is rebuilt when the mask is restored
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('_points_index', '_points_set', '_coords_count', '_shared_coords', '_lock'):
+            del state[name]
+        return state
+
+    ## @brief Restore a mask saved with pickle
+    # @details Masks saved by previous versions of Mímir lack some attributes, which are given their default value
+    def __setstate__(self, state):
+        self.version = 0
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+        self._rebuild_index()
+
+    ## @brief Rebuild the index of the points from the list of points
+    def _rebuild_index(self):
+        with self._lock:
+            self._init_index()
+            for point in self.points:
+                self._index_point(point)
+
+    ## @brief Get the points of the mask on a slice
+    # @details Return a copy of the points in the order of the list of points, as the slices are drawn by other threads
+    # @param plane_nb Number of the plane (0:sagittal, 1:coronal, 2:axial) of the slice
+    # @param slice_nb Number of the slice in the plane
+    def get_points_on_slice(self, plane_nb, slice_nb):
+        with self._lock:
+            return list(self._points_index.get((plane_nb, slice_nb), []))
+
+    ## @brief Add a point to the index of the points
+    # @param point 3D coordinates of the point
+    def _index_point(self, point):
+        self._points_set.add(tuple(point))
+        for plane_nb in range(3):
+            self._points_index.setdefault((plane_nb, point[plane_nb]), []).append(point)
+            self._coords_count[plane_nb][point[plane_nb]] += 1
+            if self._coords_count[plane_nb][point[plane_nb]] == 2:
+                self._shared_coords.add((plane_nb, point[plane_nb]))
+
+    ## @brief Remove a point from the index of the points
+    # @param point 3D coordinates of the point
+    def _unindex_point(self, point):
+        self._points_set.discard(tuple(point))
+        for plane_nb in range(3):
+            key = (plane_nb, point[plane_nb])
+            self._points_index[key].remove(point)
+            if not self._points_index[key]:
+                del self._points_index[key]
+            self._coords_count[plane_nb][point[plane_nb]] -= 1
+            if self._coords_count[plane_nb][point[plane_nb]] == 1:
+                self._shared_coords.discard(key)
+            elif self._coords_count[plane_nb][point[plane_nb]] == 0:
+                del self._coords_count[plane_nb][point[plane_nb]]
+
+    ## @brief Get the slices the mask is drawn on
+    # @details Return the set of (plane_nb, slice_nb) of the slices having points of the mask
+    def get_slices(self):
+        with self._lock:
+            return set(self._points_index)
 
     ## @brief Change the color of the mask
     # @param color (R,G,B,A) color of the mask
     def set_color(self, color):
         if len(color) == 4:
-            self.color = color
+            with self._lock:
+                self.color = color
+                self.version += 1
 
     ## @brief Return color of the mask
     def get_color(self):
         return self.color
 
     ## @brief Add a point to the mask
+    # @details Return 0 if the point was added, 1 if it isn't in the plane of the mask
     # @param point 3D coordinates of the point
     def add_point(self, point):
-        if len(point) == 3 and point not in self.points:
-            if self.index_freeze != -1 and point[self.index_freeze] != self.value_freeze :
-                return 1
-            self.points.append(point)
-            #Check if the point is in the same plane as the mask
-            if len(self.points) > 1:
-                wc = [{}, {}, {}]
-                t = []
-                for b in self.points:
-                    for i, c in enumerate(b):
-                        wc[i][c] = wc[i][c] + 1 if c in wc[i] else 1
-                for k,v in enumerate(wc):
-                    for a in v:
-                        if v[a] >= 2:
-                            t.append((k, a))
-                if len(t) == 0:
-                    del self.points[len(self.points)-1]
+        with self._lock:
+            if len(point) == 3 and tuple(point) not in self._points_set:
+                if self.index_freeze != -1 and point[self.index_freeze] != self.value_freeze :
+                    return 1
+                self.points.append(point)
+                self._index_point(point)
+                #Check if the point is in the same plane as the mask: some coordinates must be shared by several points
+                if len(self.points) > 1:
+                    if len(self._shared_coords) == 0:
+                        self._unindex_point(point)
+                        del self.points[len(self.points)-1]
+                        return 1
+                    if len(self._shared_coords) == 1:
+                        self.index_freeze, self.value_freeze = next(iter(self._shared_coords))
+                self.version += 1
+                return 0
+
+    ## @brief Add several points to the mask
+    # @details The points (except the ones already in the mask) are all added if they are in the plane of the mask,
+    # which is the plane common to all the points if the mask has no plane yet. Otherwise, none is added.
+    # Return 0 if the points were added, 1 otherwise.
+    # @param points List of 3D coordinates
+    def add_points(self, points):
+        with self._lock:
+            new_points = numpy.asarray(points).reshape(-1, 3)
+            # duplicates are removed (keeping the order of the points) before checking the plane of all the points at once
+            new_points = new_points[numpy.sort(numpy.unique(new_points, axis=0, return_index=True)[1])]
+            new_points = [point for point in new_points.tolist() if tuple(point) not in self._points_set]
+            if not new_points:
+                return 0
+            coords = numpy.array(self.points + new_points)
+            if self.index_freeze != -1:
+                if numpy.any(coords[:, self.index_freeze] != self.value_freeze):
+                    return 1
+            elif len(coords) > 1:
+                common_axes = numpy.flatnonzero(numpy.all(coords == coords[0], axis=0))
+                if len(common_axes) == 0:
                     return 1
-                if len(t) == 1:
-                    self.index_freeze = t[0][0]
-                    self.value_freeze = t[0][1]           
+                if len(common_axes) == 1:
+                    self.index_freeze = int(common_axes[0])
+                    self.value_freeze = int(coords[0, self.index_freeze])
+            for point in new_points:
+                self.points.append(point)
+                self._index_point(point)
+            self.version += 1
             return 0
+
     ## @brief Delete a point
     # @param index Index of the point in the list
     def delete_point(self, index):
-        if index < len(self.points) and index >= 0:
-            del self.points[index]
+        with self._lock:
+            if index < len(self.points) and index >= 0:
+                self._unindex_point(self.points[index])
+                del self.points[index]
+                self.version += 1
     
+
+    ## @brief Rasterize the mask in its plane
+    # @details Return a 2D array of booleans, indexed by the two coordinates of the voxels that are not frozen, which is
+    # true for the voxels inside the polygon. Only the voxels in the bounding box of the polygon are tested.
+    def rasterize(self):
+        with self._lock:
+            nx, ny = (x for i,x in enumerate(self.shape) if i != self.index_freeze)
+            plane = numpy.zeros((nx, ny), dtype=bool)
+            if not self.points:
+                return plane
+            poly_verts = numpy.array([[x for i,x in enumerate(point) if i != self.index_freeze] for point in self.points])
+
+        # bounding box of the polygon, limited to the plane
+        x_min, y_min = numpy.maximum(numpy.ceil(poly_verts.min(axis=0)).astype(int), 0)
+        x_max, y_max = numpy.minimum(numpy.floor(poly_verts.max(axis=0)).astype(int), (nx - 1, ny - 1))
+        if x_min > x_max or y_min > y_max:
+            return plane
+
+        x, y = numpy.meshgrid(numpy.arange(x_min, x_max + 1), numpy.arange(y_min, y_max + 1), indexing='ij')
+        inside = Path(poly_verts).contains_points(numpy.column_stack((x.ravel(), y.ravel())))
+        plane[x_min:x_max + 1, y_min:y_max + 1] = inside.reshape(x.shape)
+        return plane
+
+    ## @brief Set the voxels inside the mask in a volume
+    # @param volume 3D array of the shape of the mask
+    # @param value Value given to the voxels inside the mask
+    def fill_volume(self, volume, value):
+        if self.index_freeze != -1 and 0 <= self.value_freeze < self.shape[self.index_freeze]:
+            # the polygon is rasterized directly in the frozen plane
+            plane_range = [slice(None)] * 3
+            plane_range[self.index_freeze] = self.value_freeze
+            volume[tuple(plane_range)][self.rasterize()] = value
+
+    ## @brief Get the voxels inside the mask
+    # @details Return a (n_voxels, 3) array of the coordinates of the voxels
+    def get_voxels(self):
+        if self.index_freeze == -1 or not 0 <= self.value_freeze < self.shape[self.index_freeze]:
+            return numpy.zeros((0, 3), dtype=int)
+        coords = list(numpy.nonzero(self.rasterize()))
+        coords.insert(self.index_freeze, numpy.full(len(coords[0]), self.value_freeze, dtype=int))
+        return numpy.column_stack(coords)
+
     ## @brief Save a mask in a nifti file
-    # @param save_path Path of the output file
-    def save_mask_to_nifti(self, save_path):
+    # @details See save_volume_to_nifti for the options
+    # @param save_path Path of the output file (.nii or .nii.gz)
+    # @param dtype Type of the voxels (numpy.uint8 is 8 times smaller than the default float64)
+    # @param affine Affine of the image, None for the identity
+    # @param crop If true, save only the bounding box of the mask
+    # @param compress_level Level of the gzip compression of .nii.gz files, default of nibabel if None
+    def save_mask_to_nifti(self, save_path, dtype=numpy.float64, affine=None, crop=False, compress_level=None):
         if self.index_freeze != -1:
-            new_array = numpy.zeros(self.shape, dtype=numpy.float)
-            
-            nx, ny = (x for i,x in enumerate(self.shape) if i != self.index_freeze)
-            poly_verts = [tuple(x for i,x in enumerate(point) if i != self.index_freeze) for point in self.points]
-
-
-            x, y = numpy.meshgrid(numpy.arange(nx), numpy.arange(ny))
-            x, y = x.flatten(), y.flatten()
-
-            new_points = numpy.vstack((x,y)).T
-
-            path = Path(poly_verts)
-            grid = path.contains_points(new_points)
-            grid = grid.reshape((ny,nx))
-            for k,v in enumerate(new_array):
-                for k2,v2 in enumerate(v):
-                    for k3,v3 in enumerate(v2):
-                        if self.index_freeze == 0 and self.value_freeze == k and grid[k3][k2] \
-                        or self.index_freeze == 1 and self.value_freeze == k2 and grid[k3][k] \
-                        or self.index_freeze == 2 and self.value_freeze == k3 and grid[k2][k]:
-                            new_array[k][k2][k3] = 1.
-        
-            new_nifti = nibabel.Nifti1Image(new_array, affine=numpy.eye(4))
-            hdr = new_nifti.get_header()
-            hdr['pixdim'] = self.pixdim
-            new_nifti.to_filename(save_path)
\ No newline at end of file
+            new_array = numpy.zeros(self.shape, dtype=dtype)
+            self.fill_volume(new_array, 1)
+            save_volume_to_nifti(new_array, save_path, self.pixdim, affine, crop, compress_level)
+## @brief Rasterize polygons
+# @details Return an array of booleans (n_polygons, height, width), true for the points of integer coordinates inside
+# each polygon (even-odd rule). All the polygons are filled at once: the crossings of the edges with the rows are
+# counted at the first column after them, and the parity of the cumulated count along the rows tells the inside.
+# @param polygons (n_polygons, n_vertices, 2) array of (row, column) vertices, a polygon with fewer vertices repeating
+# its last one
+# @param origin (row, column) of the first point of the grid
+# @param shape (height, width) of the grid
+def rasterize_polygons(polygons, origin, shape):
+    polygons = numpy.asarray(polygons, dtype=float) - origin
+    height, width = shape
+    start = polygons
+    end = numpy.roll(polygons, -1, axis=1)
+    rows = numpy.arange(height, dtype=float)[None, :, None]
+    # an edge crosses a row if its ends are on both sides (the lower end included, so a vertex is counted once)
+    polygon_nb, row_nb, edge_nb = numpy.nonzero((start[:, None, :, 0] <= rows) != (end[:, None, :, 0] <= rows))
+    y0, x0 = start[polygon_nb, edge_nb, 0], start[polygon_nb, edge_nb, 1]
+    y1, x1 = end[polygon_nb, edge_nb, 0], end[polygon_nb, edge_nb, 1]
+    x = x0 + (row_nb - y0) * (x1 - x0) / (y1 - y0)
+    columns = numpy.clip(numpy.ceil(x), 0, width).astype(int)
+    counts = numpy.zeros((len(polygons), height, width + 1), dtype=numpy.uint8)
+    numpy.add.at(counts, (polygon_nb, row_nb, columns), 1)
+    numpy.bitwise_and(counts, 1, out=counts)
+    numpy.bitwise_xor.accumulate(counts, axis=2, out=counts)
+    return counts[:, :, :width].view(bool)
+
+## @brief Resample a closed contour
+# @details Return a (n_points, 2) array of points evenly spaced along the contour, turning counterclockwise and
+# starting from its first vertex
+# @param vertices (n_vertices, 2) array of the vertices of the contour
+# @param n_points Number of points of the resampled contour
+def resample_contour(vertices, n_points):
+    vertices = numpy.asarray(vertices, dtype=float)
+    # shoelace formula: the contour is reversed if its signed area is negative
+    area = numpy.sum(vertices[:, 0] * numpy.roll(vertices[:, 1], -1) - numpy.roll(vertices[:, 0], -1) * vertices[:, 1])
+    if area < 0:
+        vertices = numpy.concatenate((vertices[:1], vertices[:0:-1]))
+    closed = numpy.concatenate((vertices, vertices[:1]))
+    lengths = numpy.concatenate(([0], numpy.cumsum(numpy.hypot(*numpy.diff(closed, axis=0).T))))
+    if lengths[-1] == 0:
+        return numpy.repeat(vertices[:1], n_points, axis=0)
+    positions = numpy.arange(n_points) * lengths[-1] / n_points
+    return numpy.column_stack((numpy.interp(positions, lengths, closed[:, 0]), numpy.interp(positions, lengths, closed[:, 1])))
+
+## @brief Data of a 3D mask
+# @details A 3D mask is made of polygons drawn on a few key slices along an axis. On the slices between two key
+# slices, the contour is interpolated linearly between the contours of the key slices (resampled to the same number
+# of points, starting from the closest points). The volume of the mask is rasterized by segments of slices between
+# two key slices, and only the segments next to a modified key slice are rasterized again.
+class Mask3D:
+    ## Number of points of the contours interpolated between two key slices
+    CONTOUR_POINTS = 64
+
+    def __init__(self, shape, pixdim, axis):
+        self.axis = axis
+        # vertices (3D coordinates) of the polygon of each key slice
+        self.key_polygons = {}
+        self.color = None
+        self.shape = shape
+        self.pixdim = pixdim
+        # incremented each time the mask is modified
+        self.version = 0
+        self._init_cache()
+
+    ## @brief Initialize the cache of the rasterized segments
+    # @details The cache is made of the number of changes of each key slice, and of the (versions of the key slices,
+    # (row, column) of the first point, array of booleans (slices, rows, columns)) of each segment by (first key slice,
+    # last key slice)
+    def _init_cache(self):
+        self._key_versions = collections.Counter()
+        self._segments = {}
+        self._lock = threading.RLock()
+
+    ## @brief Get the state of the mask to pickle
+    # @details The rasterized segments aren't saved, they are rasterized again when needed
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('_key_versions', '_segments', '_lock'):
+            del state[name]
+        return state
+
+    ## @brief Restore a mask saved with pickle
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_cache()
+
+    ## @brief Axes of the two coordinates of the polygons, in the order of the coordinates
+    def _plane_axes(self):
+        return [i for i in range(3) if i != self.axis]
+
+    ## @brief Vertices of the mask
+    # @details Return the list of the vertices of the polygons of the key slices, by increasing key slice
+    @property
+    def points(self):
+        with self._lock:
+            return [point for slice_nb in sorted(self.key_polygons) for point in self.key_polygons[slice_nb]]
+
+    ## @brief Record a change of a key slice
+    # @param slice_nb Number of the key slice
+    def _changed_key(self, slice_nb):
+        self._key_versions[slice_nb] += 1
+        self.version += 1
+
+    ## @brief Replace the polygon of a key slice
+    # @param slice_nb Number of the key slice along the axis of the mask
+    # @param vertices List of vertices (2D coordinates in the slice), an empty list to remove the key slice
+    def set_key_polygon(self, slice_nb, vertices):
+        with self._lock:
+            if len(vertices):
+                self.key_polygons[slice_nb] = [list(map(int, vertex[:self.axis])) + [slice_nb] + list(map(int, vertex[self.axis:])) for vertex in vertices]
+            else:
+                self.key_polygons.pop(slice_nb, None)
+            self._changed_key(slice_nb)
+
+    ## @brief Add a vertex to the polygon of its key slice
+    # @details The key slice is created if needed. Return 0 (any point is in a slice along the axis of the mask).
+    # @param point 3D coordinates of the vertex
+    def add_point(self, point):
+        with self._lock:
+            if len(point) == 3 and point not in self.key_polygons.get(point[self.axis], []):
+                self.key_polygons.setdefault(point[self.axis], []).append(list(point))
+                self._changed_key(point[self.axis])
+            return 0
+
+    ## @brief Add several vertices to the polygons of their key slices
+    # @details Return 0 (any point is in a slice along the axis of the mask)
+    # @param points List of 3D coordinates
+    def add_points(self, points):
+        with self._lock:
+            for point in numpy.asarray(points, dtype=int).reshape(-1, 3).tolist():
+                self.add_point(point)
+            return 0
+
+    ## @brief Delete a vertex
+    # @details The key slice is removed with its last vertex
+    # @param index Index of the vertex in the list of vertices (see points)
+    def delete_point(self, index):
+        with self._lock:
+            if index < 0:
+                return
+            for slice_nb in sorted(self.key_polygons):
+                polygon = self.key_polygons[slice_nb]
+                if index < len(polygon):
+                    del polygon[index]
+                    if not polygon:
+                        del self.key_polygons[slice_nb]
+                    self._changed_key(slice_nb)
+                    return
+                index -= len(polygon)
+
+    ## @brief Change the color of the mask
+    # @param color (R,G,B,A) color of the mask
+    def set_color(self, color):
+        if len(color) == 4:
+            with self._lock:
+                self.color = color
+                self.version += 1
+
+    ## @brief Return color of the mask
+    def get_color(self):
+        return self.color
+
+    ## @brief Get the vertices of the polygon of a key slice which can't be filled yet
+    # @details The polygons of less than 3 vertices aren't rasterized, they are drawn as they are on their key slice.
+    # Return a copy of the vertices, as the slices are drawn by other threads, and an empty list for any other slice.
+    # @param plane_nb Number of the plane (0:sagittal, 1:coronal, 2:axial) of the slice
+    # @param slice_nb Number of the slice in the plane
+    def get_points_on_slice(self, plane_nb, slice_nb):
+        with self._lock:
+            polygon = self.key_polygons.get(slice_nb, []) if plane_nb == self.axis else []
+            return list(polygon) if len(polygon) < 3 else []
+
+    ## @brief Get the rasterized segments of the mask
+    # @details Return the list of (first key slice, last key slice, (row, column) of the first point, array of
+    # booleans (slices, rows, columns)) of the segments, by increasing key slices. The rows and columns follow the two
+    # axes of the polygons. A single key slice makes a segment on its own.
+    def get_segments(self):
+        with self._lock:
+            keys = sorted(slice_nb for slice_nb, polygon in self.key_polygons.items() if len(polygon) >= 3)
+            pairs = list(zip(keys, keys[1:])) if len(keys) > 1 else [(key, key) for key in keys]
+            segments = []
+            for pair in pairs:
+                versions = (self._key_versions[pair[0]], self._key_versions[pair[1]])
+                cached = self._segments.get(pair)
+                if cached is None or cached[0] != versions:
+                    cached = (versions,) + self._rasterize_segment(*pair)
+                self._segments[pair] = cached
+                segments.append(pair + cached[1:])
+            for pair in set(self._segments) - set(pairs):
+                del self._segments[pair]
+            return segments
+
+    ## @brief Rasterize the slices between two key slices
+    # @details Return the (row, column) of the first point and the array of booleans (slices, rows, columns) of the
+    # slices from first_key to last_key, limited to the bounding box of their polygons
+    # @param first_key First key slice
+    # @param last_key Last key slice
+    def _rasterize_segment(self, first_key, last_key):
+        axes = self._plane_axes()
+        first = numpy.array(self.key_polygons[first_key])[:, axes]
+        last = numpy.array(self.key_polygons[last_key])[:, axes]
+        polygons = [first]
+        if last_key - first_key > 1:
+            first_contour = resample_contour(first, self.CONTOUR_POINTS)
+            last_contour = resample_contour(last, self.CONTOUR_POINTS)
+            # the last contour starts from the point which makes the contours the closest
+            shifts = numpy.arange(self.CONTOUR_POINTS)
+            rolled = last_contour[(shifts[:, None] + shifts[None, :]) % self.CONTOUR_POINTS]
+            shift = numpy.argmin(((rolled - first_contour) ** 2).sum(axis=(1, 2)))
+            last_contour = rolled[shift]
+            t = (numpy.arange(1, last_key - first_key) / (last_key - first_key))[:, None, None]
+            polygons.extend((1 - t) * first_contour + t * last_contour)
+        if last_key != first_key:
+            polygons.append(last)
+        # the polygons are padded to the same number of vertices by repeating their last one
+        n_vertices = max(len(polygon) for polygon in polygons)
+        polygons = numpy.array([numpy.concatenate((polygon, numpy.repeat(polygon[-1:], n_vertices - len(polygon), axis=0))) for polygon in polygons])
+
+        limits = numpy.array([self.shape[i] for i in axes])
+        origin = numpy.maximum(numpy.ceil(polygons.min(axis=(0, 1))).astype(int), 0)
+        end = numpy.minimum(numpy.floor(polygons.max(axis=(0, 1))).astype(int) + 1, limits)
+        if numpy.any(end <= origin):
+            return (0, 0), numpy.zeros((len(polygons), 0, 0), dtype=bool)
+        return tuple(origin.tolist()), rasterize_polygons(polygons, origin, tuple((end - origin).tolist()))
+
+    ## @brief Get the slices the mask is drawn on
+    # @details Return the set of (plane_nb, slice_nb) of the slices crossing the polygons of the key slices or the
+    # volume between them
+    def get_slices(self):
+        with self._lock:
+            if not self.key_polygons:
+                return set()
+            vertices = numpy.array(self.points)
+            low = numpy.maximum(vertices.min(axis=0), 0)
+            high = numpy.minimum(vertices.max(axis=0), numpy.array(self.shape[:3]) - 1)
+            return {(plane_nb, slice_nb) for plane_nb in range(3) for slice_nb in range(int(low[plane_nb]), int(high[plane_nb]) + 1)}
+
+    ## @brief Get the section of the mask on a slice
+    # @details Return ((row, column) of the first point, 2D array of booleans) of the voxels of the slice inside the
+    # mask, the rows and columns being the first and second axes of the slice (as the layers of Fd_data), or None if
+    # the slice doesn't cross the mask
+    # @param plane_nb Number of the plane (0:sagittal, 1:coronal, 2:axial) of the slice
+    # @param slice_nb Number of the slice in the plane
+    def get_section(self, plane_nb, slice_nb):
+        segments = self.get_segments()
+        if plane_nb == self.axis:
+            for first_key, last_key, origin, volume in segments:
+                if first_key <= slice_nb <= last_key and volume.size:
+                    return origin, volume[slice_nb - first_key]
+            return None
+        # the section crosses all the segments: its rows or columns go along the axis of the mask
+        axes = self._plane_axes()
+        position = axes.index(plane_nb)
+        other = 1 - position
+        parts = []
+        for first_key, last_key, origin, volume in segments:
+            if volume.size and 0 <= slice_nb - origin[position] < volume.shape[1 + position]:
+                parts.append((first_key, origin[other], volume[:, slice_nb - origin[position]] if position == 0 else volume[:, :, slice_nb - origin[position]]))
+        if not parts:
+            return None
+        first = min(part[0] for part in parts)
+        start = min(part[1] for part in parts)
+        section = numpy.zeros((max(part[0] + len(part[2]) for part in parts) - first,
+                               max(part[1] + part[2].shape[1] for part in parts) - start), dtype=bool)
+        for first_key, origin, part in parts:
+            section[first_key - first:first_key - first + len(part), origin - start:origin - start + part.shape[1]] |= part
+        if self.axis < axes[other]:
+            return (first, start), section
+        return (start, first), section.T
+
+    ## @brief Set the voxels inside the mask in a volume
+    # @param volume 3D array of the shape of the mask
+    # @param value Value given to the voxels inside the mask
+    def fill_volume(self, volume, value):
+        # view of the volume with the axis of the mask first, then the axes of the polygons
+        view = numpy.moveaxis(volume, self.axis, 0)
+        for first_key, last_key, (row, column), segment in self.get_segments():
+            # the key slices may be out of the volume
+            low, high = max(first_key, 0), min(last_key + 1, view.shape[0])
+            if high > low and segment.size:
+                view[low:high, row:row + segment.shape[1], column:column + segment.shape[2]][segment[low - first_key:high - first_key]] = value
+
+    ## @brief Get the voxels inside the mask
+    # @details Return a (n_voxels, 3) array of the coordinates of the voxels
+    def get_voxels(self):
+        axes = self._plane_axes()
+        segments = self.get_segments()
+        parts = [numpy.zeros((0, 3), dtype=int)]
+        for i, (first_key, last_key, (row, column), segment) in enumerate(segments):
+            # the last key slice of a segment is the first one of the next segment
+            if i + 1 < len(segments):
+                segment = segment[:-1]
+            slice_nb, row_nb, column_nb = numpy.nonzero(segment)
+            coords = numpy.empty((len(slice_nb), 3), dtype=int)
+            coords[:, self.axis] = slice_nb + first_key
+            coords[:, axes[0]] = row_nb + row
+            coords[:, axes[1]] = column_nb + column
+            # the key slices may be out of the volume
+            parts.append(coords[(coords[:, self.axis] >= 0) & (coords[:, self.axis] < self.shape[self.axis])])
+        return numpy.concatenate(parts)
+
+    ## @brief Rasterize the mask
+    # @details Return a 3D array of booleans, true for the voxels inside the mask
+    def rasterize(self):
+        volume = numpy.zeros(self.shape[:3], dtype=bool)
+        self.fill_volume(volume, True)
+        return volume
+
+    ## @brief Save a mask in a nifti file
+    # @details See save_volume_to_nifti for the options
+    # @param save_path Path of the output file (.nii or .nii.gz)
+    # @param dtype Type of the voxels (numpy.uint8 is 8 times smaller than the default float64)
+    # @param affine Affine of the image, None for the identity
+    # @param crop If true, save only the bounding box of the mask
+    # @param compress_level Level of the gzip compression of .nii.gz files, default of nibabel if None
+    def save_mask_to_nifti(self, save_path, dtype=numpy.float64, affine=None, crop=False, compress_level=None):
+        new_array = numpy.zeros(self.shape[:3], dtype=dtype)
+        self.fill_volume(new_array, 1)
+        save_volume_to_nifti(new_array, save_path, self.pixdim, affine, crop, compress_level)
@@ -0,0 +1,297 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import Mimir_lib
+import Mimir_cli
+
+## Default size (in MB) of the cache of the encoded slices
+RESPONSE_CACHE_MB = 256
+## Numbers of the planes by name, as accepted by Mimir_cli
+PLANES = {'SAG':0, '0':0, 'COR':1, '1':1, 'AXI':2, '2':2}
+## Content type of the slices saved by each encoder
+CONTENT_TYPES = {'png': 'image/png', 'npy': 'application/octet-stream', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+## Encoder of each extension of the slices
+EXTENSION_ENCODERS = dict((extension, encoder) for encoder, extension in Mimir_lib.ENCODER_EXTENSIONS.items())
+
+parser = argparse.ArgumentParser(description='Serve the slices of images over HTTP.')
+parser.add_argument('path_in', nargs='*', help='Paths or glob patterns of the images to serve')
+parser.add_argument('--manifest', dest='manifest', help='Text file listing the images to serve, one per line, optionally followed by the .mim file to link to it')
+parser.add_argument('-l', '--link', dest='link', help='Link a .mim file to the images without their own, to draw its points and masks on the slices')
+parser.add_argument('--lazy', dest='lazy', action='store_true', help='Read only the needed slices from the files instead of loading the whole images (best with uncompressed .nii files)')
+parser.add_argument('--host', dest='host', default='127.0.0.1', help='Address to listen on (default 127.0.0.1, 0.0.0.0 for every interface)')
+parser.add_argument('--port', dest='port', type=int, default=8000, help='Port to listen on (default 8000)')
+parser.add_argument('--cache-size', dest='cache_size', type=int, default=RESPONSE_CACHE_MB, help='Size in MB of the cache of the encoded slices (default {})'.format(RESPONSE_CACHE_MB))
+parser.add_argument('--image-cache-size', dest='image_cache_size', type=int, default=Mimir_lib.CACHE_BYTES // 2**20, help='Size in MB of the cache of the rendered slices of each image (default {})'.format(Mimir_lib.CACHE_BYTES // 2**20))
+parser.add_argument('--compress-level', dest='compress_level', type=int, help='Compression effort of the png slices, 0 (fastest) to 9 (smallest) (default 6)')
+parser.add_argument('--quality', dest='quality', type=int, help='Quality of the jpeg slices in %% (1-100, default 75)')
+parser.add_argument('--pyramid', dest='pyramid', action='store_true', help='Build and save the downsampled copies of the images missing before serving them, instead of scaling the slices down from the images')
+parser.add_argument('-q', '--quiet', dest='quiet', action='store_true', help='Do not log the requests')
+
+## @brief Error of a request, sent to the client with its HTTP status
+class RequestError(Exception):
+
+    ## @brief Create an error
+    # @param status HTTP status of the response
+    # @param message Description of the error
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+## @brief Get the name of an image in the URLs
+# @details Return the file name of the image without its .nii or .nii.gz extension
+# @param path Path of the image
+def get_volume_name(path):
+    name = os.path.basename(path)
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return os.path.splitext(name)[0]
+
+## @brief HTTP server of the slices of images
+# @details Each request is handled by its own thread. The encoded slices are kept in a cache shared by the images, and
+# a slice requested by several clients at once is only rendered by the first request, the other ones waiting for it.
+class SliceServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    ## @brief Create the server
+    # @param address (host, port) to listen on
+    # @param volumes Images to serve (Fd_data) by name
+    # @param cache_bytes Maximum size (in bytes) of the cached encoded slices
+    # @param compress_level zlib level (0-9) of the png slices, default of the encoder if None
+    # @param quality Quality (1-100) of the jpeg slices, default of the encoder if None
+    # @param quiet If true, the requests are not logged
+    def __init__(self, address, volumes, cache_bytes=RESPONSE_CACHE_MB * 2**20, compress_level=None, quality=None, quiet=False):
+        super().__init__(address, SliceRequestHandler)
+        self.volumes = volumes
+        self.cache = Mimir_lib.SliceCache(cache_bytes)
+        self.compress_level = compress_level
+        self.quality = quality
+        self.quiet = quiet
+        # [event, response, error] of the slices being rendered, by key
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+    ## @brief Get an encoded slice
+    # @details Return ((body, ETag), render time, encode time, origin of the response: "hit" if it was in the cache,
+    # "shared" if another request rendered it, "miss" otherwise)
+    # @param key Key of the slice in the cache
+    # @param render Function returning the RGBA array of the slice
+    # @param encoder Encoder of the slice (see Mimir_lib.ENCODERS)
+    def get_encoded_slice(self, key, render, encoder):
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached, 0, 0, 'hit'
+        with self._pending_lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = pending = [threading.Event(), None, None]
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            pending[0].wait()
+            if pending[2] is not None:
+                raise pending[2]
+            return pending[1], 0, 0, 'shared'
+        try:
+            start = time.perf_counter()
+            array = render()
+            encode_start = time.perf_counter()
+            fp = io.BytesIO()
+            Mimir_lib.save_slice(Mimir_lib.slice_to_image(array), fp, encoder, self.compress_level if encoder == 'png' else None,
+                                 self.quality if encoder == 'jpeg' else None)
+            body = fp.getvalue()
+            end = time.perf_counter()
+            pending[1] = (body, '"{}"'.format(hashlib.sha1(body).hexdigest()))
+            self.cache.put(key, pending[1], len(body))
+            return pending[1], encode_start - start, end - encode_start, 'miss'
+        except Exception as e:
+            pending[2] = e
+            raise
+        finally:
+            with self._pending_lock:
+                del self._pending[key]
+            pending[0].set()
+
+## @brief Handler of the requests of the SliceServer
+# @details The URLs are:
+# - / : JSON list of the images served
+# - /<image> : JSON description of an image (shape, voxel sizes, range of intensities, numbers of masks and points)
+# - /<image>/<time>/<plane>/<slice>.<png|npy|webp|jpg> : slice of an image, with the optional query parameters min and
+# max (contrast window, in intensities, the range of the image by default), cmap (colormap), overlays (0 to hide the
+# points and masks), interpolation (see Mimir_lib.INTERPOLATIONS) and size (maximum width and height of the slice, which
+# is then rendered from the pyramid of the image)
+#
+# The slices have an ETag, so clients can revalidate them with If-None-Match, and a Server-Timing header giving the
+# time spent rendering and encoding the slice and the origin of the response (cache hit, shared or miss).
+class SliceRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    ## @brief Answer a GET request
+    def do_GET(self):
+        start = time.perf_counter()
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.split('/') if part]
+        try:
+            if not parts:
+                self.send_json({'volumes': [self.get_volume_info(name) for name in sorted(self.server.volumes)]})
+            elif len(parts) == 1:
+                self.send_json(self.get_volume_info(parts[0]))
+            elif len(parts) == 4:
+                self.send_slice(parts, parse_qs(url.query), start)
+            else:
+                raise RequestError(404, 'Unknown URL: {}'.format(url.path))
+        except RequestError as e:
+            self.send_json({'error': str(e)}, e.status)
+        except Exception as e:
+            self.send_json({'error': '{}: {}'.format(type(e).__name__, e)}, 500)
+
+    ## @brief Get an image served
+    # @param name Name of the image
+    def get_volume(self, name):
+        image_file = self.server.volumes.get(name)
+        if image_file is None:
+            raise RequestError(404, 'Unknown image: {}'.format(name))
+        return image_file
+
+    ## @brief Get the description of an image
+    # @details Return a dictionary of the name, path, shape, voxel sizes, range of intensities and numbers of masks and
+    # points of the image
+    # @param name Name of the image
+    def get_volume_info(self, name):
+        image_file = self.get_volume(name)
+        return {'name': name, 'path': image_file.path, 'shape': [int(n) for n in image_file.shape],
+                'pixdim': [float(n) for n in image_file.header['pixdim'][1:4]],
+                'contrast_min': float(image_file.contrast_min), 'contrast_max': float(image_file.contrast_max),
+                'masks': len(image_file.masks), 'points': len(image_file.points)}
+
+    ## @brief Send a slice
+    # @details Raise a RequestError if the slice or its parameters are invalid
+    # @param parts [image, time, plane, slice with the extension of the encoder] parts of the URL
+    # @param query Query parameters of the URL
+    # @param start Time at which the request was received
+    def send_slice(self, parts, query, start):
+        image_file = self.get_volume(parts[0])
+        slice_name, extension = os.path.splitext(parts[3])
+        encoder = EXTENSION_ENCODERS.get(extension)
+        if encoder is None or not Mimir_lib.is_encoder_available(encoder):
+            raise RequestError(404, 'Unknown format: {}'.format(extension))
+        plane_nb = PLANES.get(parts[2].upper())
+        if plane_nb is None:
+            raise RequestError(404, 'Unknown plane: {} (choose in SAG, COR, AXI)'.format(parts[2]))
+        cycles = image_file.shape[3] if len(image_file.shape) == 4 else 1
+        get = lambda name: query[name][-1] if name in query else None
+        try:
+            img_nb, slice_nb = int(parts[1]), int(slice_name)
+            contrast_min = float(get('min')) if get('min') is not None else image_file.contrast_min
+            contrast_max = float(get('max')) if get('max') is not None else image_file.contrast_max
+            max_size = int(get('size')) if get('size') is not None else None
+        except ValueError as e:
+            raise RequestError(400, str(e))
+        if max_size is not None and max_size < 1:
+            raise RequestError(400, 'Size {} must be at least 1'.format(max_size))
+        if not 0 <= img_nb < cycles:
+            raise RequestError(404, 'Time {} out of range 0-{}'.format(img_nb, cycles - 1))
+        if not 0 <= slice_nb < image_file.shape[plane_nb]:
+            raise RequestError(404, 'Slice {} out of range 0-{}'.format(slice_nb, image_file.shape[plane_nb] - 1))
+        colormap = get('cmap') or None
+        overlays = get('overlays') not in ('0', 'false')
+        interpolation = get('interpolation') or 'nearest'
+        if interpolation not in Mimir_lib.INTERPOLATIONS:
+            raise RequestError(400, 'Unknown interpolation: {}'.format(interpolation))
+
+        args = (img_nb, plane_nb, slice_nb, contrast_min, contrast_max, colormap, interpolation, overlays, max_size)
+        version = image_file.get_slice_version(img_nb, plane_nb, slice_nb) if overlays else None
+        try:
+            (body, etag), render_time, encode_time, origin = self.server.get_encoded_slice(
+                (parts[0],) + args + (encoder, version), lambda: image_file.get_slice_array(*args)[0], encoder)
+        except ValueError as e:
+            # unknown colormap
+            raise RequestError(400, str(e))
+        timing = 'cache;desc={}, render;dur={:.2f}, encode;dur={:.2f}, total;dur={:.2f}'.format(
+                 origin, render_time * 1000, encode_time * 1000, (time.perf_counter() - start) * 1000)
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Server-Timing', timing)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES[encoder])
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        # the clients keep the slices but check with the ETag that they haven't changed
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Server-Timing', timing)
+        self.end_headers()
+        self.wfile.write(body)
+
+    ## @brief Send a JSON response
+    # @param content Object sent as JSON
+    # @param status HTTP status of the response
+    def send_json(self, content, status=200):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+## @brief Load the images and serve them according to the command line arguments
+def main():
+    args = parser.parse_args()
+    if(args.cache_size < 0 or args.image_cache_size < 0):
+        parser.error('arguments --cache-size and --image-cache-size must be positive')
+    if(args.compress_level is not None and not 0 <= args.compress_level <= 9):
+        parser.error('argument --compress-level: invalid choice {} (choose in range 0-9)'.format(args.compress_level))
+    if(args.quality is not None and not 1 <= args.quality <= 100):
+        parser.error('argument --quality: invalid choice {} (choose in range 1-100)'.format(args.quality))
+    try:
+        files = Mimir_cli.get_batch_files(args.path_in, args.manifest, args.link)
+    except OSError as e:
+        parser.error('argument --manifest: {}'.format(e))
+    if not files:
+        parser.error('no image to serve (give paths or a --manifest)')
+
+    volumes = {}
+    for path_in, link in files:
+        name = get_volume_name(path_in)
+        if name in volumes:
+            parser.error('two images are named {}: {} and {}'.format(name, volumes[name].path, path_in))
+        try:
+            image_file = Mimir_lib.Fd_data(path_in, args.lazy)
+            if(link):
+                image_file.load_points_masks(link)
+        except Exception as e:
+            parser.error('{}: {}'.format(path_in, e))
+        image_file.enable_cache(args.image_cache_size * 2**20)
+        # never built by the requests, which would wait for the whole image to be read
+        if(args.pyramid):
+            image_file.save_pyramid()
+        image_file.enable_pyramid(build=False)
+        volumes[name] = image_file
+        print("{}: {} loaded".format(name, path_in))
+
+    server = SliceServer((args.host, args.port), volumes, args.cache_size * 2**20, args.compress_level, args.quality, args.quiet)
+    print("Serving {} image(s) on http://{}:{}/".format(len(volumes), *server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+## @brief Rendering of the viewers' slices on a worker thread
+# @details Each viewer has at most one pending request: a new request replaces the one not started yet, so only the
+# latest slice asked by a viewer is rendered. The rendered slices are delivered to the UI thread by the rendered signal.
+class RenderScheduler(QObject):
+    ## Emitted with (viewer number, get_slice_array arguments, RGBA array, scale) when a slice has been rendered
+    rendered = pyqtSignal(int, object, object, object)
+
+    ## @brief Start the worker thread
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.image_file = None
+        # get_slice_array arguments of the pending request of each viewer
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    ## @brief Set the image to render the slices from
+    # @param image_file Image (Fd_data), None to stop rendering
+    def set_image_file(self, image_file):
+        with self._condition:
+            self.image_file = image_file
+            self._pending.clear()
+
+    ## @brief Ask for a slice to be rendered for a viewer
+    # @param num Number of the viewer
+    # @param args get_slice_array arguments of the slice
+    def request(self, num, args):
+        with self._condition:
+            self._pending[num] = args
+            self._condition.notify()
+
+    ## @brief Drop the pending request of a viewer
+    # @param num Number of the viewer
+    def cancel(self, num):
+        with self._condition:
+            self._pending.pop(num, None)
+
+    ## @brief Render the pending requests
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending or self.image_file is None:
+                    self._condition.wait()
+                image_file = self.image_file
+                num = next(iter(self._pending))
+                args = self._pending.pop(num)
+            try:
+                array, scale = image_file.get_slice_array(*args)
+            except Exception as e:
+                print("Render failed: " + str(e))
+                continue
+            self.rendered.emit(num, args, array, scale)
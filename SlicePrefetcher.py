@@ -0,0 +1,73 @@
+import threading
+import time
+
+## Time (in seconds) of slider motion anticipated by the prefetcher
+LOOKAHEAD_TIME = 0.5
+
+## @brief Background rendering of the slices about to be shown
+# @details Observe the moves of the sliders and render, on a worker thread, the next slices (or cycles) in the direction
+# of the move. The rendered slices go to the cache of the image, so the viewers only have to fetch them. The number of
+# slices rendered ahead grows with the speed of the move, up to a limit, and the pending ones are dropped at each move.
+class SlicePrefetcher:
+
+    ## @brief Start the worker thread
+    # @param max_slices Maximum number of slider positions rendered ahead
+    def __init__(self, max_slices=8):
+        self.max_slices = max_slices
+        self.image_file = None
+        # get_slice_array arguments of the slices waiting to be rendered
+        self._queue = []
+        # last (value, time, direction) of each slider (0:sagittal, 1:coronal, 2:axial, 3:cycle)
+        self._moves = {}
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    ## @brief Set the image to render the slices from
+    # @param image_file Image (Fd_data, with its cache enabled), None to stop prefetching
+    def set_image_file(self, image_file):
+        with self._condition:
+            self.image_file = image_file
+            self._queue = []
+            self._moves.clear()
+
+    ## @brief Observe a move of a slider
+    # @details Replace the pending slices by the ones of the next positions of the slider in the direction of the move
+    # @param axis Slider moved (0:sagittal, 1:coronal, 2:axial, 3:cycle)
+    # @param value New value of the slider
+    # @param maximum Maximum value of the slider
+    # @param make_tasks Function returning the list of get_slice_array arguments needed to show a value of the slider
+    def observe(self, axis, value, maximum, make_tasks):
+        now = time.monotonic()
+        last_value, last_time, last_direction = self._moves.get(axis, (value, now, 0))
+        step = value - last_value
+        direction = (step > 0) - (step < 0)
+        self._moves[axis] = (value, now, direction or last_direction)
+        if direction == 0:
+            return
+        # the faster the slider moves, the further ahead the slices are rendered
+        moves_per_second = 1 / max(now - last_time, 1e-3)
+        count = max(1, min(self.max_slices, int(moves_per_second * LOOKAHEAD_TIME)))
+        tasks = []
+        for i in range(1, count + 1):
+            next_value = value + step * i
+            if next_value < 0 or next_value > maximum:
+                break
+            tasks.extend(make_tasks(next_value))
+        with self._condition:
+            # the slices of a previous move (possibly in the other direction) are not needed anymore
+            self._queue = tasks
+            self._condition.notify()
+
+    ## @brief Render the pending slices
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue or self.image_file is None:
+                    self._condition.wait()
+                image_file = self.image_file
+                task = self._queue.pop(0)
+            try:
+                image_file.get_slice_array(*task)
+            except Exception as e:
+                print("Prefetch failed: " + str(e))
@@ -79,6 +79,9 @@ class Ui_MainWindow(object):
         self.contrast_nb_label = QtWidgets.QLabel(self.mainTab)
         self.contrast_nb_label.setObjectName("contrast_nb_label")
         self.horizontalLayout_4.addWidget(self.contrast_nb_label)
+        self.autoContrastBt = QtWidgets.QPushButton(self.mainTab)
+        self.autoContrastBt.setObjectName("autoContrastBt")
+        self.horizontalLayout_4.addWidget(self.autoContrastBt)
         self.verticalLayout_6.addLayout(self.horizontalLayout_4)
         self.label_2 = QtWidgets.QLabel(self.mainTab)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Maximum, QtWidgets.QSizePolicy.Maximum)
@@ -297,6 +300,8 @@ class Ui_MainWindow(object):
         self.actionDelete_point.setObjectName("actionDelete_point")
         self.actionNew_mask = QtWidgets.QAction(MainWindow)
         self.actionNew_mask.setObjectName("actionNew_mask")
+        self.actionNew_3D_mask = QtWidgets.QAction(MainWindow)
+        self.actionNew_3D_mask.setObjectName("actionNew_3D_mask")
         self.actionDelete_mask = QtWidgets.QAction(MainWindow)
         self.actionDelete_mask.setObjectName("actionDelete_mask")
         self.actionSave_points_masks = QtWidgets.QAction(MainWindow)
@@ -315,6 +320,8 @@ class Ui_MainWindow(object):
         self.actionSave_to_NifTI.setObjectName("actionSave_to_NifTI")
         self.actionSave_all_to_NifTI = QtWidgets.QAction(MainWindow)
         self.actionSave_all_to_NifTI.setObjectName("actionSave_all_to_NifTI")
+        self.actionSave_all_to_NifTI_labels = QtWidgets.QAction(MainWindow)
+        self.actionSave_all_to_NifTI_labels.setObjectName("actionSave_all_to_NifTI_labels")
         self.menuFile.addAction(self.actionOpen)
         self.menuFile.addAction(self.actionClose)
         self.menuFile.addSeparator()
@@ -323,11 +330,13 @@ class Ui_MainWindow(object):
         self.menuPoint.addAction(self.actionNew_point)
         self.menuPoint.addAction(self.actionDelete_point)
         self.menuMask.addAction(self.actionNew_mask)
+        self.menuMask.addAction(self.actionNew_3D_mask)
         self.menuMask.addAction(self.actionDelete_mask)
         self.menuMask.addAction(self.actionSet_color)
         self.menuMask.addSeparator()
         self.menuMask.addAction(self.actionSave_to_NifTI)
         self.menuMask.addAction(self.actionSave_all_to_NifTI)
+        self.menuMask.addAction(self.actionSave_all_to_NifTI_labels)
         self.menuScreenshot.addAction(self.actionSave_current_sagittal_slice)
         self.menuScreenshot.addAction(self.actionSave_current_coronal_slice)
         self.menuScreenshot.addAction(self.actionSave_current_axial_slice)
@@ -347,6 +356,8 @@ class Ui_MainWindow(object):
         self.cycle_nb_label.setText(_translate("MainWindow", "0 / 0"))
         self.label_6.setText(_translate("MainWindow", "Contrast min | max: "))
         self.contrast_nb_label.setText(_translate("MainWindow", "0% | 0%"))
+        self.autoContrastBt.setToolTip(_translate("MainWindow", "Set the contrast from the 1st and 99th percentiles of the intensities"))
+        self.autoContrastBt.setText(_translate("MainWindow", "Auto"))
         self.label_2.setText(_translate("MainWindow", "Min contrast"))
         self.label.setText(_translate("MainWindow", "Max contrast"))
         self.tabMenu.setTabText(self.tabMenu.indexOf(self.mainTab), _translate("MainWindow", "Main"))
@@ -377,6 +388,7 @@ class Ui_MainWindow(object):
         self.actionNew_point.setText(_translate("MainWindow", "New point"))
         self.actionDelete_point.setText(_translate("MainWindow", "Delete point"))
         self.actionNew_mask.setText(_translate("MainWindow", "New mask"))
+        self.actionNew_3D_mask.setText(_translate("MainWindow", "New 3D mask"))
         self.actionDelete_mask.setText(_translate("MainWindow", "Delete mask"))
         self.actionSave_points_masks.setText(_translate("MainWindow", "Save points/masks"))
         self.actionLoad_points_masks.setText(_translate("MainWindow", "Load points/masks"))
@@ -386,5 +398,6 @@ class Ui_MainWindow(object):
         self.actionSet_color.setText(_translate("MainWindow", "Set color"))
         self.actionSave_to_NifTI.setText(_translate("MainWindow", "Save to NifTI"))
         self.actionSave_all_to_NifTI.setText(_translate("MainWindow", "Save all to NifTI"))
+        self.actionSave_all_to_NifTI_labels.setText(_translate("MainWindow", "Save all to NifTI label map"))
 
 from CursorGraphicsView import CursorGraphicsView
@@ -0,0 +1,59 @@
+import os
+
+import nibabel
+import numpy
+
+## @brief Create an image for the tests
+# @details Save a NIfTI image made of smooth patterns and noise, in the range 0-1000 for the integer types, and return
+# its path
+# @param directory Directory of the image
+# @param shape Shape of the image (3 or 4 dimensions)
+# @param dtype Data type of the image
+# @param pixdim Voxel sizes of the image
+# @param gzip If true, save the image as .nii.gz
+# @param random numpy RandomState generating the noise
+def make_image(directory, shape, dtype, pixdim, gzip, random):
+    grid = numpy.ogrid[tuple(slice(0, n) for n in shape)]
+    data = 500 + 300 * numpy.sin(grid[0] / 8.0) * numpy.cos(grid[1] / 11.0) + 100 * numpy.sin(grid[2] / 5.0)
+    if len(shape) == 4:
+        data = data + 20 * grid[3]
+    data = data + random.normal(0, 20, shape)
+    dtype = numpy.dtype(dtype)
+    if dtype.kind in 'iu':
+        data = numpy.clip(data, numpy.iinfo(dtype).min, numpy.iinfo(dtype).max)
+    image = nibabel.Nifti1Image(data.astype(dtype), numpy.eye(4))
+    image.header.set_zooms(tuple(pixdim) + (1.0,) * (len(shape) - 3))
+    path = os.path.join(directory, 'image.nii.gz' if gzip else 'image.nii')
+    nibabel.save(image, path)
+    return path
+
+## @brief Add points and masks to an image
+# @details Add random points and polygonal masks. Half of the points, and all the masks, are on the middle slices of
+# the planes (on the first cycle for the points).
+# @param image_file Image to annotate
+# @param n_points Number of points
+# @param n_masks Number of masks
+# @param random numpy RandomState placing the points and masks
+def make_annotations(image_file, n_points, n_masks, random):
+    shape = image_file.shape
+    cycles = shape[3] if len(shape) == 4 else 1
+    middle = [n // 2 for n in shape[:3]]
+    for i in range(n_points):
+        point = [int(random.randint(n)) for n in shape[:3]] + [int(random.randint(cycles))]
+        if i % 2 == 0:
+            point[i // 2 % 3] = middle[i // 2 % 3]
+            point[3] = 0
+        image_file.add_point(point, [int(c) for c in random.randint(0, 256, 3)] + [255])
+    for i in range(n_masks):
+        plane_nb = i % 3
+        width, height = (n for j, n in enumerate(shape[:3]) if j != plane_nb)
+        radius = random.uniform(min(width, height) / 8, min(width, height) / 3)
+        angles = numpy.sort(random.uniform(0, 2 * numpy.pi, 8))
+        points = []
+        for x, y in zip(width / 2 + radius * numpy.cos(angles), height / 2 + radius * numpy.sin(angles)):
+            point = [int(x), int(y)]
+            point.insert(plane_nb, middle[plane_nb])
+            points.append(point)
+        mask = image_file.get_mask(i)
+        mask.add_points(points)
+        mask.set_color([int(c) for c in random.randint(0, 256, 3)] + [128])
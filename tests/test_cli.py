@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import nibabel
+import numpy
+from PIL import Image
+import Mimir_lib
+from tests import fixtures
+
+## Path of the command line interface
+CLI_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Mimir_cli.py')
+
+## @brief Format of a single slice saved by the command line interface
+class SingleSliceTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+        self.path = fixtures.make_image(self.directory, (24, 20, 16), 'int16', (1, 1, 1), False, numpy.random.RandomState(0))
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    ## @brief Save the axial slice 5 of the image
+    # @details Return the completed process
+    # @param output Name of the output file
+    # @param options Other arguments of the command line
+    def save_slice(self, output, *options):
+        return subprocess.run([sys.executable, CLI_PATH, self.path, '-p', 'AXI', '-s', '5', '-o', os.path.join(self.directory, output)] + list(options),
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+    def test_encoder_given_by_extension(self):
+        for output, image_format in (('slice.jpg', 'JPEG'), ('slice.jpeg', 'JPEG'), ('slice.webp', 'WEBP'), ('slice.tif', 'PNG')):
+            self.assertEqual(self.save_slice(output).returncode, 0)
+            self.assertEqual(Image.open(os.path.join(self.directory, output)).format, image_format)
+        self.assertEqual(self.save_slice('slice.npy').returncode, 0)
+        self.assertEqual(numpy.load(os.path.join(self.directory, 'slice.npy')).shape, (20, 24, 3))
+
+    def test_encoder_not_matching_extension(self):
+        process = self.save_slice('slice.webp', '--encoder', 'png')
+        self.assertEqual(process.returncode, 2)
+        self.assertIn('does not match the extension', process.stderr)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'slice.webp')))
+        self.assertEqual(self.save_slice('slice.png', '--encoder', 'png').returncode, 0)
+
+    def test_default_contrast_from_header(self):
+        image = nibabel.load(self.path)
+        image = nibabel.Nifti1Image(numpy.array(image.dataobj), image.affine, image.header)
+        image.header['cal_min'] = 300
+        image.header['cal_max'] = 700
+        nibabel.save(image, self.path)
+        arrays = []
+        for options in ([], ['--lazy']):
+            self.assertEqual(self.save_slice('slice.npy', *options).returncode, 0)
+            arrays.append(numpy.load(os.path.join(self.directory, 'slice.npy')))
+        numpy.testing.assert_array_equal(arrays[0], arrays[1])
+        expected, scale = Mimir_lib.Fd_data(self.path).get_slice_array(0, 2, 5, 300.0, 700.0, None)
+        numpy.testing.assert_array_equal(arrays[0], expected[:, :, :3])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import io
+import os
+import tempfile
+import unittest
+
+import numpy
+from PIL import Image
+import Mimir_lib
+from tests import fixtures
+
+## @brief Export of the slices to files
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+        random = numpy.random.RandomState(0)
+        path = fixtures.make_image(self.directory, (24, 20, 16, 2), 'int16', (1, 1, 1.5), False, random)
+        self.image_file = Mimir_lib.Fd_data(path)
+        fixtures.make_annotations(self.image_file, 40, 3, random)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    ## @brief Save every slice of the first cycle and return the contents of the files by slice
+    # @param jobs Number of processes rendering the slices
+    # @param encoder Encoder of the slices
+    def export(self, jobs, encoder='png'):
+        output = os.path.join(self.directory, 'j{}'.format(jobs))
+        tasks = [(0, plane_nb, slice_nb, self.image_file.contrast_min, self.image_file.contrast_max, 'viridis',
+                  os.path.join(output, '{}_{}{}'.format(plane_nb, slice_nb, Mimir_lib.ENCODER_EXTENSIONS[encoder])))
+                 for plane_nb in range(3) for slice_nb in range(self.image_file.shape[plane_nb])]
+        Mimir_lib.export_slices(self.image_file, tasks, jobs, chunk_size=8, encoder=encoder)
+        contents = {}
+        for task in tasks:
+            with open(task[-1], 'rb') as fp:
+                contents[task[:3]] = fp.read()
+        return contents
+
+    def test_processes_draw_points_and_masks(self):
+        sequential = self.export(1)
+        parallel = self.export(2)
+        self.assertEqual(sorted(parallel), sorted(sequential))
+        for key in sequential:
+            self.assertEqual(parallel[key], sequential[key], key)
+        # the slices compared hold points, which must have been drawn
+        point = self.image_file.points[0]
+        annotated, scale = self.image_file.get_slice_array(0, 2, point[2], self.image_file.contrast_min, self.image_file.contrast_max, 'viridis')
+        plain, scale = self.image_file.get_slice_array(0, 2, point[2], self.image_file.contrast_min, self.image_file.contrast_max, 'viridis', overlays=False)
+        self.assertFalse(numpy.array_equal(annotated, plain))
+
+    def test_processes_encoders(self):
+        self.assertEqual(self.export(2, 'npy'), self.export(1, 'npy'))
+
+## @brief Formats of the slices saved
+class EncoderTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+        random = numpy.random.RandomState(0)
+        self.image_file = Mimir_lib.Fd_data(fixtures.make_image(self.directory, (48, 40, 16), 'int16', (1, 1, 1.5), False, random))
+        fixtures.make_annotations(self.image_file, 20, 3, random)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    ## @brief Save the axial slice 8 with export_slices
+    # @details Return the content of the file and the RGB array of the slice
+    # @param encoder Encoder of the slice
+    # @param options Other arguments of export_slices (compress_level, quality)
+    def export(self, encoder, **options):
+        path = os.path.join(self.directory, 'slice' + Mimir_lib.ENCODER_EXTENSIONS[encoder])
+        Mimir_lib.export_slices(self.image_file, [(0, 2, 8, 0, 1000, 'viridis', path)], encoder=encoder, **options)
+        with open(path, 'rb') as fp:
+            content = fp.read()
+        array, scale = self.image_file.get_slice_array(0, 2, 8, 0, 1000, 'viridis')
+        return content, array[:, :, :3]
+
+    ## @brief Decode a slice saved by an encoder
+    # @param encoder Encoder of the slice
+    # @param content Content of the file
+    def decode(self, encoder, content):
+        if encoder == 'npy':
+            return numpy.load(io.BytesIO(content))
+        image = Image.open(io.BytesIO(content))
+        self.assertEqual(image.format, 'JPEG' if encoder == 'jpeg' else encoder.upper())
+        return numpy.asarray(image.convert('RGB'))
+
+    def test_lossless(self):
+        for encoder in ('png', 'npy', 'webp'):
+            if not Mimir_lib.is_encoder_available(encoder):
+                continue
+            content, expected = self.export(encoder)
+            numpy.testing.assert_array_equal(self.decode(encoder, content), expected, encoder)
+
+    def test_png_compress_level(self):
+        contents = {}
+        for compress_level in (None, 0, 9):
+            content, expected = self.export('png', compress_level=compress_level)
+            numpy.testing.assert_array_equal(self.decode('png', content), expected)
+            contents[compress_level] = content
+        self.assertGreater(len(contents[0]), len(contents[9]))
+        # the default settings of python-pillow
+        buffer = io.BytesIO()
+        Mimir_lib.slice_to_image(self.image_file.get_slice_array(0, 2, 8, 0, 1000, 'viridis')[0]).save(buffer, 'PNG')
+        self.assertEqual(contents[None], buffer.getvalue())
+
+    @unittest.skipUnless(Mimir_lib.is_encoder_available('webp'), 'python-pillow built without WebP')
+    def test_webp_compress_level(self):
+        for compress_level in (0, 6):
+            content, expected = self.export('webp', compress_level=compress_level)
+            numpy.testing.assert_array_equal(self.decode('webp', content), expected)
+
+    def test_jpeg_quality(self):
+        contents = {}
+        for quality in (None, 20, 95):
+            content, expected = self.export('jpeg', quality=quality)
+            decoded = self.decode('jpeg', content)
+            self.assertEqual(decoded.shape, expected.shape)
+            contents[quality] = (content, numpy.abs(decoded.astype(int) - expected).mean())
+        self.assertGreater(len(contents[95][0]), len(contents[None][0]))
+        self.assertGreater(len(contents[None][0]), len(contents[20][0]))
+        self.assertLess(contents[95][1], contents[20][1])
+        self.assertLess(contents[95][1], 5)
+
+    def test_available(self):
+        self.assertTrue(Mimir_lib.is_encoder_available('npy'))
+        self.assertTrue(Mimir_lib.is_encoder_available('png'))
+        self.assertTrue(Mimir_lib.is_encoder_available('jpeg'))
+        self.assertFalse(Mimir_lib.is_encoder_available('unknown'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+import nibabel
+import numpy
+import Mimir_lib
+from tests import fixtures
+
+## @brief Histogram and percentiles of the intensities
+class HistogramTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    ## @brief Check the percentiles of an image against numpy.percentile
+    # @details numpy.percentile interpolates between the two values around the rank of the percentile, which bound the
+    # percentiles of an exact histogram, and those of the other histograms up to the width of a bin
+    # @param path Path of the image
+    # @param exact True if the histogram of the image must be exact
+    def assertPercentilesMatch(self, path, exact):
+        image_file = Mimir_lib.Fd_data(path, lazy=True)
+        data = numpy.asarray(nibabel.load(path).dataobj)
+        histogram = image_file.get_histogram()
+        self.assertEqual(histogram.exact, exact)
+        width = 0 if exact else histogram.edges[1] - histogram.edges[0]
+        cycles = [None] + list(range(data.shape[3])) if data.ndim == 4 else [None]
+        for img_nb in cycles:
+            values = numpy.sort(data if img_nb is None else data[..., img_nb], axis=None)
+            for percent in (0, 1, 2.5, 25, 50, 90, 99, 100):
+                percentile = image_file.get_percentile(percent, img_nb)
+                expected = numpy.percentile(values, percent)
+                index = percent / 100 * (len(values) - 1)
+                lower, upper = values[int(numpy.floor(index))], values[int(numpy.ceil(index))]
+                self.assertTrue(lower - width <= percentile <= upper + width, (img_nb, percent, percentile, expected))
+                self.assertLessEqual(abs(percentile - expected), upper - lower + width)
+                if exact:
+                    self.assertIn(percentile, values)
+            self.assertEqual(image_file.get_auto_contrast(2, 98, img_nb),
+                             (image_file.get_percentile(2, img_nb), image_file.get_percentile(98, img_nb)))
+        self.assertEqual((image_file.get_percentile(0), image_file.get_percentile(100)), (data.min(), data.max()))
+        self.assertEqual((image_file.contrast_min, image_file.contrast_max), (data.min(), data.max()))
+
+    def test_int16(self):
+        self.assertPercentilesMatch(fixtures.make_image(self.directory, (24, 20, 16, 2), 'int16', (1, 1, 1), False, numpy.random.RandomState(0)), True)
+
+    def test_uint8(self):
+        data = numpy.random.RandomState(0).randint(10, 200, (24, 20, 16)).astype('uint8')
+        path = os.path.join(self.directory, 'image.nii')
+        nibabel.save(nibabel.Nifti1Image(data, numpy.eye(4)), path)
+        self.assertPercentilesMatch(path, True)
+
+    def test_float32(self):
+        self.assertPercentilesMatch(fixtures.make_image(self.directory, (24, 20, 16, 2), 'float32', (1, 1, 1), False, numpy.random.RandomState(0)), False)
+
+if __name__ == '__main__':
+    unittest.main()
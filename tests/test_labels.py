@@ -0,0 +1,88 @@
+import json
+import os
+import tempfile
+import unittest
+
+import nibabel
+import numpy
+import Mimir_lib
+from tests import fixtures
+
+## @brief Masks saved in a single NIfTI label map
+class LabelsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+        random = numpy.random.RandomState(0)
+        self.image_file = Mimir_lib.Fd_data(fixtures.make_image(self.directory, (24, 20, 16), 'int16', (1, 2, 1.5), False, random))
+        fixtures.make_annotations(self.image_file, 0, 3, random)
+        # a 3D mask across the 2D ones, without color
+        mask = self.image_file.masks[self.image_file.add_mask_3d(2)]
+        for slice_nb in (4, 11):
+            mask.add_points([[11, 2, slice_nb], [13, 2, slice_nb], [13, 18, slice_nb], [11, 18, slice_nb]])
+        self.path = os.path.join(self.directory, 'labels.nii')
+        self.colors_path = os.path.join(self.directory, 'labels.json')
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    ## @brief Get the labels expected for the masks of the image
+    # @details Each mask is rasterized on its own, the following masks overwriting the previous ones
+    # @param dtype Data type of the labels
+    def get_expected_labels(self, dtype):
+        labels = numpy.zeros(self.image_file.shape[:3], dtype=dtype)
+        for i, mask in enumerate(self.image_file.masks):
+            volume = numpy.zeros(self.image_file.shape[:3], dtype=bool)
+            mask.fill_volume(volume, True)
+            self.assertTrue(volume.any(), i)
+            labels[volume] = i + 1
+        return labels
+
+    def test_labels(self):
+        self.image_file.save_labels_to_nifti(self.path, self.colors_path)
+        image = nibabel.load(self.path)
+        labels = numpy.asarray(image.dataobj)
+        self.assertEqual(labels.dtype, numpy.uint8)
+        numpy.testing.assert_array_equal(labels, self.get_expected_labels(numpy.uint8))
+        self.assertEqual(set(numpy.unique(labels)), {0, 1, 2, 3, 4})
+        numpy.testing.assert_allclose(image.header.get_zooms(), (1, 2, 1.5))
+        # the 3D mask overwrites the 2D ones where they overlap
+        volume = numpy.zeros(labels.shape, dtype=bool)
+        self.image_file.masks[0].fill_volume(volume, True)
+        self.assertIn(4, labels[volume])
+
+        with open(self.colors_path) as fp:
+            colors = json.load(fp)
+        self.assertEqual(colors['image'], self.image_file.path)
+        self.assertEqual([(label['label'], label['mask'], label['type']) for label in colors['labels']],
+                         [(1, 0, '2D'), (2, 1, '2D'), (3, 2, '2D'), (4, 3, '3D')])
+        self.assertEqual([label['color'] for label in colors['labels']],
+                         [mask.get_color() for mask in self.image_file.masks[:3]] + [self.image_file.default_color])
+
+    def test_uint16_labels(self):
+        for i in range(260):
+            self.image_file.get_mask(4 + i).add_points([[i % 24, 0, 0], [i % 24, 3, 0], [i % 24, 3, 3]])
+        self.image_file.save_labels_to_nifti(self.path)
+        labels = numpy.asarray(nibabel.load(self.path).dataobj)
+        self.assertEqual(labels.dtype, numpy.uint16)
+        self.assertEqual(labels.max(), 264)
+        numpy.testing.assert_array_equal(labels, self.get_expected_labels(numpy.uint16))
+        self.assertFalse(os.path.exists(self.colors_path))
+
+    def test_cropped_labels(self):
+        self.image_file.save_labels_to_nifti(self.path, affine=self.image_file.get_affine(), crop=True)
+        image = nibabel.load(self.path)
+        expected = self.get_expected_labels(numpy.uint8)
+        ranges = [numpy.flatnonzero(expected.any(axis=tuple(j for j in range(3) if j != i))) for i in range(3)]
+        numpy.testing.assert_array_equal(numpy.asarray(image.dataobj), expected[tuple(slice(r[0], r[-1] + 1) for r in ranges)])
+        numpy.testing.assert_array_equal(image.affine[:3, 3], self.image_file.get_affine()[:3, :3].dot([r[0] for r in ranges]) + self.image_file.get_affine()[:3, 3])
+
+    def test_too_many_masks(self):
+        self.image_file.masks = self.image_file.masks[:1] * 65536
+        with self.assertRaises(ValueError):
+            self.image_file.save_labels_to_nifti(self.path)
+        self.assertFalse(os.path.exists(self.path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import tempfile
+import unittest
+
+import nibabel
+import numpy
+import Mimir_lib
+from tests import fixtures
+
+## @brief Slices of an image loaded lazily or eagerly
+class LazyTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    ## @brief Check that an image renders the same slices and statistics in lazy and eager modes
+    # @param path Path of the image
+    def assertLazyEqualsEager(self, path):
+        images = []
+        for lazy in (False, True):
+            image_file = Mimir_lib.Fd_data(path, lazy=lazy)
+            fixtures.make_annotations(image_file, 30, 3, numpy.random.RandomState(1))
+            images.append(image_file)
+        eager, lazy = images
+        self.assertIsNone(lazy.data)
+        self.assertEqual(lazy.contrast_min, eager.contrast_min)
+        self.assertEqual(lazy.contrast_max, eager.contrast_max)
+        cycles = eager.shape[3] if len(eager.shape) == 4 else 1
+        contrast = (eager.contrast_min, eager.contrast_max)
+        for img_nb in range(cycles):
+            for plane_nb in range(3):
+                size = eager.shape[plane_nb]
+                for slice_nb in (0, size // 2, size - 1):
+                    for colormap in (None, 'viridis'):
+                        for options in ({}, {'overlays': False}, {'interpolation': 'bilinear', 'max_size': 9}):
+                            eager_array, eager_scale = eager.get_slice_array(img_nb, plane_nb, slice_nb, contrast[0], contrast[1], colormap, **options)
+                            lazy_array, lazy_scale = lazy.get_slice_array(img_nb, plane_nb, slice_nb, contrast[0], contrast[1], colormap, **options)
+                            numpy.testing.assert_array_equal(lazy_array, eager_array)
+                            self.assertEqual(lazy_scale, eager_scale)
+        eager_stats, lazy_stats = eager.get_roi_statistics(), lazy.get_roi_statistics()
+        for name in ('voxels', 'mean', 'std', 'min', 'max'):
+            numpy.testing.assert_allclose(lazy_stats[name], eager_stats[name])
+
+    def test_nifti(self):
+        self.assertLazyEqualsEager(fixtures.make_image(self.directory, (24, 20, 16, 2), 'int16', (1, 1, 1.5), False, numpy.random.RandomState(0)))
+
+    def test_compressed_nifti(self):
+        self.assertLazyEqualsEager(fixtures.make_image(self.directory, (24, 20, 16, 2), 'int16', (1, 1, 1.5), True, numpy.random.RandomState(0)))
+
+    def test_float_nifti(self):
+        self.assertLazyEqualsEager(fixtures.make_image(self.directory, (17, 20, 13), 'float32', (2, 1, 1), False, numpy.random.RandomState(0)))
+
+    def test_scaled_nifti(self):
+        data = numpy.random.RandomState(0).randint(-1000, 1000, (16, 18, 12, 2)).astype('int16')
+        image = nibabel.Nifti1Image(data, numpy.eye(4))
+        # the intensities are the values of the file scaled by the header
+        image.header.set_slope_inter(0.5, 10)
+        path = os.path.join(self.directory, 'scaled.nii')
+        nibabel.save(image, path)
+        self.assertLazyEqualsEager(path)
+
+## @brief Range of values of an image loaded lazily
+class ContrastRangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+        data = numpy.random.RandomState(0).randint(0, 1000, (16, 18, 12, 2)).astype('int16')
+        # the extremes of the image are out of the middle slices
+        data[0, 0, 0, 1] = -500
+        data[15, 17, 11, 1] = 3000
+        self.image = nibabel.Nifti1Image(data, numpy.eye(4))
+        self.path = os.path.join(self.directory, 'image.nii')
+        nibabel.save(self.image, self.path)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    ## @brief Load the image lazily, failing if the whole volume is read
+    def load_lazy(self):
+        image_file = Mimir_lib.Fd_data(self.path, lazy=True)
+        def iter_blocks(img_nb=None):
+            raise AssertionError('the whole volume is read')
+        image_file._iter_blocks = iter_blocks
+        return image_file
+
+    def test_estimate_from_middle_slices(self):
+        image_file = self.load_lazy()
+        self.assertFalse(image_file.has_contrast_range())
+        self.assertIsNone(image_file.get_header_range())
+        contrast_min, contrast_max = image_file.get_contrast_estimate()
+        self.assertTrue(0 <= contrast_min <= contrast_max < 1000)
+        self.assertFalse(image_file.has_contrast_range())
+        del image_file._iter_blocks
+        self.assertEqual((image_file.contrast_min, image_file.contrast_max), (-500, 3000))
+        self.assertTrue(image_file.has_contrast_range())
+        self.assertEqual(image_file.get_contrast_estimate(), (-500, 3000))
+
+    def test_estimate_from_header(self):
+        self.image.header['cal_min'] = 100
+        self.image.header['cal_max'] = 800.5
+        nibabel.save(self.image, self.path)
+        image_file = self.load_lazy()
+        self.assertEqual(image_file.get_header_range(), (100, 800.5))
+        self.assertEqual(image_file.get_contrast_estimate(), (100, 800.5))
+
+    def test_eager_range_is_exact(self):
+        image_file = Mimir_lib.Fd_data(self.path)
+        self.assertTrue(image_file.has_contrast_range())
+        self.assertEqual(image_file.get_contrast_estimate(), (-500, 3000))
+
+if __name__ == '__main__':
+    unittest.main()
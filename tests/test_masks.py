@@ -0,0 +1,77 @@
+import sys
+import threading
+import unittest
+
+import Mimir_lib
+
+## @brief Masks modified while their slices are drawn by other threads
+class MaskThreadsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.switch_interval = sys.getswitchinterval()
+        # the threads are switched as often as possible to make the races likely
+        sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        sys.setswitchinterval(self.switch_interval)
+
+    def test_points_on_slice_are_a_snapshot(self):
+        mask = Mimir_lib.Mask((64, 64, 64), [1, 1, 1, 1])
+        mask.add_point([10, 0, 0])
+        mask.add_point([10, 1, 1])
+        points = mask.get_points_on_slice(0, 10)
+        slices = mask.get_slices()
+        mask.add_point([10, 2, 5])
+        mask.delete_point(0)
+        self.assertEqual(points, [[10, 0, 0], [10, 1, 1]])
+        self.assertNotIn((2, 5), slices)
+        self.assertEqual(mask.get_points_on_slice(0, 10), [[10, 1, 1], [10, 2, 5]])
+
+    def test_3d_points_on_slice_are_a_snapshot(self):
+        mask = Mimir_lib.Mask3D((64, 64, 64), [1, 1, 1, 1], 2)
+        mask.add_point([5, 5, 8])
+        mask.add_point([15, 5, 8])
+        points = mask.get_points_on_slice(2, 8)
+        mask.add_point([10, 18, 8])
+        self.assertEqual(points, [[5, 5, 8], [15, 5, 8]])
+        # the polygon is filled from its third vertex
+        self.assertEqual(mask.get_points_on_slice(2, 8), [])
+
+    def test_read_while_modified(self):
+        mask = Mimir_lib.Mask((64, 64, 64), [1, 1, 1, 1])
+        # the mask is frozen in the plane x=10 by its second point
+        mask.add_point([10, 0, 0])
+        mask.add_point([10, 1, 1])
+        mask.add_point([10, 0, 1])
+        initial_slices = mask.get_slices()
+        stop = threading.Event()
+        errors = []
+
+        ## @brief Add and delete points on many slices of the plane of the mask
+        def modify():
+            try:
+                while not stop.is_set():
+                    for i in range(2, 60):
+                        mask.add_point([10, i, i])
+                    for i in range(2, 60):
+                        mask.delete_point(len(mask.points) - 1)
+            except Exception as error:
+                errors.append(error)
+
+        thread = threading.Thread(target=modify)
+        thread.start()
+        try:
+            for i in range(3000):
+                slices = mask.get_slices()
+                for plane_nb, slice_nb in list(slices)[:5]:
+                    points = mask.get_points_on_slice(plane_nb, slice_nb)
+                    self.assertIsInstance(points, list)
+                mask.rasterize()
+        finally:
+            stop.set()
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(mask.get_slices(), initial_slices)
+
+if __name__ == '__main__':
+    unittest.main()
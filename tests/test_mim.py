@@ -0,0 +1,105 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+import numpy
+import Mimir_lib
+from tests import fixtures
+
+## @brief Payload of a malicious .mim file: unpickling it would run a shell command
+class _Exploit:
+    def __reduce__(self):
+        return (os.system, ('echo exploited',))
+
+## @brief Loading and saving of the .mim files
+class MimTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+        random = numpy.random.RandomState(0)
+        path = fixtures.make_image(self.directory, (24, 20, 16, 2), 'int16', (1, 1, 1.5), False, random)
+        self.image_file = Mimir_lib.Fd_data(path)
+        fixtures.make_annotations(self.image_file, 20, 3, random)
+        self.mim_path = os.path.join(self.directory, 'annotations.mim')
+        self.image_file.save_points_masks(self.mim_path)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    ## @brief Check that a file which can't be loaded leaves the points and masks as they were
+    # @param path Path of the file
+    # @param error Exception expected
+    def assertLoadKeepsState(self, path, error):
+        points = [list(point) for point in self.image_file.points]
+        masks = list(self.image_file.masks)
+        slice_points = list(self.image_file.get_points_on_slice(points[0][3], 0, points[0][0]))
+        version = self.image_file.get_slice_version(points[0][3], 0, points[0][0])
+        with self.assertRaises(error):
+            self.image_file.load_points_masks(path)
+        self.assertEqual(self.image_file.points, points)
+        self.assertEqual(self.image_file.masks, masks)
+        self.assertEqual(self.image_file.get_points_on_slice(points[0][3], 0, points[0][0]), slice_points)
+        self.assertEqual(self.image_file.get_slice_version(points[0][3], 0, points[0][0]), version)
+
+    def test_legacy_unpickler_rejects_other_classes(self):
+        path = os.path.join(self.directory, 'exploit.mim')
+        with open(path, 'wb') as fp:
+            pickle.dump(([], [_Exploit()]), fp)
+        self.assertLoadKeepsState(path, pickle.UnpicklingError)
+
+    def test_truncated_file_keeps_state(self):
+        with open(self.mim_path, 'rb') as fp:
+            content = fp.read()
+        for size in (len(content) // 2, 10):
+            path = os.path.join(self.directory, 'truncated.mim')
+            with open(path, 'wb') as fp:
+                fp.write(content[:size])
+            self.assertLoadKeepsState(path, ValueError)
+
+    def test_round_trip_with_3d_masks(self):
+        mask_3d = self.image_file.masks[self.image_file.add_mask_3d(2)]
+        mask_3d.set_key_polygon(3, [[2, 2], [15, 3], [10, 14]])
+        mask_3d.set_key_polygon(9, [[4, 4], [18, 6], [8, 17], [3, 12]])
+        mask_3d.set_key_polygon(12, [[5, 5], [6, 9]])
+        mask_3d.set_color([10, 20, 30, 128])
+        self.image_file.get_mask(0).set_color([200, 100, 0, 255])
+        self.image_file.save_points_masks(self.mim_path)
+        self.assertEqual(Mimir_lib.read_mim(self.mim_path)['masks_flags'][-1] & Mimir_lib.MIM_MASK_3D, Mimir_lib.MIM_MASK_3D)
+        with open(self.mim_path, 'rb') as fp:
+            self.assertEqual(Mimir_lib._MIM_HEADER.unpack(fp.read(Mimir_lib._MIM_HEADER.size))[1], Mimir_lib.MIM_VERSION)
+
+        loaded = Mimir_lib.Fd_data(self.image_file.path)
+        loaded.load_points_masks(self.mim_path)
+        self.assertEqual(loaded.points, self.image_file.points)
+        self.assertEqual([type(mask) for mask in loaded.masks], [type(mask) for mask in self.image_file.masks])
+        for mask, saved in zip(loaded.masks, self.image_file.masks):
+            self.assertEqual(mask.points, saved.points)
+            self.assertEqual(mask.get_color(), saved.get_color())
+            self.assertEqual(mask.get_slices(), saved.get_slices())
+        self.assertEqual(loaded.masks[-1].axis, 2)
+        self.assertEqual(loaded.masks[-1].key_polygons, mask_3d.key_polygons)
+        for slice_nb in (3, 6, 9, 12):
+            section, saved = loaded.masks[-1].get_section(2, slice_nb), mask_3d.get_section(2, slice_nb)
+            self.assertEqual(section is None, saved is None)
+            if section is not None:
+                self.assertEqual(section[0], saved[0])
+                numpy.testing.assert_array_equal(section[1], saved[1])
+        # a key slice of less than 3 vertices is drawn as points
+        self.assertEqual(loaded.masks[-1].get_points_on_slice(2, 12), [[5, 5, 12], [6, 9, 12]])
+
+    def test_files_without_3d_masks_keep_version_2(self):
+        with open(self.mim_path, 'rb') as fp:
+            self.assertEqual(Mimir_lib._MIM_HEADER.unpack(fp.read(Mimir_lib._MIM_HEADER.size))[1], 2)
+
+    def test_load_replaces_points_index(self):
+        point = self.image_file.points[0]
+        empty = Mimir_lib.Fd_data(self.image_file.path)
+        empty.save_points_masks(self.mim_path)
+        self.image_file.load_points_masks(self.mim_path)
+        self.assertEqual(self.image_file.points, [])
+        self.assertEqual(self.image_file.get_points_on_slice(point[3], 0, point[0]), [])
+
+if __name__ == '__main__':
+    unittest.main()
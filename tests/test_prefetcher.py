@@ -0,0 +1,96 @@
+import threading
+import time
+import unittest
+
+from SlicePrefetcher import SlicePrefetcher
+
+## @brief Image recording the slices rendered, each render waiting to be released
+class BlockingImage:
+
+    def __init__(self):
+        self.rendered = []
+        self.started = threading.Semaphore(0)
+        self.release = threading.Event()
+
+    def get_slice_array(self, *task):
+        self.started.release()
+        self.release.wait()
+        self.rendered.append(task)
+
+## @brief Slices rendered ahead of a moving slider
+class PrefetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.prefetcher = SlicePrefetcher(max_slices=3)
+        self.image_file = BlockingImage()
+        self.prefetcher.set_image_file(self.image_file)
+
+    def tearDown(self):
+        self.image_file.release.set()
+        self.prefetcher.set_image_file(None)
+
+    ## @brief Move the axial slider
+    # @param value New value of the slider
+    def move(self, value):
+        self.prefetcher.observe(2, value, 20, lambda value: [(0, 2, value)])
+
+    ## @brief Wait until a number of slices are rendered, and check that no other one is
+    # @param image_file Image rendering the slices
+    # @param count Number of slices
+    def wait_rendered(self, image_file, count):
+        deadline = time.monotonic() + 5
+        while len(image_file.rendered) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        self.assertEqual(len(image_file.rendered), count)
+
+    def test_slices_ahead(self):
+        self.image_file.release.set()
+        self.move(10)
+        self.move(11)
+        self.wait_rendered(self.image_file, 3)
+        self.assertEqual(self.image_file.rendered, [(0, 2, 12), (0, 2, 13), (0, 2, 14)])
+        # not beyond the end of the slider
+        self.move(18)
+        self.move(19)
+        self.wait_rendered(self.image_file, 4)
+        self.assertEqual(self.image_file.rendered[-1], (0, 2, 20))
+
+    def test_move_cancels_pending_slices(self):
+        self.move(10)
+        self.move(11)
+        self.assertTrue(self.image_file.started.acquire(timeout=5))
+        # the slices 13 and 14 are dropped for the ones in the other direction
+        self.move(10)
+        self.image_file.release.set()
+        self.wait_rendered(self.image_file, 4)
+        self.assertEqual(self.image_file.rendered, [(0, 2, 12), (0, 2, 9), (0, 2, 8), (0, 2, 7)])
+
+    def test_image_change_cancels_pending_slices(self):
+        self.move(10)
+        self.move(11)
+        self.assertTrue(self.image_file.started.acquire(timeout=5))
+        other = BlockingImage()
+        other.release.set()
+        self.prefetcher.set_image_file(other)
+        self.image_file.release.set()
+        self.wait_rendered(self.image_file, 1)
+        self.wait_rendered(other, 0)
+        # the direction of the previous image is forgotten
+        self.move(5)
+        self.wait_rendered(other, 0)
+        self.move(4)
+        self.wait_rendered(other, 3)
+        self.assertEqual(other.rendered, [(0, 2, 3), (0, 2, 2), (0, 2, 1)])
+
+    def test_stop(self):
+        self.move(10)
+        self.move(11)
+        self.assertTrue(self.image_file.started.acquire(timeout=5))
+        self.prefetcher.set_image_file(None)
+        self.move(12)
+        self.image_file.release.set()
+        self.wait_rendered(self.image_file, 1)
+
+if __name__ == '__main__':
+    unittest.main()
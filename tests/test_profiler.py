@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+
+import numpy
+import Mimir_lib
+from tests import fixtures
+
+## @brief Statistics of the stages of the rendering
+class ProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+        random = numpy.random.RandomState(0)
+        self.image_file = Mimir_lib.Fd_data(fixtures.make_image(self.directory, (24, 20, 16, 2), 'int16', (1, 1, 1.5), False, random), lazy=True)
+        fixtures.make_annotations(self.image_file, 10, 2, random)
+
+    def tearDown(self):
+        Mimir_lib.disable_profiling()
+        self._directory.cleanup()
+
+    ## @brief Get the number of calls of each stage recorded
+    def get_counts(self):
+        return {stage: stats['count'] for stage, stats in Mimir_lib.get_profiler().get_stats().items()}
+
+    def test_disabled(self):
+        self.assertIsNone(Mimir_lib.get_profiler())
+        self.image_file.get_slice_array(0, 2, 8, 0, 1000, None)
+        profiler = Mimir_lib.enable_profiling()
+        self.assertIs(Mimir_lib.enable_profiling(), profiler)
+        self.assertEqual(profiler.get_stats(), {})
+        Mimir_lib.disable_profiling()
+        self.assertIsNone(Mimir_lib.get_profiler())
+
+    def test_render_stages(self):
+        Mimir_lib.enable_profiling()
+        array, scale = self.image_file.get_slice_array(0, 2, 8, 0, 1000, 'viridis')
+        self.assertEqual(self.get_counts(), {'read': 1, 'colormap': 1, 'overlay': 1, 'resample': 1, 'render': 1})
+        stats = Mimir_lib.get_profiler().get_stats()
+        self.assertEqual(stats['read']['bytes'], 24 * 20 * 2)
+        self.assertEqual(stats['render']['bytes'], array.nbytes)
+        self.assertEqual(stats['render']['last'], stats['render']['time'])
+        self.assertGreaterEqual(stats['render']['time'], stats['resample']['time'])
+        # no overlay stage without the points and masks
+        self.image_file.get_slice_array(0, 2, 8, 0, 1000, None, overlays=False)
+        self.assertEqual(self.get_counts(), {'read': 2, 'colormap': 2, 'overlay': 1, 'resample': 2, 'render': 2})
+
+    def test_cache_hits(self):
+        self.image_file.enable_cache()
+        Mimir_lib.enable_profiling()
+        for i in range(3):
+            self.image_file.get_slice_array(1, 0, 5, 0, 1000, None)
+        self.assertEqual(self.get_counts()['render'], 1)
+        self.assertEqual(self.get_counts()['cache_hit'], 2)
+        stats = Mimir_lib.get_profiler().pop_stats()
+        self.assertEqual(stats['cache_hit']['bytes'], 2 * stats['render']['bytes'])
+        self.assertEqual(Mimir_lib.get_profiler().get_stats(), {})
+
+    def test_export_processes(self):
+        Mimir_lib.enable_profiling()
+        tasks = [(0, 2, slice_nb, 0, 1000, None, os.path.join(self.directory, 'slices', '{}.png'.format(slice_nb)))
+                 for slice_nb in range(16)]
+        # the statistics of the processes are merged in the profiler of the main process
+        Mimir_lib.export_slices(self.image_file, tasks, jobs=2, chunk_size=3)
+        counts = self.get_counts()
+        for stage in ('read', 'render', 'encode', 'write'):
+            self.assertEqual(counts[stage], 16, stage)
+        stats = Mimir_lib.get_profiler().get_stats()
+        self.assertEqual(stats['write']['bytes'], sum(os.path.getsize(task[-1]) for task in tasks))
+
+    def test_merge(self):
+        profiler = Mimir_lib.Profiler()
+        profiler.add('render', 0.5, 10)
+        other = Mimir_lib.Profiler()
+        other.add('render', 0.25, 4)
+        other.add('encode', 0.125)
+        profiler.merge(other.get_stats())
+        self.assertEqual(profiler.get_stats(), {'render': {'count': 2, 'time': 0.75, 'bytes': 14, 'last': 0.25},
+                                                'encode': {'count': 1, 'time': 0.125, 'bytes': 0, 'last': 0.125}})
+        profiler.reset()
+        self.assertEqual(profiler.get_stats(), {})
+
+if __name__ == '__main__':
+    unittest.main()
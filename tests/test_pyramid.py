@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+
+import numpy
+import Mimir_lib
+from tests import fixtures
+
+## @brief Downsampled copies of the image used to render the slices scaled down
+class PyramidTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.min_size = Mimir_lib.PYRAMID_MIN_SIZE
+        # levels of 20 and 10 voxels for a small image
+        Mimir_lib.PYRAMID_MIN_SIZE = 8
+        random = numpy.random.RandomState(0)
+        self.path = fixtures.make_image(self._directory.name, (40, 36, 21, 2), 'int16', (1, 1, 1), False, random)
+        self.data = numpy.asarray(Mimir_lib.Fd_data(self.path).data)
+
+    def tearDown(self):
+        Mimir_lib.PYRAMID_MIN_SIZE = self.min_size
+        self._directory.cleanup()
+
+    ## @brief Get the levels of the pyramid of the layers rendered in the cache of an image
+    def get_rendered_levels(self, image_file):
+        return {key[-1] for key in image_file.cache._entries if key[0] == 'layer'}
+
+    def test_levels_are_downsampled(self):
+        image_file = Mimir_lib.Fd_data(self.path, lazy=True)
+        image_file.enable_pyramid()
+        self.assertEqual(image_file.get_pyramid_size(), 3)
+        level1 = Mimir_lib.downsample_volume(self.data)
+        self.assertEqual(level1.shape, (20, 18, 11, 2))
+        numpy.testing.assert_array_equal(image_file.get_pyramid_level(1), level1)
+        numpy.testing.assert_array_equal(image_file.get_pyramid_level(2), Mimir_lib.downsample_volume(level1))
+        self.assertFalse(os.path.exists(image_file.get_pyramid_path()))
+
+    def test_saved_levels_are_loaded(self):
+        Mimir_lib.Fd_data(self.path, lazy=True).save_pyramid()
+        image_file = Mimir_lib.Fd_data(self.path, lazy=True)
+        image_file.enable_pyramid(build=False)
+        level = image_file.get_pyramid_level(2)
+        self.assertIsInstance(level, numpy.memmap)
+        numpy.testing.assert_array_equal(level, Mimir_lib.downsample_volume(Mimir_lib.downsample_volume(self.data)))
+
+    def test_stale_levels_are_rebuilt(self):
+        Mimir_lib.Fd_data(self.path, lazy=True).save_pyramid()
+        level_path = os.path.join(Mimir_lib.Fd_data(self.path).get_pyramid_path(), 'level1.npy')
+        numpy.save(level_path, numpy.zeros((20, 18, 11, 2), dtype='int16'))
+        # the image modified after the levels were saved
+        os.utime(self.path, (os.path.getmtime(level_path) + 10,) * 2)
+        image_file = Mimir_lib.Fd_data(self.path, lazy=True)
+        image_file.enable_pyramid()
+        numpy.testing.assert_array_equal(image_file.get_pyramid_level(1), Mimir_lib.downsample_volume(self.data))
+
+    def test_max_size(self):
+        image_file = Mimir_lib.Fd_data(self.path, lazy=True)
+        image_file.enable_cache()
+        image_file.enable_pyramid()
+        for plane_nb in range(3):
+            array, scale = image_file.get_slice_array(1, plane_nb, 5, 0, 1000, 'viridis', max_size=10)
+            self.assertLessEqual(max(array.shape[:2]), 10)
+        self.assertEqual(self.get_rendered_levels(image_file), {1, 2})
+        # a slice asked larger than its size is rendered from the image
+        array, scale = image_file.get_slice_array(0, 2, 5, 0, 1000, 'viridis', max_size=100)
+        self.assertEqual(array.shape[:2], (36, 40))
+
+    def test_without_build_only_saved_levels_are_used(self):
+        image_file = Mimir_lib.Fd_data(self.path, lazy=True)
+        image_file.enable_cache()
+        image_file.enable_pyramid(build=False)
+        array, scale = image_file.get_slice_array(0, 2, 5, 0, 1000, 'viridis', max_size=10)
+        self.assertLessEqual(max(array.shape[:2]), 10)
+        self.assertEqual(self.get_rendered_levels(image_file), {0})
+        self.assertFalse(os.path.exists(image_file.get_pyramid_path()))
+
+        Mimir_lib.Fd_data(self.path, lazy=True).save_pyramid()
+        image_file.disable_pyramid()
+        image_file.enable_pyramid(build=False)
+        image_file.get_slice_array(0, 2, 6, 0, 1000, 'viridis', max_size=10)
+        self.assertEqual(self.get_rendered_levels(image_file), {0, 2})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import tempfile
+import unittest
+
+import numpy
+import Mimir_lib
+from tests import fixtures
+
+## @brief Contrast and colormap applied to the intensities of the slices
+class ContrastTest(unittest.TestCase):
+
+    def test_scale_contrast(self):
+        random = numpy.random.RandomState(0)
+        for dtype in ('uint8', 'int16', 'uint16', 'int32', 'float32', 'float64'):
+            values = (random.uniform(0, 250, (30, 40))).astype(dtype)
+            for contrast_min, contrast_max in ((0, 255), (20.5, 180.25), (-1e9, 1e9), (100, 100)):
+                scaled = Mimir_lib.scale_contrast(values, contrast_min, contrast_max)
+                self.assertEqual(scaled.dtype, numpy.uint8)
+                self.assertTrue(scaled.flags['C_CONTIGUOUS'])
+                # the values are clamped in their own type before being scaled
+                clamped = numpy.minimum(numpy.maximum(values.astype(float), contrast_min), contrast_max).astype(dtype).astype(float)
+                step = (contrast_max - contrast_min) / 255 if contrast_max != contrast_min else 1
+                numpy.testing.assert_array_equal(scaled, ((clamped - contrast_min) / step).astype(numpy.uint8))
+
+    def test_scale_contrast_keeps_values(self):
+        values = numpy.array([[-5, 0, 300, 1000]], dtype='int16')
+        Mimir_lib.scale_contrast(values, 0, 255)
+        numpy.testing.assert_array_equal(values, [[-5, 0, 300, 1000]])
+        numpy.testing.assert_array_equal(Mimir_lib.scale_contrast(values, 0, 255), [[0, 0, 255, 255]])
+
+## @brief Slices rendered by Fd_data
+class SliceTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        random = numpy.random.RandomState(0)
+        self.image_file = Mimir_lib.Fd_data(fixtures.make_image(self._directory.name, (24, 20, 16), 'int16', (1, 1, 1.5), False, random))
+        fixtures.make_annotations(self.image_file, 10, 2, random)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_slices_are_read_only(self):
+        for cache in (False, True):
+            if cache:
+                self.image_file.enable_cache()
+            for interpolation in Mimir_lib.INTERPOLATIONS:
+                for max_size in (None, 10):
+                    args = (0, 2, 8, 0, 1000, 'viridis', interpolation, True, max_size)
+                    array, scale = self.image_file.get_slice_array(*args)
+                    self.assertFalse(array.flags.writeable)
+                    with self.assertRaises(ValueError):
+                        array[0, 0] = 7
+                    numpy.testing.assert_array_equal(self.image_file.get_slice_array(*args)[0], array)
+
+if __name__ == '__main__':
+    unittest.main()
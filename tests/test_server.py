@@ -0,0 +1,118 @@
+import http.client
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy
+from PIL import Image
+import Mimir_lib
+from tests import fixtures
+import Mimir_server
+
+## @brief Responses of the slice server
+class ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        random = numpy.random.RandomState(0)
+        self.image_file = Mimir_lib.Fd_data(fixtures.make_image(self._directory.name, (40, 36, 21, 2), 'int16', (1, 1, 1), False, random), lazy=True)
+        fixtures.make_annotations(self.image_file, 10, 2, random)
+        self.image_file.enable_cache()
+        self.image_file.enable_pyramid(build=False)
+        # port 0: any free port
+        self.server = Mimir_server.SliceServer(('127.0.0.1', 0), {'bench': self.image_file}, quiet=True)
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+        self._directory.cleanup()
+
+    ## @brief Send a GET request to the server
+    # @details Return the response, with its body read
+    # @param path Path (and query) of the URL
+    # @param headers Headers of the request
+    def get(self, path, headers={}):
+        connection = http.client.HTTPConnection(*self.server.server_address[:2])
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            response.body = response.read()
+            return response
+        finally:
+            connection.close()
+
+    def test_volumes(self):
+        response = self.get('/')
+        self.assertEqual(response.status, 200)
+        self.assertEqual([volume['name'] for volume in json.loads(response.body.decode('utf-8'))['volumes']], ['bench'])
+        info = json.loads(self.get('/bench').body.decode('utf-8'))
+        self.assertEqual(info['shape'], [40, 36, 21, 2])
+        self.assertEqual((info['masks'], info['points']), (2, 10))
+
+    def test_slice(self):
+        response = self.get('/bench/1/AXI/10.png?min=0&max=1000&cmap=viridis')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('Content-Type'), 'image/png')
+        expected, scale = self.image_file.get_slice_array(1, 2, 10, 0, 1000, 'viridis')
+        numpy.testing.assert_array_equal(numpy.asarray(Image.open(io.BytesIO(response.body))), expected[:, :, :3])
+        response = self.get('/bench/1/2/10.npy?min=0&max=1000&cmap=viridis&overlays=0')
+        self.assertEqual(response.getheader('Content-Type'), 'application/octet-stream')
+        expected, scale = self.image_file.get_slice_array(1, 2, 10, 0, 1000, 'viridis', overlays=False)
+        numpy.testing.assert_array_equal(numpy.load(io.BytesIO(response.body)), expected[:, :, :3])
+
+    def test_etag(self):
+        response = self.get('/bench/0/COR/5.png')
+        etag = response.getheader('ETag')
+        self.assertIsNotNone(etag)
+        self.assertEqual(response.getheader('Cache-Control'), 'no-cache')
+        response = self.get('/bench/0/COR/5.png', {'If-None-Match': '"other", ' + etag})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.getheader('ETag'), etag)
+        self.assertEqual(response.body, b'')
+        # another contrast is another slice
+        response = self.get('/bench/0/COR/5.png?max=300', {'If-None-Match': etag})
+        self.assertEqual(response.status, 200)
+        self.assertNotEqual(response.getheader('ETag'), etag)
+
+    def test_server_timing(self):
+        timings = []
+        for i in range(2):
+            timing = self.get('/bench/0/SAG/7.webp').getheader('Server-Timing')
+            timings.append(dict(entry.strip().split(';', 1) for entry in timing.split(',')))
+        self.assertEqual([timing['cache'] for timing in timings], ['desc=miss', 'desc=hit'])
+        for name in ('render', 'encode', 'total'):
+            self.assertGreaterEqual(float(timings[0][name].split('=')[1]), 0)
+        self.assertEqual(timings[1]['render'], 'dur=0.00')
+
+    def test_size(self):
+        for plane, size in (('SAG', 36), ('COR', 40), ('AXI', 40)):
+            response = self.get('/bench/0/{}/10.png?size=10'.format(plane))
+            self.assertEqual(response.status, 200)
+            self.assertLessEqual(max(Image.open(io.BytesIO(response.body)).size), 10)
+            self.assertEqual(max(Image.open(io.BytesIO(self.get('/bench/0/{}/10.png'.format(plane)).body)).size), size)
+        # the requests never build the pyramid
+        self.assertFalse(os.path.exists(self.image_file.get_pyramid_path()))
+        self.assertEqual(self.image_file._get_ready_pyramid_size(), 1)
+
+    def test_bad_requests(self):
+        for path in ('/bench/0/AXI/x.png', '/bench/0/AXI/5.png?min=low', '/bench/0/AXI/5.png?size=0',
+                     '/bench/0/AXI/5.png?interpolation=cubic', '/bench/0/AXI/5.png?cmap=unknown'):
+            response = self.get(path)
+            self.assertEqual(response.status, 400, path)
+            self.assertIn('error', json.loads(response.body.decode('utf-8')))
+
+    def test_not_found(self):
+        for path in ('/other', '/other/0/AXI/5.png', '/bench/0/AXI/5.gif', '/bench/0/TOP/5.png', '/bench/2/AXI/5.png',
+                     '/bench/0/AXI/21.png', '/bench/0/AXI'):
+            response = self.get(path)
+            self.assertEqual(response.status, 404, path)
+            self.assertIn('error', json.loads(response.body.decode('utf-8')))
+
+if __name__ == '__main__':
+    unittest.main()
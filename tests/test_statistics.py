@@ -0,0 +1,110 @@
+import csv
+import os
+import tempfile
+import unittest
+
+import numpy
+import Mimir_lib
+from tests import fixtures
+
+## @brief Statistics of the intensities in the masks and at the points
+class StatisticsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+        random = numpy.random.RandomState(0)
+        self.image_file = Mimir_lib.Fd_data(fixtures.make_image(self.directory, (24, 20, 16, 3), 'int16', (1, 2, 1.5), False, random))
+        fixtures.make_annotations(self.image_file, 12, 3, random)
+        mask = self.image_file.masks[self.image_file.add_mask_3d(2)]
+        for slice_nb in (3, 12):
+            mask.add_points([[4, 3, slice_nb], [15, 3, slice_nb], [9, 17, slice_nb]])
+        # a mask without voxels and a point out of the image
+        self.image_file.get_mask(5)
+        self.image_file.add_point([30, 5, 5, 0], [255, 0, 0, 255])
+        self.data = numpy.asarray(self.image_file.data, dtype=float)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    ## @brief Get the voxels of the regions of the image
+    # @details Return a list of boolean volumes, the masks first
+    def get_regions(self):
+        regions = []
+        for mask in self.image_file.masks:
+            volume = numpy.zeros(self.image_file.shape[:3], dtype=bool)
+            mask.fill_volume(volume, True)
+            regions.append(volume)
+        for point in self.image_file.points:
+            volume = numpy.zeros(self.image_file.shape[:3], dtype=bool)
+            if all(0 <= point[j] < self.image_file.shape[j] for j in range(3)):
+                volume[tuple(point[:3])] = True
+            regions.append(volume)
+        return regions
+
+    def test_statistics(self):
+        stats = self.image_file.get_roi_statistics()
+        regions = self.get_regions()
+        self.assertEqual(stats['names'], ['mask {}'.format(i) for i in range(6)] + ['point {}'.format(i) for i in range(13)])
+        numpy.testing.assert_array_equal(stats['voxels'], [volume.sum() for volume in regions])
+        numpy.testing.assert_allclose(stats['volume'], stats['voxels'] * 3.0)
+        for name in ('mean', 'std', 'min', 'max'):
+            self.assertEqual(stats[name].shape, (19, 3))
+        for i, volume in enumerate(regions):
+            for cycle in range(3):
+                values = self.data[..., cycle][volume]
+                if len(values) == 0:
+                    for name in ('mean', 'std', 'min', 'max'):
+                        self.assertTrue(numpy.isnan(stats[name][i, cycle]), (name, i))
+                    continue
+                numpy.testing.assert_allclose(stats['mean'][i, cycle], values.mean(), rtol=1e-12)
+                numpy.testing.assert_allclose(stats['std'][i, cycle], values.std(), rtol=1e-9, atol=1e-9)
+                self.assertEqual(stats['min'][i, cycle], values.min())
+                self.assertEqual(stats['max'][i, cycle], values.max())
+        self.assertEqual((stats['voxels'][5], stats['voxels'][-1]), (0, 0))
+        self.assertGreater(stats['voxels'][3], 1)
+
+    def test_masks_or_points(self):
+        stats = self.image_file.get_roi_statistics()
+        masks = self.image_file.get_roi_statistics(points=False)
+        points = self.image_file.get_roi_statistics(masks=False)
+        self.assertEqual(masks['names'] + points['names'], stats['names'])
+        for name in ('voxels', 'mean', 'std', 'min', 'max'):
+            numpy.testing.assert_array_equal(numpy.concatenate((masks[name], points[name])), stats[name])
+        stats = self.image_file.get_roi_statistics(masks=False, points=False)
+        self.assertEqual(stats['names'], [])
+        self.assertEqual(stats['mean'].shape, (0, 3))
+
+    def test_save_csv(self):
+        stats = self.image_file.get_roi_statistics()
+        path = os.path.join(self.directory, 'stats.csv')
+        Mimir_lib.save_roi_statistics(stats, path)
+        with open(path, newline='') as fp:
+            rows = list(csv.reader(fp))
+        self.assertEqual(rows[0], ['roi', 'cycle', 'voxels', 'volume_mm3', 'mean', 'std', 'min', 'max'])
+        self.assertEqual(len(rows), 1 + 19 * 3)
+        for row in rows[1:]:
+            i, cycle = stats['names'].index(row[0]), int(row[1])
+            self.assertEqual(int(row[2]), stats['voxels'][i])
+            self.assertEqual(float(row[3]), stats['volume'][i])
+            for name, value in zip(('mean', 'std', 'min', 'max'), row[4:]):
+                # the values are written without loss
+                numpy.testing.assert_array_equal(float(value), stats[name][i, cycle])
+
+    def test_save_npz(self):
+        stats = self.image_file.get_roi_statistics()
+        path = os.path.join(self.directory, 'stats.npz')
+        Mimir_lib.save_roi_statistics(stats, path)
+        with numpy.load(path) as saved:
+            self.assertEqual(saved['names'].tolist(), stats['names'])
+            for name in ('voxels', 'volume', 'mean', 'std', 'min', 'max'):
+                numpy.testing.assert_array_equal(saved[name], stats[name])
+
+    def test_save_unknown_format(self):
+        path = os.path.join(self.directory, 'stats.txt')
+        with self.assertRaises(ValueError):
+            Mimir_lib.save_roi_statistics(self.image_file.get_roi_statistics(), path)
+        self.assertFalse(os.path.exists(path))
+
+if __name__ == '__main__':
+    unittest.main()